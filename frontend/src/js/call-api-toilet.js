@@ -8,8 +8,11 @@ const Settings = require('./settings-toilet.js');
  * API呼び出し規約の定義
  */
 export const apiRules = {
-  // 現況取得
-  fetchCurrentStatus: new Common.APIRule(Settings.apiServerURLBase, '/', 'GET'),
+  // 現況取得: ETag による条件付き要求を行う
+  fetchCurrentStatus: new Common.APIRule(Settings.apiServerURLBase, '/', 'GET', '', true),
+
+  // 現況の配信 (Server-Sent Events)
+  streamCurrentStatus: new Common.APIRule(Settings.apiServerURLBase, '/stream', 'GET'),
 
   // ログ取得
   fetchLogs: new Common.APIRule(Settings.apiServerURLBase, '/logs/', 'GET'),
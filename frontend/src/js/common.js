@@ -35,17 +35,27 @@ export const toggleValidMode = valid => {
  * API呼出規約クラス
  */
 export class APIRule {
-  constructor (apiServerURLBase, url, httpMethod, urlSuffix = '') {
+  constructor (apiServerURLBase, url, httpMethod, urlSuffix = '', conditional = false) {
     this.apiServerURLBase = apiServerURLBase;
     this.url = url;
     this.httpMethod = httpMethod;
     this.urlSuffix = urlSuffix;
+    this.conditional = conditional;
+
+    // 条件付き要求用: 前回の応答の ETag と本文
+    this.etag = null;
+    this.cachedJSON = null;
+  }
+
+  getURL () {
+    return `${this.apiServerURLBase}${this.url}${this.urlSuffix}`;
   }
 
   call ({ success, fail, final, loadingSpinner = true } = {}) {
     callAPI({
-      url: `${this.apiServerURLBase}${this.url}${this.urlSuffix}`,
+      url: this.getURL(),
       httpMethod: this.httpMethod,
+      rule: this.conditional ? this : null,
       success: success,
       fail: fail,
       final: final,
@@ -59,24 +69,42 @@ export class APIRule {
  *
  * @param {string} url APIのURL
  * @param {string} httpMethod HTTPメソッド名
+ * @param {APIRule} rule 条件付き要求を行う場合のAPI呼出規約 (前回の ETag と本文を保持する)
  * @param {function} success 成功時の処理
  * @param {function} fail 失敗時の処理
  * @param {function} final 終了時の共通処理
  */
-const callAPI = ({ url, httpMethod = 'GET', success, fail, final, loadingSpinner = true } = {}) => {
+const callAPI = ({ url, httpMethod = 'GET', rule = null, success, fail, final, loadingSpinner = true } = {}) => {
   if (loadingSpinner) {
     viewLoadingSpinner(true);
   }
 
+  const headers = {};
+  if (rule && rule.etag) {
+    // 前回から変化が無ければ 304 Not Modified として本文を省略させる
+    headers['If-None-Match'] = rule.etag;
+  }
+
   fetch(url,
     {
       method: httpMethod,
-      mode: 'cors'
+      mode: 'cors',
+      cache: rule ? 'no-store' : 'default',
+      headers: headers
     }
   )
     .then(response => {
+      if (rule && response.status === 304 && rule.cachedJSON !== null) {
+        return rule.cachedJSON;
+      }
       if (response.ok) {
-        return response.json();
+        return response.json().then(json => {
+          if (rule) {
+            rule.etag = response.headers.get('ETag');
+            rule.cachedJSON = json;
+          }
+          return json;
+        });
       } else {
         throw new Error(`${response.status}: サーバー側からエラーが返されました。`);
       }
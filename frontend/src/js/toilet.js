@@ -33,6 +33,11 @@ const logStepHours = 1;
  */
 const format = 'yyyymmdd';
 
+/**
+ * ログ取得APIの応答形式: 集計区間の定義を1回だけ受け取り、グラフデータはクライアント側で組み立てる
+ */
+const logFormat = 'columnar';
+
 /**
  * グラフ縦軸の軸ラベルパターン
  */
@@ -65,6 +70,11 @@ const yAxesTickOptionPatterns = {
  */
 let previousFetchedStatusCache;
 
+/**
+ * 現況の配信で最後に受け取った現況情報 (差分の適用先)
+ */
+let streamedStatus = null;
+
 // Chart.js グローバル設定
 Chart.defaults.global.defaultFontFamily =
   '"Noto Sans JP", "Hiragino Kaku Gothic ProN", "ヒラギノ角ゴ ProN W3", Meiryo, メイリオ, sans-serif';
@@ -74,8 +84,8 @@ $(() => {
   const suffix = /^page-(.*)$/g.exec(pageID)[1];
 
   if (suffix === 'toilet' && 0 < $('.js-dashboard').length) {
-    // ダッシュボード用: 自動で現況取得
-    fetchCurrentStatus(true);
+    // ダッシュボード用: 現況の配信を購読、受けられない場合は自動で定期取得
+    subscribeCurrentStatus();
   }
 });
 
@@ -87,128 +97,199 @@ $(() => {
 export const fetchCurrentStatus = (isLoop) => {
   API.apiRules.fetchCurrentStatus.call({
     loadingSpinner: false,
-    success: json => {
-      Common.toggleValidMode(true);
+    success: json => renderCurrentStatus(json),
+    fail: e => {
+      Common.toggleValidMode(false);
+    },
+    final: () => {
+      if (isLoop) {
+        // 定期的に現況を取得
+        setTimeout(() => fetchCurrentStatus(true), 5000);
+      }
+    }
+  });
+};
 
-      if (JSON.stringify(json) === previousFetchedStatusCache) {
-        console.info('取得した現況情報が前回の結果と合致しているため画面更新をスキップします。');
-        return;
+/**
+ * ダッシュボード: 現況の配信 (Server-Sent Events) を購読して画面に反映
+ * 配信を受けられない環境では定期取得に切り替えます。
+ */
+export const subscribeCurrentStatus = () => {
+  if (typeof EventSource === 'undefined') {
+    fetchCurrentStatus(true);
+    return;
+  }
+
+  let received = false;
+  const source = new EventSource(API.apiRules.streamCurrentStatus.getURL());
+
+  // 現況全体
+  source.addEventListener('status', e => {
+    received = true;
+    streamedStatus = JSON.parse(e.data);
+    renderCurrentStatus(streamedStatus);
+  });
+
+  // トイレ単位の差分
+  source.addEventListener('delta', e => {
+    received = true;
+    if (streamedStatus === null || streamedStatus.success === false) {
+      return;
+    }
+    applyStatusDelta(streamedStatus, JSON.parse(e.data));
+    renderCurrentStatus(streamedStatus);
+  });
+
+  source.onerror = () => {
+    // 一度でも受信できていれば自動再接続に任せ、それ以外は定期取得に切り替える
+    if (!received || source.readyState === EventSource.CLOSED) {
+      source.close();
+      console.warn('現況の配信を受信できないため、定期取得に切り替えます。');
+      fetchCurrentStatus(true);
+    }
+  };
+};
+
+/**
+ * 現況情報にトイレ単位の差分を適用します。
+ *
+ * @param {Object} status 現況情報
+ * @param {Object} delta トイレ単位の差分
+ */
+const applyStatusDelta = (status, delta) => {
+  for (const item of status.status) {
+    if (item.id !== delta.toilet_group_id) {
+      continue;
+    }
+
+    for (const subItem of item.details) {
+      if (subItem.id === delta.toilet_id) {
+        subItem.used = delta.used;
+        subItem.valid = delta.valid;
       }
+    }
 
-      // 今回の現況情報を保管
-      previousFetchedStatusCache = JSON.stringify(json);
+    item.used = item.details.filter(subItem => subItem.used).length;
+    item.rate100 = (0 < item.max) ? Math.floor(item.used / item.max * 100) : 0;
+  }
+};
 
-      // 画面変更を行っていることを表すために一時的にローディングスピナーを出す
-      Common.viewLoadingSpinner(true);
+/**
+ * ダッシュボード: 取得した現況情報を画面に反映
+ *
+ * @param {Object} json 現況情報
+ */
+const renderCurrentStatus = json => {
+  Common.toggleValidMode(true);
 
-      // 一定時間経過後に画面更新
-      setTimeout(() => {
-        Common.viewLoadingSpinner(false);
+  if (JSON.stringify(json) === previousFetchedStatusCache) {
+    console.info('取得した現況情報が前回の結果と合致しているため画面更新をスキップします。');
+    return;
+  }
 
-        // 既存の現況をすべてクリア
-        $('.js-status-item:not(.js-status-item-template)').remove();
+  // 今回の現況情報を保管
+  previousFetchedStatusCache = JSON.stringify(json);
 
-        if (json.success === false) {
-          // 取得できなかったときはエラー内容を出力する
-          Common.toggleValidMode(false);
-          throw new Error(`${json.message}`);
-        }
+  // 画面変更を行っていることを表すために一時的にローディングスピナーを出す
+  Common.viewLoadingSpinner(true);
 
-        let counter = -1;
-        for (const item of json.status) {
-          counter++;
+  // 一定時間経過後に画面更新
+  setTimeout(() => {
+    Common.viewLoadingSpinner(false);
 
-          const $newItem = $('.js-status-item-template')
-            .clone()
-            .removeClass('js-status-item-template d-none');
+    // 既存の現況をすべてクリア
+    $('.js-status-item:not(.js-status-item-template)').remove();
 
-          if (item.valid === true) {
-            $newItem.find('.js-status-invalid').remove();
+    if (json.success === false) {
+      // 取得できなかったときはエラー内容を出力する
+      Common.toggleValidMode(false);
+      throw new Error(`${json.message}`);
+    }
 
-            $newItem.find('.js-status-valid-collapse').attr('href', `#js-toilet-group-${counter}`);
+    let counter = -1;
+    for (const item of json.status) {
+      counter++;
+
+      const $newItem = $('.js-status-item-template')
+        .clone()
+        .removeClass('js-status-item-template d-none');
+
+      if (item.valid === true) {
+        $newItem.find('.js-status-invalid').remove();
+
+        $newItem.find('.js-status-valid-collapse').attr('href', `#js-toilet-group-${counter}`);
+
+        $newItem.find('.js-status-valid').addClass(
+          item.name.includes('男') ? 'callout-primary' : 'callout-danger'
+        );
+        $newItem.find('.js-status-name').text(item.name);
+        $newItem.find('.js-status-rate').text(item.rate100);
+        $newItem.find('.js-status-progressbar')
+          .attr('aria-valuenow', item.used)
+          .attr('aria-valuemax', item.max)
+          .css('width', `${item.rate100}%`)
+          .addClass(
+            (100 <= item.rate100) ? 'bg-danger'
+              : (50 <= item.rate100) ? 'bg-warning'
+                : 'bg-success'
+          );
+        const availableCount = item.max - item.used;
+        if (0 < availableCount) {
+          $newItem.find('.js-status-available').text(availableCount);
+        } else {
+          $newItem.find('.js-status-available').text('');
+          $newItem.find('.js-status-available-unit').text('無し');
+        }
 
-            $newItem.find('.js-status-valid').addClass(
-              item.name.includes('男') ? 'callout-primary' : 'callout-danger'
-            );
-            $newItem.find('.js-status-name').text(item.name);
-            $newItem.find('.js-status-rate').text(item.rate100);
-            $newItem.find('.js-status-progressbar')
-              .attr('aria-valuenow', item.used)
-              .attr('aria-valuemax', item.max)
-              .css('width', `${item.rate100}%`)
-              .addClass(
-                (100 <= item.rate100) ? 'bg-danger'
-                  : (50 <= item.rate100) ? 'bg-warning'
-                    : 'bg-success'
-              );
-            const availableCount = item.max - item.used;
-            if (0 < availableCount) {
-              $newItem.find('.js-status-available').text(availableCount);
-            } else {
-              $newItem.find('.js-status-available').text('');
-              $newItem.find('.js-status-available-unit').text('無し');
-            }
+        // トイレグループに属するトイレごとの仔細
+        if (0 < item.details.length) {
+          $newItem.find('.js-toilet-group-details').attr('id', `js-toilet-group-${counter}`);
+          const $details = $newItem.find('.js-toilet-group-details .js-toilet-group-details-container');
+          $details.empty();
+
+          let subCounter = -1;
+          for (const subItem of item.details) {
+            subCounter++;
 
-            // トイレグループに属するトイレごとの仔細
-            if (0 < item.details.length) {
-              $newItem.find('.js-toilet-group-details').attr('id', `js-toilet-group-${counter}`);
-              const $details = $newItem.find('.js-toilet-group-details .js-toilet-group-details-container');
-              $details.empty();
-
-              let subCounter = -1;
-              for (const subItem of item.details) {
-                subCounter++;
-
-                // 状態テキストの決定
-                let subStatus = '';
-                if (subItem.valid) {
-                  subStatus = subItem.used ? '使用中' : '空き';
-                } else {
-                  subStatus = '使用不能';
-                }
-
-                // 仔細要素を追加
-                $details.append(
-                  $('<dl />')
-                    .append(
-                      $('<dt />').text(subItem.name)
-                    )
-                    .append(
-                      $('<dd />')
-                        .text(subStatus)
-                        .addClass('my-0')
-                    ).addClass(
-                      // 末尾に下余白を付けない
-                      (item.details.length <= subCounter + 1) ? 'mb-0' : ''
-                    )
-                );
-              }
+            // 状態テキストの決定
+            let subStatus = '';
+            if (subItem.valid) {
+              subStatus = subItem.used ? '使用中' : '空き';
             } else {
-              $newItem.find('.js-toilet-group-details').remove();
+              subStatus = '使用不能';
             }
-          } else {
-            $newItem.find('.js-status-valid-collapse').remove();
-            $newItem.find('.js-status-invalid').addClass(
-              item.name.includes('男') ? 'callout-primary' : 'callout-danger'
+
+            // 仔細要素を追加
+            $details.append(
+              $('<dl />')
+                .append(
+                  $('<dt />').text(subItem.name)
+                )
+                .append(
+                  $('<dd />')
+                    .text(subStatus)
+                    .addClass('my-0')
+                ).addClass(
+                  // 末尾に下余白を付けない
+                  (item.details.length <= subCounter + 1) ? 'mb-0' : ''
+                )
             );
-            $newItem.find('.js-status-name').text(item.name);
           }
-
-          // 要素追加
-          $('.js-dashboard-valid').append($newItem);
+        } else {
+          $newItem.find('.js-toilet-group-details').remove();
         }
-      }, 250);
-    },
-    fail: e => {
-      Common.toggleValidMode(false);
-    },
-    final: () => {
-      if (isLoop) {
-        // 定期的に現況を取得
-        setTimeout(() => fetchCurrentStatus(true), 5000);
+      } else {
+        $newItem.find('.js-status-valid-collapse').remove();
+        $newItem.find('.js-status-invalid').addClass(
+          item.name.includes('男') ? 'callout-primary' : 'callout-danger'
+        );
+        $newItem.find('.js-status-name').text(item.name);
       }
+
+      // 要素追加
+      $('.js-dashboard-valid').append($newItem);
     }
-  });
+  }, 250);
 };
 
 /**
@@ -222,7 +303,7 @@ export const fetchLogs = () => {
   API.apiRules.fetchLogs.urlSuffix =
     `?begin_date=${dateformat(beginDate, format)}&end_date=${dateformat(endDate, format)}&` +
     `begin_hours_per_day=${logBeginHoursPerDay}&end_hours_per_day=${logEndHoursPerDay}&` +
-    `step_hours=${logStepHours}`;
+    `step_hours=${logStepHours}&format=${logFormat}`;
 
   API.apiRules.fetchLogs.call({
     success: json => {
@@ -239,7 +320,7 @@ export const fetchLogs = () => {
       }
 
       // 出力グラフ情報
-      const graphs = json.graphs;
+      const graphs = json.format === 'columnar' ? expandColumnarLogs(json) : json.graphs;
 
       // 系列色を生成
       const colors = palette('mpn65', graphs.length).map(hex => `#${hex}`);
@@ -302,6 +383,62 @@ export const fetchLogs = () => {
   });
 };
 
+/**
+ * 列指向形式のログ取得APIの応答を Chart.js のグラフデータに展開します。
+ *
+ * @param {Object} json 列指向形式の応答
+ * @returns {Array} グラフデータのリスト (使用頻度、占有率の順に系列の数だけ並ぶ)
+ */
+const expandColumnarLogs = json => {
+  const grid = json.grid;
+
+  // 集計区間のラベルを生成する: サーバー側と同じく、終端時間に達したら次の日へ回す
+  const labels = [];
+  const currentDate = new Date(`${grid.begin_date}T00:00:00`);
+  const beginMinutesPerDay = grid.begin_hours_per_day * 60;
+  const endMinutesPerDay = grid.end_hours_per_day * 60;
+  let currentBeginMinutes = beginMinutesPerDay;
+  while (labels.length < grid.count) {
+    const beginDate = new Date(currentDate.getTime());
+    beginDate.setMinutes(currentBeginMinutes);
+    const endDate = new Date(currentDate.getTime());
+    endDate.setMinutes(currentBeginMinutes + grid.step_minutes);
+    labels.push(`${dateformat(beginDate, 'mm-dd HH:MM')}~${dateformat(endDate, 'HH:MM')}`);
+
+    if (endMinutesPerDay <= currentBeginMinutes + grid.step_minutes) {
+      currentBeginMinutes = beginMinutesPerDay;
+      currentDate.setDate(currentDate.getDate() + 1);
+    } else {
+      currentBeginMinutes += grid.step_minutes;
+    }
+  }
+
+  // 系列名に使うサンプリング間隔の表記
+  const stepName = grid.step_minutes % 60 === 0 ? `${grid.step_minutes / 60}時間` : `${grid.step_minutes}分`;
+
+  const frequencyGraphs = json.series.map(series => ({
+    type: 'bar',
+    data: {
+      labels: labels,
+      datasets: [{
+        label: `${series.name} - ${stepName}あたりの使用頻度`,
+        data: series.frequency
+      }]
+    }
+  }));
+  const occupancyGraphs = json.series.map(series => ({
+    type: 'line',
+    data: {
+      labels: labels,
+      datasets: [{
+        label: `${series.name} - ${stepName}あたりの占有率`,
+        data: series.occupancy.map(value => value / json.occupancy_scale)
+      }]
+    }
+  }));
+  return frequencyGraphs.concat(occupancyGraphs);
+};
+
 /**
  * グラフタイトルから対応するY軸ラベルを返します。
  *
@@ -3,11 +3,10 @@
 ###############################################################################
 import sys
 import json
+import datetime
 from datetime import datetime as dt
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy.pool import SingletonThreadPool
+from sqlalchemy.orm.session import Session
 
 sys.path.insert(0, ".")
 import functions.common as Common
@@ -15,6 +14,24 @@ import functions.common as Common
 ### 定数定義
 # open/close を許可する最短呼出間隔 (秒)
 MIN_DOOR_EVENT_SPAN_SECONDS = 3
+# ドアステート切替の結果: 成功
+TRANSITION_SUCCEEDED = "succeeded"
+# ドアステート切替の結果: システムモードを取得できない
+TRANSITION_SYSTEM_MODE_UNKNOWN = "system_mode_unknown"
+# ドアステート切替の結果: システムモードが停止状態
+TRANSITION_SYSTEM_STOPPED = "system_stopped"
+# ドアステート切替の結果: 対象のトイレが存在しない
+TRANSITION_NOT_FOUND = "not_found"
+# ドアステート切替の結果: 既に切替先のステートになっている
+TRANSITION_ALREADY = "already"
+# ドアステート切替の結果: 前回更新から最短呼出間隔が経過していない
+TRANSITION_TOO_EARLY = "too_early"
+# ドアステート切替の結果: 前回更新よりも前に発生したイベント
+TRANSITION_OUT_OF_ORDER = "out_of_order"
+# ドアステート切替の結果: 同じバッチ内で重複しているイベント
+TRANSITION_DUPLICATE = "duplicate"
+# ドアステート切替の結果: イベントの形式が正しくない
+TRANSITION_INVALID = "invalid"
 # ロガーオブジェクト
 logger = Common.get_logger("action")
 
@@ -29,213 +46,303 @@ def open(event, context):
         Dict -- application/json = {
             success: True or False,
             message: 補足メッセージ,
+            reason: 失敗理由コード,  // 失敗時のみ。TRANSITION_* のいずれか
         }
     """
     toilet_id = event["toilet_id"]
-
-    from model.app_state import AppState
-    from model.toilet import Toilet
-    from model.toilet_status import ToiletStatus
     logger.info(f"[open] API Called. :toilet_id={toilet_id}")
+    return change_door_state("open", toilet_id, False)
 
-    with Common.create_session() as session:
-        current_state = Common.get_system_mode(session)
-        if current_state is None:
-            message = "システムモードを取得できませんでした。サーバー上のエラーログを確認して下さい。"
-            return {
-                "success": False,
-                "message": message
-            }
-        if current_state == Common.SYSTEM_MODE_STOP:
-            message = "システムモードが停止状態です。すべての入退室ログは記録されません。"
-            logger.info(f"[open] API Response. :success={False} "\
-                        f":message={message}")
-            return {
-                "success": False,
-                "message": message
-            }
 
-        # 現在の在室状況を取得
-        try:
-            is_closed = session \
-                .query(Toilet.is_closed) \
-                .filter(Toilet.id == toilet_id) \
-                .one() \
-                .is_closed
-        except NoResultFound:
-            message = f"トイレ #{toilet_id} が見つかりません。トイレマスター上のID設定とAPI呼び出し元のIDが合致することを確認して下さい。"
-            logger.error(f"[open] API Response. :success={False} "\
-                         f":message={message}")
-            return {
-                "success": False,
-                "message": message
-            }
+def close(event, context):
+    """トイレのドアが閉められたことを記録します。
 
-        if not is_closed:
-            message = f"トイレ #{toilet_id} は既に空室です。重複防止のため退室ログは記録されません。"
-            logger.info(f"[open] API Response. :success={False} "\
-                        f":message={message}")
-            return {
-                "success": False,
-                "message": message
-            }
+    Arguments:
+        toilet_id {int} -- ターゲットトイレID
 
-        # 現在の在室状況を更新
-        try:
-            target_toilet = session \
-                .query(Toilet) \
-                .filter(Toilet.id == toilet_id) \
-                .one()
-        except NoResultFound:
-            message = f"トイレ #{toilet_id} が見つかりません。トイレマスター上のID設定とAPI呼び出し元のIDが合致することを確認して下さい。"
-            logger.error(f"[open] API Response. :success={False} "\
-                         f":message={message}")
-            return {
-                "success": False,
-                "message": message
-            }
+    Returns:
+        Dict -- application/json = {
+            success: True or False,
+            message: 補足メッセージ,
+            reason: 失敗理由コード,  // 失敗時のみ。TRANSITION_* のいずれか
+        }
+    """
+    toilet_id = event["toilet_id"]
+    logger.info(f"[close] API Called. :toilet_id={toilet_id}")
+    return change_door_state("close", toilet_id, True)
 
-        # 前回更新からの経過時間を算出
-        timedelta = dt.now() - target_toilet.modified_time
-        if timedelta.total_seconds() < MIN_DOOR_EVENT_SPAN_SECONDS:
-            message = f"トイレ #{toilet_id} は {MIN_DOOR_EVENT_SPAN_SECONDS} 秒以内に更新されています。"\
-                      f"過剰反応防止のため、再度時間を置いてから呼び出して下さい。"
-            logger.warning(f"[open] API Response. :success={False} "\
-                         f":message={message}")
-            return {
-                "success": False,
-                "message": message
-            }
 
-        target_toilet.is_closed = False
-        target_toilet.modified_time = dt.now()
-        session.add(target_toilet)
+def events(event, context):
+    """センサーのゲートウェイ等でまとめられた複数のドアイベントを一括で記録します。
+    イベントは発生日時の順に1件ずつ開閉時と同じ規則で判定し、記録はすべて1つのトランザクションで行います。
 
-        # トイレのドアが開いたことを表すイベントをトランザクションテーブルに追加
-        session.add(ToiletStatus(
-            toilet_id=toilet_id,
-            is_closed=False,
-            created_time=dt.now()
-        ))
+    Arguments:
+        events {list} -- ドアイベントのリスト = [
+            {
+                toilet_id: 11,                        // ターゲットトイレID
+                is_closed: True or False,             // True=ドアが閉められた, False=ドアが開いた
+                occurred_at: "2020-01-01T10:00:00",   // センサー側での発生日時 (ISO 8601 形式の文字列、またはUNIX時間の秒数)
+                seq: 1,                               // センサー側の連番 (省略可)、同じトイレで重複したものは記録されない
+            },
+            ...
+        ]
+
+    Returns:
+        Dict -- application/json = {
+            success: True or False,    // リクエスト全体を処理できたかどうか
+            message: 補足メッセージ,
+            results: [                 // イベントごとの結果 (受け取った順)
+                {
+                    toilet_id: 11,
+                    seq: 1,
+                    success: True or False,
+                    reason: 失敗理由コード,  // 成功時は None。TRANSITION_* のいずれか
+                    message: 補足メッセージ,
+                },
+                ...
+            ]
+        }
+    """
+    door_events = event.get("events") if isinstance(event, dict) else event
+    if not isinstance(door_events, list):
+        message = "events にはドアイベントの配列を指定して下さい。"
+        logger.error(f"[events] API Response. :success={False} :message={message}")
+        return {
+            "success": False,
+            "message": message,
+            "results": []
+        }
+    logger.info(f"[events] API Called. :events_length={len(door_events)}")
 
+    with Common.create_session() as session:
+        results = apply_door_events(session, door_events)
         session.commit()
 
-    message = f"トイレ #{toilet_id} が空室になりました。"
-    logger.info(f"[open] API Response. :success={True} "\
-                f":message={message}")
+    succeeded_count = len([x for x in results if x["success"]])
+    message = f"{len(results)} 件中 {succeeded_count} 件のイベントを記録しました。"
+    logger.info(f"[events] API Response. :success={True} :message={message}")
     return {
         "success": True,
-        "message": message
+        "message": message,
+        "results": results
     }
 
 
-def close(event, context):
-    """トイレのドアが閉められたことを記録します。
+def change_door_state(api_name: str, toilet_id: int, is_closed: bool) -> dict:
+    """トイレのドアステートを切り替え、API応答用のデータを返します。
 
     Arguments:
+        api_name {str} -- ログ出力用のAPI名
         toilet_id {int} -- ターゲットトイレID
+        is_closed {bool} -- 切替先のステート (True=閉まった, False=開いた)
 
     Returns:
-        Dict -- application/json = {
-            success: True or False,
-            message: 補足メッセージ,
-        }
+        dict -- API応答用のデータ
     """
-    toilet_id = event["toilet_id"]
+    with Common.create_session() as session:
+        result = transit_door_state(session, toilet_id, is_closed)
+        session.commit()
 
-    from model.toilet import Toilet
-    from model.toilet_status import ToiletStatus
-    logger.info(f"[close] API Called. :toilet_id={toilet_id}")
+    message = get_transition_message(result, toilet_id, is_closed)
+    if result == TRANSITION_SUCCEEDED:
+        logger.info(f"[{api_name}] API Response. :success={True} "\
+                    f":message={message}")
+        return {
+            "success": True,
+            "message": message
+        }
 
-    with Common.create_session() as session:
-        current_state = Common.get_system_mode(session)
-        if current_state is None:
-            message = "システムモードを取得できませんでした。サーバー上のエラーログを確認して下さい。"
-            return {
-                "success": False,
-                "message": message
-            }
-        if current_state == Common.SYSTEM_MODE_STOP:
-            message = "システムモードが停止状態です。すべての入退室ログは記録されません。"
-            logger.info(f"[close] API Response. :success={False} "\
-                        f":message={message}")
-            return {
-                "success": False,
-                "message": message
-            }
+    if result in (TRANSITION_SYSTEM_MODE_UNKNOWN, TRANSITION_NOT_FOUND):
+        log = logger.error
+    elif result == TRANSITION_TOO_EARLY:
+        log = logger.warning
+    else:
+        log = logger.info
+    log(f"[{api_name}] API Response. :success={False} "\
+        f":reason={result} :message={message}")
+    return {
+        "success": False,
+        "message": message,
+        "reason": result
+    }
 
-        # 現在の在室状況を取得
-        try:
-            is_closed = session \
-                .query(Toilet.is_closed) \
-                .filter(Toilet.id == toilet_id) \
-                .one() \
-                .is_closed
-        except NoResultFound:
-            message = f"トイレ #{toilet_id} が見つかりません。トイレマスター上のID設定とAPI呼び出し元のIDが合致することを確認して下さい。"
-            logger.error(f"[close] API Response. :success={False} "\
-                         f":message={message}")
-            return {
-                "success": False,
-                "message": message
-            }
 
-        if is_closed:
-            message = f"トイレ #{toilet_id} は既に使用中です。重複防止のため入室ログは記録されません。"
-            logger.info(f"[close] API Response. :success={False} "\
-                        f":message={message}")
-            return {
-                "success": False,
-                "message": message
-            }
+def apply_door_events(session: Session, events: list) -> list:
+    """センサー側で記録された複数のドアイベントを発生日時の順に適用します。
+    ステートの判定と最短呼出間隔の判定は1件ずつ呼び出した場合と同じ規則に従い、イベントの発生日時を基準に行います。
+    コミットは呼出元で行って下さい。
 
-        # 現在の在室状況を更新
+    Arguments:
+        session {Session} -- DB接続セッション
+        events {list} -- ドアイベントのリスト [{toilet_id, is_closed, occurred_at, seq}, ...]
+
+    Returns:
+        list -- イベントごとの適用結果 (受け取った順) [{toilet_id, seq, success, reason, message}, ...]
+    """
+    now = dt.now()
+    results = [None] * len(events)
+    targets = []
+    for index, event in enumerate(events):
         try:
-            target_toilet = session \
-                .query(Toilet) \
-                .filter(Toilet.id == toilet_id) \
-                .one()
-        except NoResultFound:
-            message = f"トイレ #{toilet_id} が見つかりません。トイレマスター上のID設定とAPI呼び出し元のIDが合致することを確認して下さい。"
-            logger.error(f"[close] API Response. :success={False} "\
-                         f":message={message}")
-            return {
+            toilet_id = int(event["toilet_id"])
+            is_closed = event["is_closed"]
+            occurred_time = parse_occurred_at(event["occurred_at"])
+            seq = event.get("seq")
+            # ステートは JSON の真偽値、シーケンス番号は0以上の整数に限る ("false" などの文字列は受け付けない)
+            if not isinstance(is_closed, bool):
+                raise ValueError(f"is_closed={is_closed!r}")
+            if seq is not None and (isinstance(seq, bool) or not isinstance(seq, int) or seq < 0):
+                raise ValueError(f"seq={seq!r}")
+        except (KeyError, TypeError, ValueError, AttributeError):
+            results[index] = {
+                "toilet_id": event.get("toilet_id") if isinstance(event, dict) else None,
+                "seq": event.get("seq") if isinstance(event, dict) else None,
                 "success": False,
-                "message": message
+                "reason": TRANSITION_INVALID,
+                "message": get_transition_message(TRANSITION_INVALID, None, None)
             }
+            continue
+
+        if now < occurred_time:
+            # センサー側の時計が進んでいる場合は受信日時として扱う
+            occurred_time = now
+        targets.append((occurred_time, seq if seq is not None else -1, index, toilet_id, is_closed))
+
+    # 発生日時、同時刻であればシーケンス番号の順に適用する
+    targets.sort(key=lambda x: (x[0], x[1], x[2]))
+    applied_seqs = set()
+    for occurred_time, seq, index, toilet_id, is_closed in targets:
+        key = (toilet_id, seq)
+        if 0 <= seq and key in applied_seqs:
+            result = TRANSITION_DUPLICATE
+        else:
+            result = transit_door_state(session, toilet_id, is_closed, occurred_time)
+            applied_seqs.add(key)
+
+        results[index] = {
+            "toilet_id": toilet_id,
+            "seq": None if seq < 0 else seq,
+            "success": result == TRANSITION_SUCCEEDED,
+            "reason": None if result == TRANSITION_SUCCEEDED else result,
+            "message": get_transition_message(result, toilet_id, is_closed)
+        }
+    return results
 
-        # 前回更新からの経過時間を算出
-        timedelta = dt.now() - target_toilet.modified_time
-        if timedelta.total_seconds() < MIN_DOOR_EVENT_SPAN_SECONDS:
-            message = f"トイレ #{toilet_id} は {MIN_DOOR_EVENT_SPAN_SECONDS} 秒以内に更新されています。"\
-                      f"過剰反応防止のため、再度時間を置いてから呼び出して下さい。"
-            logger.warning(f"[close] API Response. :success={False} "\
-                         f":message={message}")
-            return {
-                "success": False,
-                "message": message
-            }
 
-        target_toilet.is_closed = True
-        target_toilet.modified_time = dt.now()
-        session.add(target_toilet)
+def parse_occurred_at(occurred_at) -> dt:
+    """ドアイベントの発生日時を解釈します。
 
-        # トイレのドアが閉められたことを表すイベントをトランザクションテーブルに追加
-        session.add(ToiletStatus(
-            toilet_id=toilet_id,
-            is_closed=True,
-            created_time=dt.now()
-        ))
+    Arguments:
+        occurred_at {int, float, str} -- UNIX時間 (秒) または ISO 8601 形式の日時文字列
 
-        session.commit()
+    Returns:
+        datetime -- 発生日時 (ローカル時刻)
+    """
+    if isinstance(occurred_at, bool):
+        raise ValueError(occurred_at)
+    if isinstance(occurred_at, (int, float)):
+        return dt.fromtimestamp(occurred_at)
 
-    message = f"トイレ #{toilet_id} が使用中になりました。"
-    logger.info(f"[close] API Response. :success={True} "\
-                f":message={message}")
-    return {
-        "success": True,
-        "message": message
-    }
+    occurred_time = dt.fromisoformat(occurred_at)
+    if occurred_time.tzinfo is not None:
+        occurred_time = occurred_time.astimezone().replace(tzinfo=None)
+    return occurred_time
+
+
+def transit_door_state(session: Session, toilet_id: int, is_closed: bool, occurred_time: dt = None) -> str:
+    """トイレのドアステートを切り替え、入退室トランザクションテーブルにイベントを追加します。
+    現在のステートと最短呼出間隔の判定は条件付きの UPDATE 1文で行うため、同時に呼び出されても二重に記録されることはありません。
+    コミットは呼出元で行って下さい。
+
+    Arguments:
+        session {Session} -- DB接続セッション
+        toilet_id {int} -- ターゲットトイレID
+        is_closed {bool} -- 切替先のステート (True=閉まった, False=開いた)
+
+    Keyword Arguments:
+        occurred_time {datetime} -- イベントの発生日時、省略時は現在日時 (default: {None})
+
+    Returns:
+        str -- 切替結果 (TRANSITION_* のいずれか)
+    """
+    from model.toilet import Toilet
+    from model.toilet_status import ToiletStatus, get_toilet_group_ids
+
+    current_state = Common.get_system_mode(session)
+    if current_state is None:
+        return TRANSITION_SYSTEM_MODE_UNKNOWN
+    if current_state == Common.SYSTEM_MODE_STOP:
+        return TRANSITION_SYSTEM_STOPPED
+
+    # 切替元のステートであり、かつ前回更新から最短呼出間隔が経過している場合に限り更新
+    now = occurred_time if occurred_time is not None else dt.now()
+    updated_count = session \
+        .query(Toilet) \
+        .filter(
+            Toilet.id == toilet_id,
+            Toilet.is_closed == (not is_closed),
+            Toilet.modified_time <= now - datetime.timedelta(seconds=MIN_DOOR_EVENT_SPAN_SECONDS)
+        ) \
+        .update({
+            Toilet.is_closed: is_closed,
+            Toilet.modified_time: now
+        }, synchronize_session=False)
+
+    if updated_count == 0:
+        # 更新できなかった場合に限り、どの条件を満たさなかったのかを調べる
+        target_toilet = session \
+            .query(Toilet.is_closed, Toilet.modified_time) \
+            .filter(Toilet.id == toilet_id) \
+            .one_or_none()
+        if target_toilet is None:
+            return TRANSITION_NOT_FOUND
+        if now < target_toilet.modified_time:
+            return TRANSITION_OUT_OF_ORDER
+        if target_toilet.is_closed == is_closed:
+            return TRANSITION_ALREADY
+        return TRANSITION_TOO_EARLY
+
+    # トイレのドアが開いた/閉められたことを表すイベントをトランザクションテーブルに追加
+    session.add(ToiletStatus(
+        toilet_id=toilet_id,
+        is_closed=is_closed,
+        created_time=now,
+        toilet_group_id=get_toilet_group_ids(session).get(toilet_id)
+    ))
+    return TRANSITION_SUCCEEDED
+
+
+def get_transition_message(result: str, toilet_id: int, is_closed: bool) -> str:
+    """ドアステートの切替結果に対応する補足メッセージを返します。
+
+    Arguments:
+        result {str} -- 切替結果 (TRANSITION_* のいずれか)
+        toilet_id {int} -- ターゲットトイレID
+        is_closed {bool} -- 切替先のステート (True=閉まった, False=開いた)
+
+    Returns:
+        str -- 補足メッセージ
+    """
+    if result == TRANSITION_SUCCEEDED:
+        return f"トイレ #{toilet_id} が使用中になりました。" if is_closed else \
+               f"トイレ #{toilet_id} が空室になりました。"
+    if result == TRANSITION_SYSTEM_MODE_UNKNOWN:
+        return "システムモードを取得できませんでした。サーバー上のエラーログを確認して下さい。"
+    if result == TRANSITION_SYSTEM_STOPPED:
+        return "システムモードが停止状態です。すべての入退室ログは記録されません。"
+    if result == TRANSITION_NOT_FOUND:
+        return f"トイレ #{toilet_id} が見つかりません。トイレマスター上のID設定とAPI呼び出し元のIDが合致することを確認して下さい。"
+    if result == TRANSITION_ALREADY:
+        return f"トイレ #{toilet_id} は既に使用中です。重複防止のため入室ログは記録されません。" if is_closed else \
+               f"トイレ #{toilet_id} は既に空室です。重複防止のため退室ログは記録されません。"
+    if result == TRANSITION_OUT_OF_ORDER:
+        return f"トイレ #{toilet_id} には発生日時よりも新しいイベントが記録されています。順序を保つためこのイベントは記録されません。"
+    if result == TRANSITION_DUPLICATE:
+        return f"トイレ #{toilet_id} に対して同じシーケンス番号のイベントが重複しています。"
+    if result == TRANSITION_INVALID:
+        return "イベントの形式が正しくありません。toilet_id, is_closed, occurred_at を指定して下さい。"
+    return f"トイレ #{toilet_id} は {MIN_DOOR_EVENT_SPAN_SECONDS} 秒以内に更新されています。"\
+           f"過剰反応防止のため、再度時間を置いてから呼び出して下さい。"
 
 
 def emergency(event, context):
@@ -251,8 +358,8 @@ def emergency(event, context):
     logger.info(f"[emergency] API Called.")
 
     with Common.create_session() as session:
-        # 現在のシステムモードを取得
-        current_state = Common.get_system_mode(session)
+        # 現在のシステムモードを取得: 反転元となるため必ずマスターから取り直す
+        current_state = Common.get_system_mode(session, use_cache=False)
         if current_state is None:
             message = "システムモードを取得できませんでした。サーバー上のエラーログを確認して下さい。"
             return {
@@ -287,6 +394,9 @@ def emergency(event, context):
 
         session.commit()
 
+    # 切替後のシステムモードでキャッシュを差し替える
+    Common.system_mode_cache.set(next_state)
+
     logger.info(f"[emergency] API Response. "\
                 f":valid={next_state} :action={next_state_name}")
 
@@ -0,0 +1,145 @@
+###############################################################################
+#    ログ取得処理で使用する集計処理を定義します。
+#    NumPy がインストールされている場合はそれを使い、無い場合は標準ライブラリーの bisect で同じ結果を求めます。
+#    サーバー版 (server/app/logs/aggregate.py) とは使う関数が異なるため、こちらにはログ取得処理が使うものだけを置きます。
+###############################################################################
+from bisect import bisect_right
+from datetime import datetime as dt
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def count_events_per_bucket(event_times: list, bucket_begins: list, bucket_ends: list) -> list:
+    """イベントの発生日時を集計区間ごとに数えます。
+    集計区間は [開始日時, 終了日時) の半開区間で、いずれも開始日時の昇順に並び、すべて同じ長さであるものとします。
+    区間どうしが重なっている場合、その両方に含まれるイベントはそれぞれの区間で数えます。
+    イベント1件あたり二分探索2回で済むため、期間を長くしても計算量はイベント数に比例したまま保たれます。
+    日時の代わりにエポックミリ秒などの整数を渡すこともできます (集計区間の境界も同じ単位の整数とします)。
+
+    Arguments:
+        event_times {list} -- イベントの発生日時のリスト (順不同)
+        bucket_begins {list} -- 集計区間の開始日時のリスト (昇順)
+        bucket_ends {list} -- 集計区間の終了日時のリスト (昇順)
+
+    Returns:
+        list -- 集計区間ごとのイベント件数
+    """
+    return sum_values_per_bucket(event_times, None, bucket_begins, bucket_ends)
+
+
+def sum_values_per_bucket(event_times: list, values: list, bucket_begins: list, bucket_ends: list) -> list:
+    """イベントごとの値を、その発生日時を含む集計区間ごとに合計します。
+    集計区間の条件は count_events_per_bucket() と同じです。
+
+    Arguments:
+        event_times {list} -- イベントの発生日時のリスト (順不同)
+        values {list} -- イベントごとの値のリスト (event_times と同じ順)、Noneの場合はすべて1として件数を数える
+        bucket_begins {list} -- 集計区間の開始日時のリスト (昇順)
+        bucket_ends {list} -- 集計区間の終了日時のリスト (昇順)
+
+    Returns:
+        list -- 集計区間ごとの合計値
+    """
+    bucket_count = len(bucket_begins)
+    if bucket_count == 0:
+        return []
+
+    # イベントを含む区間は [終了日時がイベントより後になる最初の区間, 開始日時がイベント以前になる最後の区間] の範囲となる
+    # 区間が重ならない限り範囲は1区間だけなので、範囲内の区間に直接加算しても計算量はイベント数に比例する
+    if numpy is not None and event_times:
+        times = to_microseconds_array(event_times)
+        first_indexes = numpy.searchsorted(to_microseconds_array(bucket_ends), times, side="right")
+        last_indexes = numpy.searchsorted(to_microseconds_array(bucket_begins), times, side="right")
+        lengths = numpy.maximum(last_indexes - first_indexes, 0)
+        # 範囲内の区間のインデックスを展開する: 例えば範囲 [3, 5) と [7, 8) は 3, 4, 7 となる
+        offsets = numpy.arange(lengths.sum()) - numpy.repeat(numpy.cumsum(lengths) - lengths, lengths)
+        indexes = numpy.repeat(first_indexes, lengths) + offsets
+        weights = None if values is None else numpy.repeat(numpy.asarray(values), lengths)
+        totals = numpy.bincount(indexes, weights=weights, minlength=bucket_count)
+        if weights is None or weights.dtype.kind in "biu":
+            return [int(x) for x in totals]
+        return [float(x) for x in totals]
+
+    totals = [0] * bucket_count
+    for index, event_time in enumerate(event_times):
+        value = 1 if values is None else values[index]
+        for bucket_index in range(bisect_right(bucket_ends, event_time), bisect_right(bucket_begins, event_time)):
+            totals[bucket_index] += value
+    return totals
+
+
+def sum_occupied_seconds_per_bucket(statuses: list, closed_toilet_ids: list, window_begin: dt,
+                                    bucket_begins: list, bucket_ends: list) -> list:
+    """トイレの占有秒数 (全個室の合計) を集計区間ごとに求めます。
+    期間開始時点で閉まっているトイレを起点に、入退室イベントの列を1回ずつ走査して占有秒数の累積値を区間の境界で求め、その差を区間の占有秒数とします。
+    計算量はイベント数と区間数の和に比例します。
+
+    Arguments:
+        statuses {list} -- 期間内の入退室イベント (toilet_id, is_closed, created_time を持つもの、発生日時の昇順)
+        closed_toilet_ids {list} -- 期間開始時点でドアが閉まっているトイレIDのリスト
+        window_begin {datetime} -- 期間開始日時
+        bucket_begins {list} -- 集計区間の開始日時のリスト (昇順、期間開始日時以降)
+        bucket_ends {list} -- 集計区間の終了日時のリスト (昇順)
+
+    Returns:
+        list -- 集計区間ごとの占有秒数 (全個室の合計)
+    """
+    occupied_at_begins = accumulate_occupied_seconds(statuses, closed_toilet_ids, window_begin, bucket_begins)
+    occupied_at_ends = accumulate_occupied_seconds(statuses, closed_toilet_ids, window_begin, bucket_ends)
+    return [end - begin for begin, end in zip(occupied_at_begins, occupied_at_ends)]
+
+
+def accumulate_occupied_seconds(statuses: list, closed_toilet_ids: list, window_begin: dt, points: list) -> list:
+    """期間開始日時から指定した各時点までの占有秒数 (全個室の合計) の累積値を求めます。
+    占有秒数は、その時点で閉まっているトイレの数を傾きとする折れ線として積み上げます。
+    ドアが閉められたイベントが続く場合は最初のものから占有しているものとし、
+    サーバー版がトイレ使用セッションテーブルで入室と退室を組にする規則と同じ結果になります。
+
+    Arguments:
+        statuses {list} -- 期間内の入退室イベント (toilet_id, is_closed, created_time を持つもの、発生日時の昇順)
+        closed_toilet_ids {list} -- 期間開始時点でドアが閉まっているトイレIDのリスト
+        window_begin {datetime} -- 期間開始日時
+        points {list} -- 累積値を求める時点のリスト (昇順)
+
+    Returns:
+        list -- 時点ごとの占有秒数の累積値
+    """
+    closed_ids = set(closed_toilet_ids)
+    occupied_seconds = 0.0
+    last_time = window_begin
+    index = 0
+    results = []
+    for point in points:
+        while index < len(statuses) and statuses[index].created_time <= point:
+            status = statuses[index]
+            occupied_seconds += len(closed_ids) * (status.created_time - last_time).total_seconds()
+            last_time = status.created_time
+            if status.is_closed:
+                closed_ids.add(status.toilet_id)
+            else:
+                closed_ids.discard(status.toilet_id)
+            index += 1
+        results.append(occupied_seconds + len(closed_ids) * (point - last_time).total_seconds())
+    return results
+
+
+def to_microseconds_array(values: list):
+    """日時のリストを、西暦1年1月1日からの経過マイクロ秒数を表す NumPy の整数配列に変換します。
+    datetime64 への変換よりも速く、タイムゾーンや夏時間の影響も受けません。
+    整数のリスト (エポックミリ秒など) はそのまま整数配列にするため、比較する値どうしの単位は呼出元で揃えて下さい。
+
+    Arguments:
+        values {list} -- 日時 (タイムゾーン情報無し) または整数のリスト
+
+    Returns:
+        numpy.ndarray -- 経過マイクロ秒数の配列
+    """
+    if values and isinstance(values[0], int):
+        return numpy.fromiter(values, dtype=numpy.int64, count=len(values))
+    return numpy.fromiter((
+        ((x.toordinal() * 86400 + x.hour * 3600 + x.minute * 60 + x.second) * 1000000 + x.microsecond)
+        for x in values
+    ), dtype=numpy.int64, count=len(values))
@@ -3,11 +3,15 @@
 ###############################################################################
 from datetime import datetime as dt
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.orm.session import Session
-from sqlalchemy.pool import SingletonThreadPool
+from sqlalchemy.pool import SingletonThreadPool, QueuePool, NullPool
+import os
 import sys
+import threading
+import time
 sys.path.insert(0, ".")
 
 ### ロギング設定ロード
@@ -20,6 +24,38 @@ import configparser
 config = configparser.ConfigParser()
 config.read("./settings.ini", "UTF-8")
 
+# 環境変数から設定値を上書きする際の接頭辞
+SETTINGS_ENV_PREFIX = "DOOR_WATCHER_"
+
+
+def get_setting(section: str, key: str, default=None, type=str):
+    """アプリケーション設定値を取得します。
+    環境変数 (DOOR_WATCHER_ + セクション名_キー名を大文字にしたもの) が定義されていればそれを優先し、
+    次いで settings.ini の該当セクション、いずれも無ければ既定値を返します。
+
+    Arguments:
+        section {str} -- セクション名 (例: db)
+        key {str} -- 設定キー名 (例: echo)
+
+    Keyword Arguments:
+        default {any} -- 既定値 (default: {None})
+        type {type} -- 変換先の型 (str, int, float, bool) (default: {str})
+
+    Returns:
+        any -- 設定値
+    """
+    env_name = f"{SETTINGS_ENV_PREFIX}{section}_{key}".upper()
+    value = os.environ.get(env_name)
+    if value is None:
+        value = config.get(section, key, fallback=None)
+    if value is None:
+        return default
+
+    if type is bool:
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return type(value)
+
+
 # MySQL接続文字列
 DB_HOST = config.get("db", "host")
 DB_DATABASE = config.get("db", "database")
@@ -40,16 +76,135 @@ SYSTEM_MODE_STOP = False
 SYSTEM_MODE_RUNNING = True
 
 
+# 既定のDB接続先名
+DEFAULT_ENGINE_NAME = "db"
+# 集計・分析用のDB接続先名 (settings.ini の [analytics] セクションで読み取り用のエンドポイントを指定できる)
+ANALYTICS_ENGINE_NAME = "analytics"
+# 設定値から選択可能なコネクションプール方式
+POOL_CLASSES = {
+    "SingletonThreadPool": SingletonThreadPool,
+    "QueuePool": QueuePool,
+    "NullPool": NullPool,
+}
+
+
+class EngineRegistry(object):
+    """DBエンジン、およびセッション生成器をコンテナー内で共有するレジストリークラスです。
+    ウォームスタートした Lambda の呼出では前回生成したエンジンとMySQL接続をそのまま使い回します。
+    """
+
+    def __init__(self):
+        self.engines = {}
+        self.session_makers = {}
+        self.lock = threading.Lock()
+
+    def get_engine(self, name: str = DEFAULT_ENGINE_NAME) -> Engine:
+        """接続先名に対応するDBエンジンを返します。未生成の場合はこの時点で生成します。
+
+        Keyword Arguments:
+            name {str} -- 接続先名、settings.ini のセクション名を兼ねる (default: {DEFAULT_ENGINE_NAME})
+
+        Returns:
+            Engine -- DBエンジン
+        """
+        engine = self.engines.get(name)
+        if engine is not None:
+            return engine
+
+        with self.lock:
+            if name not in self.engines:
+                self.engines[name] = self.create_engine(name)
+                self.session_makers[name] = sessionmaker(bind=self.engines[name])
+            return self.engines[name]
+
+    def get_session_maker(self, name: str = DEFAULT_ENGINE_NAME) -> sessionmaker:
+        """接続先名に対応するセッション生成器を返します。
+
+        Keyword Arguments:
+            name {str} -- 接続先名 (default: {DEFAULT_ENGINE_NAME})
+
+        Returns:
+            sessionmaker -- セッション生成器
+        """
+        if name not in self.session_makers:
+            self.get_engine(name)
+        return self.session_makers[name]
+
+    def create_engine(self, name: str) -> Engine:
+        """設定値に従ってDBエンジンを新たに生成します。
+
+        Arguments:
+            name {str} -- 接続先名
+
+        Returns:
+            Engine -- DBエンジン
+        """
+        echo = get_setting(name, "echo", False, type=bool)
+        pool_class_name = get_setting(name, "poolclass", "SingletonThreadPool")
+        if pool_class_name not in POOL_CLASSES:
+            raise ValueError(f"[{name}] poolclass={pool_class_name} は未対応のコネクションプール方式です。")
+        pool_class = POOL_CLASSES[pool_class_name]
+
+        options = {
+            "echo": echo,
+            "poolclass": pool_class,
+            "pool_recycle": get_setting(name, "pool_recycle", 60, type=int),
+            "pool_pre_ping": get_setting(name, "pool_pre_ping", True, type=bool),
+        }
+        if pool_class is QueuePool:
+            options["pool_size"] = get_setting(name, "pool_size", 1, type=int)
+            options["max_overflow"] = get_setting(name, "max_overflow", 0, type=int)
+
+        get_logger(__name__).info(f"[create_engine] :name={name} :poolclass={pool_class_name} :echo={echo}")
+        return create_engine(get_db_path(name), **options)
+
+    def dispose(self):
+        """生成済みのDBエンジンをすべて破棄します。
+        """
+        with self.lock:
+            for engine in self.engines.values():
+                engine.dispose()
+            self.engines.clear()
+            self.session_makers.clear()
+
+
+def get_db_path(name: str) -> str:
+    """接続先名に対応するMySQL接続文字列を返します。
+    接続先名と同名のセクションに host, database, user, password を指定した場合はそれを使い、無いものは [db] セクションの値とします。
+    集計・分析用の接続先 ([analytics]) に読み取り用のエンドポイントを指定すると、集計の読み取りを書き込み用のインスタンスから切り離せます。
+
+    Arguments:
+        name {str} -- 接続先名
+
+    Returns:
+        str -- MySQL接続文字列
+    """
+    if name == DEFAULT_ENGINE_NAME:
+        return DB_PATH
+    host = get_setting(name, "host", DB_HOST)
+    database = get_setting(name, "database", DB_DATABASE)
+    user = get_setting(name, "user", DB_USER)
+    password = get_setting(name, "password", DB_PASSWORD)
+    return f"mysql+mysqlconnector://{user}:{password}@{host}/{database}?charset={DB_CHARSET}"
+
+
+# コンテナー内で共有するDBエンジンレジストリー
+engine_registry = EngineRegistry()
+
+
 class SessionFactory(object):
     """DB接続セッションを生成するファクトリークラスです。
     """
 
-    def __init__(self, echo=False):
-        self.engine = create_engine(DB_PATH, echo=echo, poolclass=SingletonThreadPool, pool_recycle=60)
+    def __init__(self, name=DEFAULT_ENGINE_NAME):
+        self.name = name
+
+    @property
+    def engine(self) -> Engine:
+        return engine_registry.get_engine(self.name)
 
     def create(self) -> Session:
-        Session = sessionmaker(bind=self.engine)
-        return Session()
+        return engine_registry.get_session_maker(self.name)()
 
 
 class SessionContext(object):
@@ -73,45 +228,106 @@ class SessionContextFactory(object):
     """with構文 に対応したDB接続セッションを生成するファクトリークラスです。
     """
 
-    def __init__(self, echo=False):
-        self.session_factory = SessionFactory(echo=echo)
+    def __init__(self, name=DEFAULT_ENGINE_NAME):
+        self.session_factory = SessionFactory(name=name)
 
     def create(self) -> SessionContext:
         return SessionContext(self.session_factory.create())
 
 
-def create_session() -> SessionContext:
+def create_session(name: str = DEFAULT_ENGINE_NAME) -> SessionContext:
     """DB接続セッションを作成します。
     この関数の戻り値を受け取る呼出元変数は with構文 を用いて自動クローズの対象とすることを推奨します。
 
+    Keyword Arguments:
+        name {str} -- 接続先名、集計・分析の読み取りには ANALYTICS_ENGINE_NAME を指定する (default: {DEFAULT_ENGINE_NAME})
+
     Returns:
         Session -- DB接続セッション
     """
-    return SessionContextFactory(echo=True).create()
+    return SessionContextFactory(name=name).create()
 
 
-def get_system_mode(session: Session) -> int:
-    """現在のシステムモードをアプリケーション状態マスターから取得します。
+class SystemModeCache(object):
+    """システムモードをプロセス内に保持するキャッシュクラスです。
+    システムモードは緊急停止APIでしか変化しないため、切替時に明示的に更新し、
+    他のプロセスで切り替えられた場合に備えて有効期限切れ後はマスターから取り直します。
+    """
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self.state = None
+        self.expires_at = 0.0
+        self.lock = threading.Lock()
+
+    def get(self):
+        """有効期限内のシステムモードを返します。
+
+        Returns:
+            int -- システムモード、キャッシュされていないか有効期限切れの場合はNone
+        """
+        with self.lock:
+            if self.state is None or self.expires_at <= time.monotonic():
+                return None
+            return self.state
+
+    def set(self, state):
+        """システムモードをキャッシュします。
+
+        Arguments:
+            state {int} -- システムモード
+        """
+        with self.lock:
+            self.state = state
+            self.expires_at = time.monotonic() + self.ttl_seconds
+
+    def invalidate(self):
+        """キャッシュを破棄し、次回はマスターから取り直すようにします。
+        """
+        with self.lock:
+            self.state = None
+            self.expires_at = 0.0
+
+
+# プロセス内で共有するシステムモードキャッシュ
+system_mode_cache = SystemModeCache(get_setting("system_mode", "cache_ttl_seconds", 5.0, type=float))
+
+
+def get_system_mode(session: Session, use_cache: bool = True) -> int:
+    """現在のシステムモードを返します。
+    キャッシュが有効であればそれを返し、そうでなければアプリケーション状態マスターから取得してキャッシュします。
 
     Arguments:
         session {Session} -- DB接続セッション
 
+    Keyword Arguments:
+        use_cache {bool} -- キャッシュを参照するかどうか (default: {True})
+
     Returns:
         int -- システムモード (SYSTEM_MODE_STOP=停止, SYSTEM_MODE_RUNNING=稼働), マスターデータを取得できなかった場合はNone
     """
     from model.app_state import AppState
     logger = get_logger(__name__)
 
+    if use_cache:
+        state = system_mode_cache.get()
+        if state is not None:
+            return state
+
     try:
-        return session \
+        state = session \
             .query(AppState.state) \
             .filter(AppState.id == SYSTEM_MODE_APP_STATE_ID) \
             .one() \
             .state
     except NoResultFound:
         logger.error("Method Error. [get_system_mode] アプリケーション状態マスター id={1} のレコードが設定されていません")
+        system_mode_cache.invalidate()
         return None
 
+    system_mode_cache.set(state)
+    return state
+
 
 def get_logger(name: str) -> logging.Logger:
     """指定したモジュール名でロガーオブジェクトを生成します。
@@ -10,6 +10,7 @@ from sqlalchemy.orm.exc import NoResultFound
 
 sys.path.insert(0, ".")
 import functions.common as Common
+from functions.aggregate import count_events_per_bucket, sum_occupied_seconds_per_bucket
 
 ### 定数定義
 # ロガーオブジェクト
@@ -90,40 +91,7 @@ def status(event, context):
             .all()
 
         # 返却用の形式に変換
-        result = {"status": []}
-        for i, toilet_group in enumerate(toilet_groups):
-            result["status"].append({
-                "name": toilet_group.ToiletGroup.name,
-                "valid": toilet_group.ToiletGroup.valid,
-                "max": toilet_group.max
-            })
-
-            result["status"][-1]["used"] = 0
-            result["status"][-1]["rate100"] = 0
-            result["status"][-1]["details"] = []
-
-            if not toilet_group.ToiletGroup.valid:
-                # このトイレグループ全体が無効になっている
-                continue
-            if toilet_group.max == 0:
-                # このトイレグループに紐づくトイレが存在しない
-                continue
-
-            # このグループ内の個々のトイレの仔細をデータに加える
-            for n, toilet in enumerate(toilets):
-                if toilet.ToiletGroupMap.toilet_group_id != toilet_group.ToiletGroup.id:
-                    continue
-                if toilet.Toilet.is_closed:
-                    result["status"][-1]["used"] += 1
-
-                result["status"][-1]["details"].append({
-                    "name": toilet.Toilet.name,
-                    "used": toilet.Toilet.is_closed,
-                    "valid": toilet.Toilet.valid
-                })
-
-            result["status"][-1]["rate100"] = \
-                int(result["status"][-1]["used"] / toilet_group.max * 100)
+        result = {"status": assemble_status(toilet_groups, toilets)}
 
     result["success"] = True
     result["message"] = ""
@@ -131,6 +99,62 @@ def status(event, context):
     return result
 
 
+def assemble_status(toilet_groups: list, toilets: list) -> list:
+    """トイレグループマスターとトイレマスターの取得結果から、トイレグループごとの在室状況を組み立てます。
+    トイレは先にトイレグループIDごとに振り分けておくため、処理量はトイレグループ数とトイレ数の和に比例します。
+
+    Arguments:
+        toilet_groups {list} -- トイレグループマスターの取得結果 (ToiletGroup, ToiletGroupMap, max)
+        toilets {list} -- トイレマスターの取得結果 (Toilet, ToiletGroupMap)、トイレID順
+
+    Returns:
+        list -- トイレグループごとの在室状況
+    """
+    # トイレグループIDごとにトイレを振り分ける
+    toilets_by_group = {}
+    for toilet in toilets:
+        if toilet.ToiletGroupMap is None:
+            # いずれのトイレグループにも属していない
+            continue
+        toilets_by_group.setdefault(toilet.ToiletGroupMap.toilet_group_id, []).append(toilet.Toilet)
+
+    # 返却用の形式に変換
+    status = []
+    for toilet_group in toilet_groups:
+        status.append({
+            "name": toilet_group.ToiletGroup.name,
+            "valid": toilet_group.ToiletGroup.valid,
+            "max": toilet_group.max,
+            "used": 0,
+            "rate100": 0,
+            "details": []
+        })
+
+        if not toilet_group.ToiletGroup.valid:
+            # このトイレグループ全体が無効になっている
+            continue
+        if toilet_group.max == 0:
+            # このトイレグループに紐づくトイレが存在しない
+            continue
+
+        # このグループ内の個々のトイレの仔細をデータに加える
+        details = status[-1]["details"]
+        used = 0
+        for toilet in toilets_by_group.get(toilet_group.ToiletGroup.id, []):
+            if toilet.is_closed:
+                used += 1
+            details.append({
+                "name": toilet.name,
+                "used": toilet.is_closed,
+                "valid": toilet.valid
+            })
+
+        status[-1]["used"] = used
+        status[-1]["rate100"] = int(used / toilet_group.max * 100)
+
+    return status
+
+
 def log(event, context):
     """指定期間、および日当たりそれぞれの時間帯におけるすべてのトイレの使用回数を表す Chart.js グラフ用データを返します。
     このAPIでは、ドアが閉じられた回数をもとに集計します。
@@ -224,7 +248,8 @@ def log(event, context):
     # 日付計算の都合上、終端日時は 24:00 とする
     end_datetime = end_datetime + datetime.timedelta(hours=24)
 
-    with Common.create_session() as session:
+    # 集計のための読み取りは集計・分析用の接続先 (読み取り用のエンドポイントを指定できる) で行う
+    with Common.create_session(Common.ANALYTICS_ENGINE_NAME) as session:
         # トイレマスターを取得
         toilets = session \
             .query( \
@@ -262,6 +287,48 @@ def log(event, context):
                 "message": message
             }
 
+        # トイレIDごとの所属トイレグループIDを求めておく
+        group_ids_by_toilet = {}
+        for x in toilets:
+            if x.ToiletGroupMap is not None:
+                group_ids_by_toilet.setdefault(x.Toilet.id, []).append(x.ToiletGroupMap.toilet_group_id)
+
+        # 区間内のトイレ入退室トランザクションを全グループ分まとめて1回で取得し、トイレグループごとに振り分ける
+        # ORMオブジェクトは生成せず、集計に必要な列だけをタプルで受け取る
+        statuses_by_group = {}
+        for target_status in session \
+                .query(
+                    ToiletStatus.toilet_id,
+                    ToiletStatus.is_closed,
+                    ToiletStatus.created_time
+                ) \
+                .filter(
+                    begin_datetime <= ToiletStatus.created_time,
+                    ToiletStatus.created_time < end_datetime
+                ) \
+                .order_by(asc(ToiletStatus.created_time)) \
+                .all():
+            for group_id in group_ids_by_toilet.get(target_status.toilet_id, []):
+                statuses_by_group.setdefault(group_id, []).append(target_status)
+
+        # 区間の開始時点で各トイレが使用中だったかどうかを、開始日時より前の直近のイベントから求める
+        # トイレごとに (toilet_id, created_time) の降順で1件だけ引く相関サブクエリとし、1回の問い合わせで済ませる
+        last_is_closed = session \
+            .query(ToiletStatus.is_closed) \
+            .filter(
+                ToiletStatus.toilet_id == Toilet.id,
+                ToiletStatus.created_time < begin_datetime
+            ) \
+            .order_by(desc(ToiletStatus.created_time), desc(ToiletStatus.id)) \
+            .limit(1) \
+            .correlate(Toilet) \
+            .as_scalar()
+        initially_closed_toilet_ids = set([
+            x.id
+            for x in session.query(Toilet.id, last_is_closed.label("is_closed")).all()
+            if x.is_closed
+        ])
+
         ##### 使用頻度 (抽出開始時刻よりも前から継続して入室中だったデータはカウント対象に含まれないので注意) #####
         # 横軸ラベルを生成
         graphs = []
@@ -291,6 +358,9 @@ def log(event, context):
                 current_begin_hours += step_hours
             current_end_hours = current_begin_hours + step_hours
 
+        bucket_begins = [x["begin"] for x in target_begin_and_end_pairs]
+        bucket_ends = [x["end"] for x in target_begin_and_end_pairs]
+
         # 系列ごとにグラフデータを分けて作成
         for i, series_toilet in enumerate(grouped_toilets):
             graph = {
@@ -308,44 +378,24 @@ def log(event, context):
             target_toilets_id_list = [
                 x.Toilet.id
                 for x in toilets
-                if x.ToiletGroupMap.toilet_group_id == series_toilet.ToiletGroupMap.toilet_group_id
+                if x.ToiletGroupMap is not None and x.ToiletGroupMap.toilet_group_id == series_toilet.ToiletGroup.id
             ]
 
-            # この系列に属するトイレ入退室トランザクションテーブルで区間内に該当するレコードを抽出
-            target_statuses_all = session \
-                .query(ToiletStatus) \
-                .filter(
-                    begin_datetime <= ToiletStatus.created_time,
-                    ToiletStatus.created_time < end_datetime,
-                    ToiletStatus.toilet_id.in_(target_toilets_id_list)
-                ) \
-                .order_by(asc(ToiletStatus.created_time)) \
-                .all()
-
-            # 先頭のサンプリング時間から順にドアクローズイベントの件数を抽出していく
-            data_frequency = []
-            start_index = 0
-            for one_of_begin_and_end_pairs in target_begin_and_end_pairs:
-                sampling_count = 0
-
-                for n, target_status in enumerate(target_statuses_all[start_index:]):
-                    if one_of_begin_and_end_pairs["begin"] <= target_status.created_time and \
-                            target_status.created_time < one_of_begin_and_end_pairs["end"] and \
-                            target_status.is_closed:
-                        # 対象区間内の入室記録であればカウント
-                        sampling_count += 1
-                    elif one_of_begin_and_end_pairs["end"] <= target_status.created_time:
-                        # 対象区間から出た時点で抜ける
-                        start_index = n
-                        break
-
-                data_frequency.append(sampling_count)
+            # この系列に属するトイレ入退室トランザクションのうち区間内に該当するレコード
+            target_statuses_all = statuses_by_group.get(series_toilet.ToiletGroup.id, [])
+
+            # サンプリング時間ごとにドアクローズイベントの件数を数える
+            data_frequency = count_events_per_bucket(
+                [x.created_time for x in target_statuses_all if x.is_closed],
+                bucket_begins,
+                bucket_ends
+            )
 
             # 出来上がったグラフデータをグラフリストに格納
             graph["data"]["datasets"][0]["data"] = data_frequency
             graphs.append(graph)
 
-        ##### 占有率 (抽出開始時刻よりも前から継続して入室中だったデータはカウント対象に含まれないので注意) #####
+        ##### 占有率 (抽出開始時刻よりも前から継続して入室中だったものは、その開始時刻から占有しているものとして扱う) #####
         # 系列ごとにグラフデータを分けて作成
         for i, series_toilet in enumerate(grouped_toilets):
             graph = {
@@ -363,77 +413,30 @@ def log(event, context):
             target_toilets_id_list = [
                 x.Toilet.id
                 for x in toilets
-                if x.ToiletGroupMap.toilet_group_id == series_toilet.ToiletGroupMap.toilet_group_id
+                if x.ToiletGroupMap is not None and x.ToiletGroupMap.toilet_group_id == series_toilet.ToiletGroup.id
             ]
 
-            # この系列に属するトイレ入退室トランザクションテーブルで区間内に該当するレコードを抽出
-            target_statuses_all = session \
-                .query(ToiletStatus) \
-                .filter(
-                    begin_datetime <= ToiletStatus.created_time,
-                    ToiletStatus.created_time < end_datetime,
-                    ToiletStatus.toilet_id.in_(target_toilets_id_list)
-                ) \
-                .order_by(asc(ToiletStatus.created_time)) \
-                .all()
-
-            data_occupancy = []
-            start_index = 0
+            # この系列に属するトイレ入退室トランザクションのうち区間内に該当するレコード
+            target_statuses_all = statuses_by_group.get(series_toilet.ToiletGroup.id, [])
 
             # 個室1室あたりが最大占有率になる時間秒数
             max_occupancy_time = step_hours * 60 * 60
 
-            # トイレIDごとに直前に入室した時刻を記憶できるようにしておく
-            temp_last_start_times = {
-                x: None
-                for x in target_toilets_id_list
-            }
+            # イベントの列を1回だけ走査して、サンプリング時間ごとの個室全体の占有時間累計秒数を求める
+            occupied_times = sum_occupied_seconds_per_bucket(
+                target_statuses_all,
+                [x for x in target_toilets_id_list if x in initially_closed_toilet_ids],
+                begin_datetime,
+                bucket_begins,
+                bucket_ends
+            )
 
-            # 先頭のサンプリング時間から順に抽出していく
-            for m, one_of_begin_and_end_pairs in enumerate(target_begin_and_end_pairs):
-                # 抽出対象区間をまたいで占有している場合は現在の抽出開始時刻に合わせておく
-                temp_last_start_times = {
-                    x: None if temp_last_start_times[x] is None else one_of_begin_and_end_pairs["begin"]
-                    for x in target_toilets_id_list
-                }
-
-                # 抽出対象区間内における個室ごとの占有時間累計秒数
-                occupied_times = {
-                    x: 0
-                    for x in target_toilets_id_list
-                }
-
-                for n, target_status in enumerate(target_statuses_all[start_index:]):
-                    if one_of_begin_and_end_pairs["begin"] <= target_status.created_time and \
-                            target_status.created_time < one_of_begin_and_end_pairs["end"]:
-                        if target_status.is_closed:
-                            # 対象区間内の入室記録にヒットしたら占有時間の計算を開始する
-                            temp_last_start_times[target_status.toilet_id] = target_status.created_time
-                        elif temp_last_start_times[target_status.toilet_id] is not None:
-                            # 対象区間内の退室記録にヒットしたら占有時間の計算を完了する
-                            time_delta = target_status.created_time - temp_last_start_times[target_status.toilet_id]
-                            occupied_times[target_status.toilet_id] += time_delta.total_seconds()
-                            temp_last_start_times[target_status.toilet_id] = None
-                    elif one_of_begin_and_end_pairs["end"] <= target_status.created_time:
-                        # 抽出対象区間から抜けたらその時間の集計を完了する
-                        start_index = n
-
-                        # 抽出対象区間の終端まで入室中だったものはその終端で区切る
-                        for id, last_start_time in temp_last_start_times.items():
-                            if last_start_time is not None:
-                                time_delta = one_of_begin_and_end_pairs["end"] - temp_last_start_times[target_status.toilet_id]
-                                occupied_times[target_status.toilet_id] += time_delta.total_seconds()
-                                # NOTE: 次の抽出対象区間に回った後にその抽出開始時刻で占有時間の計算を開始する
-
-                        break
-
-                # トイレグループ内の個室ごとの占有時間を理論上のMAX占有時間で割った割合について、トイレグループ内の個室全体で相加平均したものをこのトイレグループの占有率とする
-                data_occupancy.append(
-                  sum([
-                    (occupied_time / max_occupancy_time)
-                    for x, occupied_time in occupied_times.items()
-                  ]) / len(occupied_times)
-                )
+            # トイレグループ内の個室ごとの占有時間を理論上のMAX占有時間で割った割合について、トイレグループ内の個室全体で相加平均したものをこのトイレグループの占有率とする
+            # 個室が1つも紐付いていないトイレグループは常に0とする
+            data_occupancy = [
+                occupied_time / max_occupancy_time / len(target_toilets_id_list) if target_toilets_id_list else 0
+                for occupied_time in occupied_times
+            ]
 
             # 出来上がったグラフデータをグラフリストに格納
             graph["data"]["datasets"][0]["data"] = data_occupancy
@@ -2,17 +2,65 @@
 #    トイレの在室ログを表すテーブルの定義
 ###############################################################################
 from model import Base
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index, select, asc, desc
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql.schema import Column
 from sqlalchemy.sql.sqltypes import Integer, Text, Boolean, DateTime
 
 
+def get_toilet_group_ids(session) -> dict:
+    """トイレIDごとに紐付くトイレグループIDを返します。
+    複数のトイレグループに紐付いている場合は、最初に紐付けたものとします。
+    同じDB接続セッションの中では1回だけ読み込むため、まとめて登録する場合もトイレグループ紐付け用マスターへの問い合わせは1回で済みます。
+
+    Arguments:
+        session {Session} -- DB接続セッション
+
+    Returns:
+        dict -- トイレID -> トイレグループID
+    """
+    from model.toilet_group_map import ToiletGroupMap
+    toilet_group_ids = session.info.get("toilet_group_ids")
+    if toilet_group_ids is None:
+        # 紐付けた順の逆に読み込み、最初に紐付けたもので上書きする
+        toilet_group_ids = {}
+        for x in session \
+                .query(ToiletGroupMap.toilet_id, ToiletGroupMap.toilet_group_id) \
+                .order_by(desc(ToiletGroupMap.id)) \
+                .all():
+            toilet_group_ids[x.toilet_id] = x.toilet_group_id
+        session.info["toilet_group_ids"] = toilet_group_ids
+    return toilet_group_ids
+
+
+def default_toilet_group_id(context) -> int:
+    """トイレグループIDの既定値として、同じ行のトイレIDに紐付くトイレグループIDを求めます。
+    登録時に指定しなかった場合に限って1行ごとに問い合わせるため、ドアイベントの記録では get_toilet_group_ids() で求めて指定して下さい。
+    複数のトイレグループに紐付いている場合は、最初に紐付けたものとします。
+    """
+    from model.toilet_group_map import ToiletGroupMap
+    toilet_id = context.get_current_parameters().get("toilet_id")
+    return context.connection.execute(
+        select([ToiletGroupMap.toilet_group_id])
+        .where(ToiletGroupMap.toilet_id == toilet_id)
+        .order_by(asc(ToiletGroupMap.id))
+        .limit(1)
+    ).scalar()
+
+
 """トイレ入退室トランザクションテーブル
 """
 class ToiletStatus(Base):
     __tablename__ = "toilet_status"
-    __table_args__ = {"extend_existing": True}
+    __table_args__ = (
+        # 発生日時の範囲で絞り込み、発生日時の順に並べる集計用 (テーブルを参照せずに済むよう、集計に使う列をすべて含める)
+        Index("ix_toilet_status_created_time", "created_time", "toilet_id", "is_closed"),
+        # トイレごとに直前のイベントを求める、トイレごとに発生日時の順に走査する用
+        Index("ix_toilet_status_toilet_id_created_time", "toilet_id", "created_time", "is_closed"),
+        # トイレグループごとに発生日時の範囲で絞り込む集計用
+        Index("ix_toilet_status_toilet_group_id_created_time", "toilet_group_id", "created_time", "is_closed"),
+        {"extend_existing": True}
+    )
 
     # 固有のID
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -25,3 +73,8 @@ class ToiletStatus(Base):
 
     # レコード作成日時
     created_time = Column(DateTime, nullable=False)
+
+    # トイレグループID (トイレグループ紐付け用マスターの写し)
+    # 集計時にトイレグループ紐付け用マスターを参照せずに済ませるためのもので、登録時に指定しなかった場合はトイレIDから自動で求める
+    # 紐付けが変わった場合は、DB側のトリガーで過去のレコードも含めて付け替えるため、外部キーにはしない
+    toilet_group_id = Column(Integer, nullable=True, default=default_toilet_group_id)
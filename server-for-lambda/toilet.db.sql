@@ -38,8 +38,12 @@ CREATE TABLE IF NOT EXISTS toilet_status (
 	toilet_id	INTEGER NOT NULL,
 	is_closed	BOOLEAN NOT NULL,
 	created_time	TIMESTAMP NOT NULL,
+	toilet_group_id	INTEGER,
 	PRIMARY KEY(id),
-	FOREIGN KEY(toilet_id) REFERENCES toilet(id)
+	FOREIGN KEY(toilet_id) REFERENCES toilet(id),
+	INDEX ix_toilet_status_created_time (created_time, toilet_id, is_closed),
+	INDEX ix_toilet_status_toilet_id_created_time (toilet_id, created_time, is_closed),
+	INDEX ix_toilet_status_toilet_group_id_created_time (toilet_group_id, created_time, is_closed)
 );
 
 CREATE TABLE IF NOT EXISTS toilet_group_map (
@@ -51,6 +55,13 @@ CREATE TABLE IF NOT EXISTS toilet_group_map (
 	FOREIGN KEY(toilet_group_id) REFERENCES toilet_group(id)
 );
 
+CREATE TRIGGER tr_toilet_group_map_insert AFTER INSERT ON toilet_group_map FOR EACH ROW
+	UPDATE toilet_status SET toilet_group_id = (SELECT m.toilet_group_id FROM toilet_group_map m WHERE m.toilet_id = toilet_status.toilet_id ORDER BY m.id LIMIT 1) WHERE toilet_id IN (NEW.toilet_id);
+CREATE TRIGGER tr_toilet_group_map_update AFTER UPDATE ON toilet_group_map FOR EACH ROW
+	UPDATE toilet_status SET toilet_group_id = (SELECT m.toilet_group_id FROM toilet_group_map m WHERE m.toilet_id = toilet_status.toilet_id ORDER BY m.id LIMIT 1) WHERE toilet_id IN (OLD.toilet_id, NEW.toilet_id);
+CREATE TRIGGER tr_toilet_group_map_delete AFTER DELETE ON toilet_group_map FOR EACH ROW
+	UPDATE toilet_status SET toilet_group_id = (SELECT m.toilet_group_id FROM toilet_group_map m WHERE m.toilet_id = toilet_status.toilet_id ORDER BY m.id LIMIT 1) WHERE toilet_id IN (OLD.toilet_id);
+
 INSERT INTO app_state VALUES (1,'システムモード',1,'0=使用できない状態, 1=使用可能な状態','2020-03-02 00:58:54.749426');
 
 INSERT INTO toilet VALUES (11,'4F 男性用トイレ (洋式)',1,0,'2020-03-02 00:58:54.749426');
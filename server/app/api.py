@@ -3,13 +3,18 @@
 ###############################################################################
 import sys
 sys.path.insert(0, ".")
+import collections
 import datetime
+import threading
+import time
+import zlib
 from datetime import datetime as dt
 from sqlalchemy import func, asc, desc
 from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy.orm.session import Session
 
 # Flask サブモジュールとして必要なパッケージの取り込みと設定を行う
-from flask import Blueprint, request, jsonify, Response
+from flask import Blueprint, request, jsonify, Response, json, stream_with_context
 from flask_cors import CORS
 import app.common as Common
 from app.main import app
@@ -20,6 +25,14 @@ logger = Common.get_logger("root")
 def status():
     """現在のトイレ在室状況を返します。
     なお、システム停止モードに移行している間はすべて success=False として返します。
+    応答内容はプロセス内のスナップショットから返し、現況が変化していない間はDBに問い合わせません。
+    応答には現況のバージョンを表す ETag を付与し、If-None-Match が一致した場合は本文を含まない 304 Not Modified を返します。
+    wait_for_version を指定した場合は、現況のバージョン番号がその値よりも新しくなるかタイムアウトするまで応答を保留します (ロングポーリング)。
+    ただし、保留中の要求数がプロセスあたりの上限に達している場合は保留せずに直ちに応答します。
+
+    Arguments:
+        wait_for_version {int} -- クライアントが把握している現況のバージョン番号 (省略時は保留しない)
+        timeout {int} -- 応答を保留する最大秒数 (default: 30)
 
     Returns:
         Response -- application/json = {
@@ -27,6 +40,7 @@ def status():
           message: "エラーメッセージ",    // エラー発生時のみ。正常完了時は空文字
           status: [
             {
+              id: 10,                  // トイレグループID
               name: "4F 男性用トイレ"    // トイレグループの名称
               valid: True or False,    // このトイレグループの状況を取得できたかどうか
               used: 1,                 // このトイレグループにおける現在の使用数
@@ -34,6 +48,7 @@ def status():
               rate100: 0-100,          // このトイレグループの使用率% (同じ名前のトイレを合算した使用率%)
               details: [               // このトイレグループの仔細
                 {
+                  id: 11,                // このトイレのID
                   name: "4F 男性用トイレ (洋式)",  // このトイレの名称
                   used: True or False,   // このトイレが現在使用中であるかどうか
                   valid: True or False,  // このトイレが現在トラブルが起きていない状態であるかどうか
@@ -45,88 +60,419 @@ def status():
           ]
         }
     """
-    from model.toilet import Toilet
-    from model.toilet_group import ToiletGroup
-    from model.toilet_group_map import ToiletGroupMap
-    logger.info(f"[status] API Called.")
-
-    with Common.create_session() as session:
-        current_state = Common.get_system_mode(session)
-        if current_state is None:
-            message = "システムモードを取得できませんでした。サーバー上のエラーログを確認して下さい。"
-            return jsonify({
-                "success": False,
-                "message": message
-            })
-        if current_state == Common.SYSTEM_MODE_STOP:
-            message = "現在システムモード「停止」のため、現況を取得できません。"\
-                      "現況を取得するためにはシステムモード「再開」に切り替えて下さい。"
-            logger.info(f"[status] API Response. :success={False} "\
-                        f":message={message}")
-            return jsonify({
-                "success": False,
-                "message": message
-            })
+    wait_for_version = request.args.get("wait_for_version", None, type=int)
+    timeout = request.args.get("timeout", 30, type=float)
+    logger.info(f"[status] API Called. :wait_for_version={wait_for_version} :timeout={timeout}")
 
-        # トイレグループマスターを取得: トイレへの紐付け情報も合わせて取得
-        toilet_groups = session \
-            .query(
-                ToiletGroup,
-                ToiletGroupMap,
-                func.count().label("max")
-            ) \
-            .outerjoin(ToiletGroupMap, ToiletGroup.id == ToiletGroupMap.toilet_group_id) \
-            .order_by(asc(ToiletGroup.id)) \
-            .group_by(ToiletGroup.id) \
-            .all()
-
-        # トイレマスターを取得: トイレグループへの紐付け情報も合わせて取得
-        toilets = session \
-            .query(
-                Toilet,
-                ToiletGroupMap,
-            ) \
-            .outerjoin(ToiletGroupMap, Toilet.id == ToiletGroupMap.toilet_id) \
-            .order_by(asc(Toilet.id)) \
-            .all()
-
-        # 返却用の形式に変換
-        result = {"status": []}
-        for i, toilet_group in enumerate(toilet_groups):
-            result["status"].append({
-                "name": toilet_group.ToiletGroup.name,
-                "valid": toilet_group.ToiletGroup.valid,
-                "max": toilet_group.max
-            })
+    if wait_for_version is not None and Common.status_version.read() <= wait_for_version:
+        wait_for_status_change(wait_for_version, timeout)
 
-            result["status"][-1]["used"] = 0
-            result["status"][-1]["rate100"] = 0
-            result["status"][-1]["details"] = []
+    snapshot = status_snapshot.get()
+    response = Response(snapshot.body, mimetype="application/json")
+    response.set_etag(snapshot.etag)
+    response.headers["X-Status-Version"] = str(snapshot.version)
+    # キャッシュした応答を使う場合でも毎回 ETag による再検証を行わせる
+    response.cache_control.no_cache = True
+    response.make_conditional(request)
 
-            if not toilet_group.ToiletGroup.valid:
-                # このトイレグループ全体が無効になっている
-                continue
-            if toilet_group.max == 0:
-                # このトイレグループに紐づくトイレが存在しない
+    logger.info(f"[status] API Response. :success={snapshot.data['success']} "\
+                f":status_length={len(snapshot.data.get('status', []))} "\
+                f":etag={snapshot.etag} :status_code={response.status_code}")
+    return response
+
+
+# ロングポーリングで応答を保留できる要求数の上限
+# 保留中はスレッドを占有するため、ストリーム配信の上限との合計がWSGIのスレッド数より十分に小さくなるようにする
+long_poll_slots = threading.BoundedSemaphore(Common.get_setting("long_poll.max_waiters", 2, type=int))
+
+
+def wait_for_status_change(version: int, timeout: float) -> bool:
+    """現況のバージョン番号が指定した値から変化するまで待ち合わせます。
+    待ち合わせている要求数が上限に達している場合は待たずに戻ります。
+
+    Arguments:
+        version {int} -- クライアントが把握している現況のバージョン番号
+        timeout {float} -- 待ち合わせる最大秒数
+
+    Returns:
+        bool -- 待ち合わせを行ったかどうか
+    """
+    max_timeout = Common.get_setting("long_poll.max_timeout_seconds", 30.0, type=float)
+    timeout = min(max(timeout, 0), max_timeout)
+
+    if not long_poll_slots.acquire(blocking=False):
+        logger.warning(f"[status] Long polling slots are exhausted. :wait_for_version={version}")
+        return False
+    try:
+        Common.status_notifier.wait(version, timeout)
+        return True
+    finally:
+        long_poll_slots.release()
+
+
+@app.route("/stream", methods=["GET"])
+def stream():
+    """現在のトイレ在室状況を Server-Sent Events で配信します。
+    接続時に現況全体を status イベントとして送り、以降はドアステートが変化するたびにトイレ単位の差分を delta イベントとして送ります。
+    マスターデータやシステムモードが変化した場合は、差分ではなく現況全体を status イベントとして送り直します。
+    いずれのイベントも id に現況のバージョン番号を持つため、再接続時は Last-Event-ID によって続きから受け取ることができます。
+
+    Returns:
+        Response -- text/event-stream =
+          event: status
+          id: 12
+          data: { GET / と同じ形式 }
+
+          event: delta
+          id: 13
+          data: {
+            toilet_id: 11,         // 変化したトイレのID
+            toilet_group_id: 10,   // 変化したトイレが属するトイレグループのID
+            used: True or False,   // このトイレが現在使用中であるかどうか
+            valid: True or False,  // このトイレが現在トラブルが起きていない状態であるかどうか
+            version: 13            // 変化後の現況のバージョン番号
+          }
+    """
+    last_event_id = request.headers.get("Last-Event-ID", request.args.get("last_event_id"))
+    logger.info(f"[stream] API Called. :method={request.method} :last_event_id={last_event_id}")
+
+    # GET に付随して受け付けられる HEAD では配信を始めないため、GET 以外は拒否する
+    if request.method != "GET":
+        response = jsonify({
+            "success": False,
+            "message": "現況の配信は GET で要求して下さい。"
+        })
+        response.status_code = 405
+        response.headers["Allow"] = "GET"
+        return response
+
+    # 上限に達している場合は、配信を始める前に 503 を返して定期取得に切り替えさせる
+    # 配信枠は実際に配信を始めたジェネレーターの中で確保するため、ここでは空きがあるかどうかを確かめるだけにする
+    if not stream_slots.acquire(blocking=False):
+        message = "現況の配信数が上限に達しています。時間を置いて再接続するか、定期取得に切り替えて下さい。"
+        logger.warning(f"[stream] API Response. :message={message}")
+        response = jsonify({
+            "success": False,
+            "message": message
+        })
+        response.status_code = 503
+        return response
+    stream_slots.release()
+
+    try:
+        last_version = int(last_event_id) if last_event_id is not None else None
+    except ValueError:
+        last_version = None
+
+    return Response(
+        stream_with_context(generate_status_events(last_version)),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+
+# 現況のストリーム配信を同時に受け付ける接続数の上限
+# 配信中はスレッドを占有するため、ロングポーリングの上限との合計がWSGIのスレッド数より十分に小さくなるようにする
+stream_slots = threading.BoundedSemaphore(Common.get_setting("stream.max_clients", 4, type=int))
+
+
+def generate_status_events(last_version: int):
+    """現況のストリーム配信で送るイベントを順次生成します。
+    この関数はジェネレーターであり、最初のイベントを送る時点で配信枠を確保し、接続が終了した時点で解放します。
+    応答を返す前に例外が発生した場合など、一度も反復されなかった場合は配信枠を確保しません。
+
+    Arguments:
+        last_version {int} -- クライアントが最後に受け取った現況のバージョン番号、初回接続時はNone
+
+    Yields:
+        str -- Server-Sent Events 形式のイベント
+    """
+    heartbeat_seconds = Common.get_setting("stream.heartbeat_seconds", 15.0, type=float)
+    deadline = time.monotonic() + Common.get_setting("stream.max_duration_seconds", 300.0, type=float)
+
+    if not stream_slots.acquire(blocking=False):
+        # 空きを確かめてから配信を始めるまでの間に上限に達した場合は、待ち時間の後に再接続させる
+        logger.warning(f"[stream] API Response. :message=配信を始める前に配信数が上限に達しました")
+        yield "retry: 3000\n\n"
+        return
+
+    try:
+        # クライアントに再接続を促す際の待ち時間 (ミリ秒)
+        yield "retry: 3000\n\n"
+
+        sent = status_snapshot.find(last_version) if last_version is not None else None
+        while time.monotonic() < deadline:
+            snapshot = status_snapshot.get()
+            if sent is None or sent.version != snapshot.version:
+                deltas = diff_status(sent, snapshot)
+                if deltas is None:
+                    yield format_event("status", snapshot.version, snapshot.body.decode("utf-8"))
+                else:
+                    for delta in deltas:
+                        yield format_event("delta", snapshot.version, json.dumps(delta))
+                sent = snapshot
+
+            if Common.status_notifier.wait(sent.version, min(heartbeat_seconds, max(0, deadline - time.monotonic()))) == sent.version:
+                # 変化が無いまま待ち合わせ時間が経過した
+                yield ": heartbeat\n\n"
+    finally:
+        stream_slots.release()
+        logger.info(f"[stream] API Disconnected.")
+
+
+def diff_status(previous: "StatusSnapshot", current: "StatusSnapshot") -> list:
+    """2つの現況のスナップショットを比較し、トイレ単位の差分を返します。
+
+    Arguments:
+        previous {StatusSnapshot} -- 比較元のスナップショット、無い場合はNone
+        current {StatusSnapshot} -- 比較先のスナップショット
+
+    Returns:
+        list -- トイレ単位の差分、現況全体を送り直すべき場合はNone
+    """
+    if previous is None or not previous.data["success"] or not current.data["success"]:
+        return None
+    if len(previous.data["status"]) != len(current.data["status"]):
+        return None
+
+    deltas = []
+    for previous_group, current_group in zip(previous.data["status"], current.data["status"]):
+        # トイレグループ自体の構成が変わった場合はマスターデータが変更されたとみなす
+        for key in ("id", "name", "valid", "max"):
+            if previous_group[key] != current_group[key]:
+                return None
+        if len(previous_group["details"]) != len(current_group["details"]):
+            return None
+
+        for previous_toilet, current_toilet in zip(previous_group["details"], current_group["details"]):
+            if previous_toilet["id"] != current_toilet["id"] or previous_toilet["name"] != current_toilet["name"]:
+                return None
+            if previous_toilet["used"] == current_toilet["used"] and previous_toilet["valid"] == current_toilet["valid"]:
                 continue
+            deltas.append({
+                "toilet_id": current_toilet["id"],
+                "toilet_group_id": current_group["id"],
+                "used": current_toilet["used"],
+                "valid": current_toilet["valid"],
+                "version": current.version
+            })
+    return deltas
 
-            # このグループ内の個々のトイレの仔細をデータに加える
-            for n, toilet in enumerate(toilets):
-                if toilet.ToiletGroupMap.toilet_group_id != toilet_group.ToiletGroup.id:
-                    continue
-                if toilet.Toilet.is_closed:
-                    result["status"][-1]["used"] += 1
 
-                result["status"][-1]["details"].append({
-                    "name": toilet.Toilet.name,
-                    "used": toilet.Toilet.is_closed,
-                    "valid": toilet.Toilet.valid
-                })
+def format_event(event: str, id: int, data: str) -> str:
+    """Server-Sent Events 形式のイベントを組み立てます。
 
-            result["status"][-1]["rate100"] = \
-                int(result["status"][-1]["used"] / toilet_group.max * 100)
+    Arguments:
+        event {str} -- イベント名
+        id {int} -- イベントID
+        data {str} -- イベントデータ (改行を含まないこと)
 
+    Returns:
+        str -- Server-Sent Events 形式のイベント
+    """
+    return f"event: {event}\nid: {id}\ndata: {data}\n\n"
+
+
+class StatusSnapshot(object):
+    """ある時点における現況のAPI応答用データを表すクラスです。
+    応答本文のシリアライズと ETag の算出は生成時に一度だけ行います。
+    """
+
+    def __init__(self, version: int, data: dict):
+        self.version = version
+        self.data = data
+        self.body = json.dumps(data).encode("utf-8")
+        # バージョン番号が同じでもマスターデータを直接書き換えられた場合に備えて本文のハッシュ値を加える
+        self.etag = f"{version}-{zlib.crc32(self.body):08x}"
+        self.created_at = time.monotonic()
+
+
+class StatusSnapshotCache(object):
+    """現況のスナップショットをプロセス内に保持するキャッシュクラスです。
+    現況のバージョン番号が変化した場合に限りDBから作り直すため、変化が無い間はDBに一切問い合わせません。
+    """
+
+    # 差分配信のために保持しておく過去のスナップショットの件数
+    HISTORY_SIZE = 64
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self.snapshot = None
+        self.history = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self) -> StatusSnapshot:
+        """最新の現況のスナップショットを返します。
+
+        Returns:
+            StatusSnapshot -- 現況のスナップショット
+        """
+        snapshot = self.snapshot
+        if self.is_fresh(snapshot):
+            return snapshot
+
+        with self.lock:
+            # 待機中に他のスレッドが作り直している場合はそれを使う
+            if self.is_fresh(self.snapshot):
+                return self.snapshot
+
+            # 作り直している間に現況が変化した場合に次回作り直されるよう、バージョン番号は先に取得しておく
+            version = Common.status_version.read()
+            with Common.create_session() as session:
+                self.snapshot = StatusSnapshot(version, build_status(session))
+            logger.debug(f"[StatusSnapshotCache] Rebuilt. :version={version}")
+
+            self.history[version] = self.snapshot
+            self.history.move_to_end(version)
+            while self.HISTORY_SIZE < len(self.history):
+                self.history.popitem(last=False)
+            return self.snapshot
+
+    def find(self, version: int) -> StatusSnapshot:
+        """過去に作成したスナップショットのうち、指定したバージョン番号のものを返します。
+
+        Arguments:
+            version {int} -- バージョン番号
+
+        Returns:
+            StatusSnapshot -- スナップショット、保持していない場合はNone
+        """
+        with self.lock:
+            return self.history.get(version)
+
+    def is_fresh(self, snapshot: StatusSnapshot) -> bool:
+        """スナップショットが最新の現況を表しているかどうかを返します。
+
+        Arguments:
+            snapshot {StatusSnapshot} -- 現況のスナップショット
+
+        Returns:
+            bool -- 最新であるかどうか
+        """
+        if snapshot is None:
+            return False
+        if 0 < self.ttl_seconds and self.ttl_seconds <= time.monotonic() - snapshot.created_at:
+            return False
+        return snapshot.version == Common.status_version.read()
+
+
+# プロセス内で共有する現況のスナップショット
+status_snapshot = StatusSnapshotCache(Common.get_setting("status.snapshot_ttl_seconds", 60.0, type=float))
+
+
+def build_status(session: Session) -> dict:
+    """DBから現在のトイレ在室状況を取得し、API応答用のデータを作成します。
+
+    Arguments:
+        session {Session} -- DB接続セッション
+
+    Returns:
+        dict -- API応答用のデータ
+    """
+    from model.toilet import Toilet
+    from model.toilet_group import ToiletGroup
+    from model.toilet_group_map import ToiletGroupMap
+
+    # 他のプロセスで切り替えられたシステムモードも反映できるよう、マスターから取り直す
+    current_state = Common.get_system_mode(session, use_cache=False)
+    if current_state is None:
+        message = "システムモードを取得できませんでした。サーバー上のエラーログを確認して下さい。"
+        return {
+            "success": False,
+            "message": message
+        }
+    if current_state == Common.SYSTEM_MODE_STOP:
+        message = "現在システムモード「停止」のため、現況を取得できません。"\
+                  "現況を取得するためにはシステムモード「再開」に切り替えて下さい。"
+        return {
+            "success": False,
+            "message": message
+        }
+
+    # トイレグループマスターを取得: トイレへの紐付け情報も合わせて取得
+    toilet_groups = session \
+        .query(
+            ToiletGroup,
+            ToiletGroupMap,
+            func.count().label("max")
+        ) \
+        .outerjoin(ToiletGroupMap, ToiletGroup.id == ToiletGroupMap.toilet_group_id) \
+        .order_by(asc(ToiletGroup.id)) \
+        .group_by(ToiletGroup.id) \
+        .all()
+
+    # トイレマスターを取得: トイレグループへの紐付け情報も合わせて取得
+    toilets = session \
+        .query(
+            Toilet,
+            ToiletGroupMap,
+        ) \
+        .outerjoin(ToiletGroupMap, Toilet.id == ToiletGroupMap.toilet_id) \
+        .order_by(asc(Toilet.id)) \
+        .all()
+
+    result = {"status": assemble_status(toilet_groups, toilets)}
     result["success"] = True
     result["message"] = ""
-    logger.info(f"[status] API Response. :success={True} :status_length={len(result['status'])}")
-    return jsonify(result)
+    return result
+
+
+def assemble_status(toilet_groups: list, toilets: list) -> list:
+    """トイレグループマスターとトイレマスターの取得結果から、トイレグループごとの在室状況を組み立てます。
+    トイレは先にトイレグループIDごとに振り分けておくため、処理量はトイレグループ数とトイレ数の和に比例します。
+
+    Arguments:
+        toilet_groups {list} -- トイレグループマスターの取得結果 (ToiletGroup, ToiletGroupMap, max)
+        toilets {list} -- トイレマスターの取得結果 (Toilet, ToiletGroupMap)、トイレID順
+
+    Returns:
+        list -- トイレグループごとの在室状況
+    """
+    # トイレグループIDごとにトイレを振り分ける
+    toilets_by_group = {}
+    for toilet in toilets:
+        if toilet.ToiletGroupMap is None:
+            # いずれのトイレグループにも属していない
+            continue
+        toilets_by_group.setdefault(toilet.ToiletGroupMap.toilet_group_id, []).append(toilet.Toilet)
+
+    # 返却用の形式に変換
+    status = []
+    for toilet_group in toilet_groups:
+        status.append({
+            "id": toilet_group.ToiletGroup.id,
+            "name": toilet_group.ToiletGroup.name,
+            "valid": toilet_group.ToiletGroup.valid,
+            "max": toilet_group.max,
+            "used": 0,
+            "rate100": 0,
+            "details": []
+        })
+
+        if not toilet_group.ToiletGroup.valid:
+            # このトイレグループ全体が無効になっている
+            continue
+        if toilet_group.max == 0:
+            # このトイレグループに紐づくトイレが存在しない
+            continue
+
+        # このグループ内の個々のトイレの仔細をデータに加える
+        details = status[-1]["details"]
+        used = 0
+        for toilet in toilets_by_group.get(toilet_group.ToiletGroup.id, []):
+            if toilet.is_closed:
+                used += 1
+            details.append({
+                "id": toilet.id,
+                "name": toilet.name,
+                "used": toilet.is_closed,
+                "valid": toilet.valid
+            })
+
+        status[-1]["used"] = used
+        status[-1]["rate100"] = int(used / toilet_group.max * 100)
+
+    return status
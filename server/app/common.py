@@ -2,12 +2,19 @@
 #    任意の処理を実行するAPIを定義します。
 ###############################################################################
 from datetime import datetime as dt
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.orm.session import Session
-from sqlalchemy.pool import SingletonThreadPool
+from sqlalchemy.pool import SingletonThreadPool, QueuePool, NullPool
+import fcntl
+import os
+import sqlite3
 import sys
+import threading
+import time
+import urllib.parse
 sys.path.insert(0, ".")
 
 ### ロギング設定ロード
@@ -20,8 +27,39 @@ import configparser
 config = configparser.ConfigParser()
 config.read("./alembic.ini", "UTF-8")
 
+# 環境変数から設定値を上書きする際の接頭辞
+SETTINGS_ENV_PREFIX = "DOOR_WATCHER_"
+
+
+def get_setting(key: str, default=None, type=str):
+    """アプリケーション設定値を取得します。
+    環境変数 (DOOR_WATCHER_ + キー名を大文字、ドットをアンダースコアに置換したもの) が定義されていればそれを優先し、
+    次いで alembic.ini の [app] セクション、いずれも無ければ既定値を返します。
+
+    Arguments:
+        key {str} -- 設定キー名 (例: db.echo)
+
+    Keyword Arguments:
+        default {any} -- 既定値 (default: {None})
+        type {type} -- 変換先の型 (str, int, float, bool) (default: {str})
+
+    Returns:
+        any -- 設定値
+    """
+    env_name = SETTINGS_ENV_PREFIX + key.upper().replace(".", "_")
+    value = os.environ.get(env_name)
+    if value is None:
+        value = config.get("app", key, fallback=None)
+    if value is None:
+        return default
+
+    if type is bool:
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return type(value)
+
+
 # DB接続文字列
-DB_PATH = config.get("alembic", "sqlalchemy.url")
+DB_PATH = get_setting("db.url", config.get("alembic", "sqlalchemy.url"))
 print(DB_PATH)
 
 ### 定数定義
@@ -35,16 +73,288 @@ SYSTEM_MODE_STOP = 0
 SYSTEM_MODE_RUNNING = 1
 
 
+# 既定のDB接続先名
+DEFAULT_ENGINE_NAME = "db"
+# 集計・分析用の読み取り専用のDB接続先名
+ANALYTICS_ENGINE_NAME = "analytics"
+# 設定値から選択可能なコネクションプール方式
+POOL_CLASSES = {
+    "SingletonThreadPool": SingletonThreadPool,
+    "QueuePool": QueuePool,
+    "NullPool": NullPool,
+}
+# SQLite の接続ごとに設定する PRAGMA の適用順 (ロック待ちの設定は journal_mode の切替よりも先に行う)
+SQLITE_PRAGMA_NAMES = ["busy_timeout", "journal_mode", "synchronous", "cache_size", "mmap_size", "temp_store", "wal_autocheckpoint",
+                       "query_only"]
+# SQLite の PRAGMA の設定値の組 (プロファイル)
+SQLITE_PRAGMA_PROFILES = {
+    # SQLite の既定値のまま (ロールバックジャーナル)
+    "default": {},
+    # 書き込みと読み取りが互いを待たないよう WAL とし、ロックを待つ時間とキャッシュを確保する
+    "tuned": {
+        "busy_timeout": 5000,
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16000,
+        "mmap_size": 268435456,
+        "temp_store": "MEMORY",
+        "wal_autocheckpoint": 1000,
+    },
+    # 集計・分析用の読み取り専用の接続: 走査する範囲が広いため、キャッシュとメモリーマップを大きく取る
+    "analytics": {
+        "busy_timeout": 5000,
+        "cache_size": -64000,
+        "mmap_size": 1073741824,
+        "temp_store": "MEMORY",
+        "query_only": 1,
+    },
+}
+# 接続先名ごとの既定の PRAGMA プロファイル (無いものは tuned)
+DEFAULT_SQLITE_PROFILES = {
+    ANALYTICS_ENGINE_NAME: "analytics",
+}
+# WAL のチェックポイントのモード
+SQLITE_CHECKPOINT_MODES = ["PASSIVE", "FULL", "RESTART", "TRUNCATE"]
+
+
+class EngineRegistry(object):
+    """DBエンジン、およびセッション生成器をプロセス内で共有するレジストリークラスです。
+    エンジンは接続先名ごとに初回要求時にのみ生成し、以降のリクエストでは同じものを使い回します。
+    """
+
+    def __init__(self):
+        self.engines = {}
+        self.session_makers = {}
+        self.checkpointers = {}
+        self.lock = threading.Lock()
+
+    def get_engine(self, name: str = DEFAULT_ENGINE_NAME) -> Engine:
+        """接続先名に対応するDBエンジンを返します。未生成の場合はこの時点で生成します。
+
+        Keyword Arguments:
+            name {str} -- 接続先名、設定キーの接頭辞を兼ねる (default: {DEFAULT_ENGINE_NAME})
+
+        Returns:
+            Engine -- DBエンジン
+        """
+        engine = self.engines.get(name)
+        if engine is not None:
+            return engine
+
+        with self.lock:
+            if name not in self.engines:
+                self.engines[name] = self.create_engine(name)
+                self.session_makers[name] = sessionmaker(bind=self.engines[name])
+            return self.engines[name]
+
+    def get_session_maker(self, name: str = DEFAULT_ENGINE_NAME) -> sessionmaker:
+        """接続先名に対応するセッション生成器を返します。
+
+        Keyword Arguments:
+            name {str} -- 接続先名 (default: {DEFAULT_ENGINE_NAME})
+
+        Returns:
+            sessionmaker -- セッション生成器
+        """
+        if name not in self.session_makers:
+            self.get_engine(name)
+        return self.session_makers[name]
+
+    def create_engine(self, name: str) -> Engine:
+        """設定値に従ってDBエンジンを新たに生成します。
+
+        Arguments:
+            name {str} -- 接続先名
+
+        Returns:
+            Engine -- DBエンジン
+        """
+        url = get_setting(f"{name}.url", None) or get_default_url(name)
+        echo = get_setting(f"{name}.echo", False, type=bool)
+        pool_class_name = get_setting(f"{name}.poolclass", "SingletonThreadPool")
+        if pool_class_name not in POOL_CLASSES:
+            raise ValueError(f"{name}.poolclass={pool_class_name} は未対応のコネクションプール方式です。")
+        pool_class = POOL_CLASSES[pool_class_name]
+
+        options = {
+            "echo": echo,
+            "poolclass": pool_class,
+            "pool_recycle": get_setting(f"{name}.pool_recycle", -1, type=int),
+        }
+        if pool_class is QueuePool:
+            options["pool_size"] = get_setting(f"{name}.pool_size", 5, type=int)
+            options["max_overflow"] = get_setting(f"{name}.max_overflow", 10, type=int)
+        elif pool_class is SingletonThreadPool:
+            options["pool_size"] = get_setting(f"{name}.pool_size", 5, type=int)
+        if url.startswith("sqlite") and pool_class is not SingletonThreadPool:
+            # スレッドをまたいでコネクションが受け渡されるため、SQLite側のスレッドチェックを外す
+            options["connect_args"] = {"check_same_thread": False}
+
+        get_logger(__name__).info(f"[create_engine] :name={name} :poolclass={pool_class_name} :echo={echo}")
+        engine = create_engine(url, **options)
+        if url.startswith("sqlite"):
+            self.configure_sqlite(name, engine)
+        return engine
+
+    def configure_sqlite(self, name: str, engine: Engine):
+        """SQLite の接続ごとに PRAGMA を設定するようにし、WAL の場合は定期的なチェックポイントを開始します。
+
+        Arguments:
+            name {str} -- 接続先名
+            engine {Engine} -- DBエンジン
+        """
+        pragmas = get_sqlite_pragmas(name)
+        get_logger(__name__).info(f"[configure_sqlite] :name={name} :pragmas={pragmas}")
+        if pragmas:
+            @event.listens_for(engine, "connect")
+            def set_sqlite_pragmas(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                for pragma, value in pragmas:
+                    cursor.execute(f"PRAGMA {pragma}={value}")
+                cursor.close()
+
+        # チェックポイントはプールのコネクションを使わず、専用の接続で行う
+        interval_seconds = get_setting(f"{name}.sqlite.checkpoint_interval_seconds", 60, type=float)
+        if dict(pragmas).get("journal_mode", "").upper() == "WAL" and 0 < interval_seconds and engine.url.database:
+            checkpointer = SqliteCheckpointer(
+                engine.url.database,
+                interval_seconds,
+                get_setting(f"{name}.sqlite.checkpoint_mode", "PASSIVE").upper(),
+                dict(pragmas).get("busy_timeout", 0)
+            )
+            checkpointer.start()
+            self.checkpointers[name] = checkpointer
+
+    def dispose(self):
+        """生成済みのDBエンジンをすべて破棄します。
+        """
+        with self.lock:
+            for checkpointer in self.checkpointers.values():
+                checkpointer.stop()
+            for engine in self.engines.values():
+                engine.dispose()
+            self.engines.clear()
+            self.session_makers.clear()
+            self.checkpointers.clear()
+
+
+def get_default_url(name: str) -> str:
+    """接続先名に対応する既定のDB接続文字列を返します。
+    集計・分析用の接続先は、SQLite の場合は同じファイルを読み取り専用 (mode=ro) で開く URI とし、それ以外は同じ接続文字列とします。
+
+    Arguments:
+        name {str} -- 接続先名
+
+    Returns:
+        str -- DB接続文字列
+    """
+    prefix = "sqlite:///"
+    if name != ANALYTICS_ENGINE_NAME or not DB_PATH.startswith(prefix):
+        return DB_PATH
+    path = DB_PATH[len(prefix):]
+    if path in ("", ":memory:"):
+        return DB_PATH
+    return f"{prefix}file:{urllib.parse.quote(path)}?mode=ro&uri=true"
+
+
+def get_sqlite_pragmas(name: str) -> list:
+    """接続先名に対応する SQLite の PRAGMA の設定値を返します。
+    プロファイル ({name}.sqlite.profile) の設定値を、PRAGMA ごとの設定値 ({name}.sqlite.{PRAGMA名}) で上書きしたものとなります。
+
+    Arguments:
+        name {str} -- 接続先名
+
+    Returns:
+        list -- (PRAGMA名, 設定値) のリスト (適用順)
+    """
+    profile_name = get_setting(f"{name}.sqlite.profile", DEFAULT_SQLITE_PROFILES.get(name, "tuned"))
+    if profile_name not in SQLITE_PRAGMA_PROFILES:
+        raise ValueError(f"{name}.sqlite.profile={profile_name} は未対応のプロファイルです。")
+    profile = SQLITE_PRAGMA_PROFILES[profile_name]
+
+    pragmas = []
+    for pragma in SQLITE_PRAGMA_NAMES:
+        value = get_setting(f"{name}.sqlite.{pragma}", profile.get(pragma))
+        if value is not None and value != "":
+            pragmas.append((pragma, value))
+    return pragmas
+
+
+class SqliteCheckpointer(object):
+    """SQLite の WAL を定期的にデータベースファイルへ書き戻すクラスです。
+    書き込みごとの自動チェックポイント (wal_autocheckpoint) は読み取り中のトランザクションがあると最後まで進まず、
+    読み取りが途切れない間は WAL が伸び続けるため、バックグラウンドのスレッドで一定間隔ごとにチェックポイントを行います。
+    """
+
+    def __init__(self, database: str, interval_seconds: float, mode: str, busy_timeout_ms: int):
+        if mode not in SQLITE_CHECKPOINT_MODES:
+            raise ValueError(f"sqlite.checkpoint_mode={mode} は未対応のチェックポイントモードです。")
+        self.database = database
+        self.interval_seconds = interval_seconds
+        self.mode = mode
+        self.busy_timeout_ms = int(busy_timeout_ms)
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """チェックポイントを行うスレッドを開始します。
+        """
+        self.thread = threading.Thread(target=self.run, name="sqlite-checkpointer", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """チェックポイントを行うスレッドを停止します。
+        """
+        self.stopped.set()
+
+    def run(self):
+        """一定間隔ごとにチェックポイントを行います。
+        バックグラウンドのスレッドで実行されます。
+        """
+        connection = None
+        while not self.stopped.wait(self.interval_seconds):
+            try:
+                if connection is None:
+                    connection = sqlite3.connect(self.database, timeout=self.busy_timeout_ms / 1000)
+                self.checkpoint(connection)
+            except sqlite3.Error:
+                get_logger(__name__).exception("[SqliteCheckpointer] Checkpoint failed. 次回の間隔で再試行します")
+        if connection is not None:
+            connection.close()
+
+    def checkpoint(self, connection: sqlite3.Connection) -> tuple:
+        """チェックポイントを1回行います。
+
+        Arguments:
+            connection {Connection} -- SQLite の接続
+
+        Returns:
+            tuple -- (ロック待ちで完了しなかったかどうか, WAL のページ数, 書き戻したページ数)
+        """
+        result = connection.execute(f"PRAGMA wal_checkpoint({self.mode})").fetchone()
+        if result[0] or result[2] < result[1]:
+            get_logger(__name__).info(f"[SqliteCheckpointer] Incomplete. :mode={self.mode} :busy={result[0]} "\
+                                      f":wal_pages={result[1]} :checkpointed_pages={result[2]}")
+        return result
+
+
+# プロセス内で共有するDBエンジンレジストリー
+engine_registry = EngineRegistry()
+
+
 class SessionFactory(object):
     """DB接続セッションを生成するファクトリークラスです。
     """
 
-    def __init__(self, echo=False):
-        self.engine = create_engine(DB_PATH, echo=echo, poolclass=SingletonThreadPool)
+    def __init__(self, name=DEFAULT_ENGINE_NAME):
+        self.name = name
+
+    @property
+    def engine(self) -> Engine:
+        return engine_registry.get_engine(self.name)
 
     def create(self) -> Session:
-        Session = sessionmaker(bind=self.engine)
-        return Session()
+        return engine_registry.get_session_maker(self.name)()
 
 
 class SessionContext(object):
@@ -68,45 +378,219 @@ class SessionContextFactory(object):
     """with構文 に対応したDB接続セッションを生成するファクトリークラスです。
     """
 
-    def __init__(self, echo=False):
-        self.session_factory = SessionFactory(echo=echo)
+    def __init__(self, name=DEFAULT_ENGINE_NAME):
+        self.session_factory = SessionFactory(name=name)
 
     def create(self) -> SessionContext:
         return SessionContext(self.session_factory.create())
 
 
-def create_session() -> SessionContext:
+def create_session(name: str = DEFAULT_ENGINE_NAME) -> SessionContext:
     """DB接続セッションを作成します。
     この関数の戻り値を受け取る呼出元変数は with構文 を用いて自動クローズの対象とすることを推奨します。
 
+    Keyword Arguments:
+        name {str} -- 接続先名、集計・分析の読み取りには ANALYTICS_ENGINE_NAME を指定する (default: {DEFAULT_ENGINE_NAME})
+
     Returns:
         Session -- DB接続セッション
     """
-    return SessionContextFactory(echo=True).create()
+    return SessionContextFactory(name=name).create()
+
+
+class SystemModeCache(object):
+    """システムモードをプロセス内に保持するキャッシュクラスです。
+    システムモードは緊急停止APIでしか変化しないため、切替時に明示的に更新し、
+    他のプロセスで切り替えられた場合に備えて有効期限切れ後はマスターから取り直します。
+    """
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self.state = None
+        self.expires_at = 0.0
+        self.lock = threading.Lock()
+
+    def get(self):
+        """有効期限内のシステムモードを返します。
+
+        Returns:
+            int -- システムモード、キャッシュされていないか有効期限切れの場合はNone
+        """
+        with self.lock:
+            if self.state is None or self.expires_at <= time.monotonic():
+                return None
+            return self.state
+
+    def set(self, state):
+        """システムモードをキャッシュします。
+
+        Arguments:
+            state {int} -- システムモード
+        """
+        with self.lock:
+            self.state = state
+            self.expires_at = time.monotonic() + self.ttl_seconds
+
+    def invalidate(self):
+        """キャッシュを破棄し、次回はマスターから取り直すようにします。
+        """
+        with self.lock:
+            self.state = None
+            self.expires_at = 0.0
+
+
+# プロセス内で共有するシステムモードキャッシュ
+system_mode_cache = SystemModeCache(get_setting("system_mode.cache_ttl_seconds", 5.0, type=float))
+
+
+class SharedCounter(object):
+    """同一ホスト上の複数プロセス間で共有する単調増加カウンタークラスです。
+    値は固定長の10進数文字列としてファイルに保持し、加算時はファイルロックで排他します。
+    参照時はファイルを読むだけなので、DBへの問い合わせは発生しません。
+    """
+
+    # ファイルに書き込む値の桁数
+    WIDTH = 20
+
+    def __init__(self, path: str):
+        self.path = path
+        self.fd = None
+        self.lock = threading.Lock()
+
+    def open(self) -> int:
+        """カウンターファイルを開きます。既に開いている場合は何もしません。
+
+        Returns:
+            int -- ファイルディスクリプター
+        """
+        if self.fd is None:
+            with self.lock:
+                if self.fd is None:
+                    directory = os.path.dirname(self.path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o664)
+        return self.fd
+
+    def read(self) -> int:
+        """現在の値を返します。
+
+        Returns:
+            int -- 現在の値、一度も加算されていない場合は0
+        """
+        raw = os.pread(self.open(), self.WIDTH, 0)
+        return int(raw) if raw.strip() else 0
+
+    def increment(self) -> int:
+        """値を1加算します。
+
+        Returns:
+            int -- 加算後の値
+        """
+        fd = self.open()
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            value = self.read() + 1
+            os.pwrite(fd, f"{value:0{self.WIDTH}d}".encode(), 0)
+            return value
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+# 現況 (ドアステート、マスターデータ、システムモード) が変化するたびに加算するバージョン番号
+# Webアプリケーションの各プロセスはこの値の変化をもって現況のスナップショットを作り直す
+status_version = SharedCounter(get_setting("status.version_file", "db/status.version"))
+
+
+class StatusNotifier(object):
+    """現況のバージョン番号が変化するのを待ち合わせるためのクラスです。
+    同一プロセス内での変化は notify() により即座に、他のプロセスでの変化はバージョン番号の定期的な確認により検知します。
+    """
+
+    def __init__(self, counter: SharedCounter, poll_interval_seconds: float):
+        self.counter = counter
+        self.poll_interval_seconds = poll_interval_seconds
+        self.condition = threading.Condition()
+
+    def notify(self):
+        """待ち合わせているスレッドをすべて起こします。
+        """
+        with self.condition:
+            self.condition.notify_all()
+
+    def wait(self, version: int, timeout: float) -> int:
+        """現況のバージョン番号が指定した値から変化するか、タイムアウトするまで待ち合わせます。
+
+        Arguments:
+            version {int} -- 呼出元が把握しているバージョン番号
+            timeout {float} -- タイムアウト秒数
+
+        Returns:
+            int -- 待ち合わせ終了時点のバージョン番号
+        """
+        deadline = time.monotonic() + timeout
+        current_version = self.counter.read()
+        while current_version == version:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            with self.condition:
+                self.condition.wait(min(remaining, self.poll_interval_seconds))
+            current_version = self.counter.read()
+        return current_version
+
+
+# 現況の変化を待ち合わせるための通知オブジェクト
+status_notifier = StatusNotifier(status_version, get_setting("status.poll_interval_seconds", 0.5, type=float))
+
+
+def publish_status_change() -> int:
+    """現況が変化したことを全プロセスに通知します。
+    DBへの変更をコミットした後に呼び出して下さい。
+
+    Returns:
+        int -- 通知後の現況のバージョン番号
+    """
+    version = status_version.increment()
+    status_notifier.notify()
+    return version
 
 
-def get_system_mode(session: Session) -> int:
-    """現在のシステムモードをアプリケーション状態マスターから取得します。
+def get_system_mode(session: Session, use_cache: bool = True) -> int:
+    """現在のシステムモードを返します。
+    キャッシュが有効であればそれを返し、そうでなければアプリケーション状態マスターから取得してキャッシュします。
 
     Arguments:
         session {Session} -- DB接続セッション
 
+    Keyword Arguments:
+        use_cache {bool} -- キャッシュを参照するかどうか (default: {True})
+
     Returns:
         int -- システムモード (SYSTEM_MODE_STOP=停止, SYSTEM_MODE_RUNNING=稼働), マスターデータを取得できなかった場合はNone
     """
     from model.app_state import AppState
     logger = get_logger(__name__)
 
+    if use_cache:
+        state = system_mode_cache.get()
+        if state is not None:
+            return state
+
     try:
-        return session \
+        state = session \
             .query(AppState.state) \
             .filter(AppState.id == SYSTEM_MODE_APP_STATE_ID) \
             .one() \
             .state
     except NoResultFound:
         logger.error("Method Error. [get_system_mode] アプリケーション状態マスター id={1} のレコードが設定されていません")
+        system_mode_cache.invalidate()
         return None
 
+    system_mode_cache.set(state)
+    return state
+
 
 def get_logger(name: str) -> logging.Logger:
     """指定したモジュール名でロガーオブジェクトを生成します。
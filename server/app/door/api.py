@@ -3,16 +3,17 @@
 ###############################################################################
 import sys
 sys.path.insert(0, ".")
+import datetime
 from datetime import datetime as dt
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy.pool import SingletonThreadPool
+from sqlalchemy.orm.session import Session
 
 # Flask サブモジュールとして必要なパッケージの取り込みと設定を行う
 from flask import Blueprint, request, jsonify, Response
 from flask_cors import CORS
 import app.common as Common
+from app.door.journal import DoorJournal
+from app.logs.toilet_session import add_toilet_sessions
+from app.logs.rollup import UsageRollupRefresher
 sub_function = Blueprint("door", __name__, url_prefix="/door")
 CORS(sub_function)
 logger = Common.get_logger("door")
@@ -20,6 +21,47 @@ logger = Common.get_logger("door")
 ### 定数定義
 # open/close を許可する最短呼出間隔 (秒)
 MIN_DOOR_EVENT_SPAN_SECONDS = 3
+# ドアステート切替の結果: 成功
+TRANSITION_SUCCEEDED = "succeeded"
+# ドアステート切替の結果: システムモードを取得できない
+TRANSITION_SYSTEM_MODE_UNKNOWN = "system_mode_unknown"
+# ドアステート切替の結果: システムモードが停止状態
+TRANSITION_SYSTEM_STOPPED = "system_stopped"
+# ドアステート切替の結果: 対象のトイレが存在しない
+TRANSITION_NOT_FOUND = "not_found"
+# ドアステート切替の結果: 既に切替先のステートになっている
+TRANSITION_ALREADY = "already"
+# ドアステート切替の結果: 前回更新から最短呼出間隔が経過していない
+TRANSITION_TOO_EARLY = "too_early"
+# ドアステート切替の結果: 前回更新よりも前に発生したイベント
+TRANSITION_OUT_OF_ORDER = "out_of_order"
+# ドアステート切替の結果: 同じバッチ内で重複しているイベント
+TRANSITION_DUPLICATE = "duplicate"
+# ドアステート切替の結果: イベントの形式が正しくない
+TRANSITION_INVALID = "invalid"
+
+# トイレ使用状況集計テーブル (1時間単位) への反映を行うバックグラウンドのスレッド、無効の場合はNone
+# ドアイベントをDBに書き込んだ後に反映を依頼し、ログ取得APIは集計テーブルを読み取るだけにする
+usage_rollup_refresher = None
+if Common.get_setting("logs.use_rollup", True, type=bool) \
+        and 0 < Common.get_setting("logs.rollup_refresh_interval_seconds", 60, type=float):
+    usage_rollup_refresher = UsageRollupRefresher(
+        Common.get_setting("logs.rollup_refresh_interval_seconds", 60, type=float)
+    )
+    usage_rollup_refresher.start()
+
+# write-behind モード時のドアイベントジャーナル、無効の場合はNone
+# 有効の場合、ドアステートの切替はジャーナルへの追記をもって応答し、DBへはバックグラウンドでまとめて書き込む
+door_journal = None
+if Common.get_setting("door.write_behind", False, type=bool):
+    door_journal = DoorJournal(
+        Common.get_setting("door.journal_file", "db/door.journal"),
+        Common.get_setting("door.flush_interval_ms", 200, type=int) / 1000,
+        Common.get_setting("door.flush_batch_size", 100, type=int),
+        Common.get_setting("door.journal_fsync", True, type=bool),
+        on_flushed=usage_rollup_refresher.request if usage_rollup_refresher is not None else None
+    )
+    door_journal.start()
 
 
 @sub_function.route("/open", methods=["PUT"])
@@ -33,211 +75,341 @@ def open() -> Response:
         Response -- application/json = {
             success: True or False,
             message: 補足メッセージ,
+            reason: 失敗理由コード,  // 失敗時のみ。TRANSITION_* のいずれか
         }
     """
     toilet_id = request.json["toilet_id"]
-
-    from model.app_state import AppState
-    from model.toilet import Toilet
-    from model.toilet_status import ToiletStatus
     logger.info(f"[open] API Called. :toilet_id={toilet_id}")
+    return jsonify(change_door_state("open", toilet_id, False))
 
-    with Common.create_session() as session:
-        current_state = Common.get_system_mode(session)
-        if current_state is None:
-            message = "システムモードを取得できませんでした。サーバー上のエラーログを確認して下さい。"
-            return jsonify({
-                "success": False,
-                "message": message
-            })
-        if current_state == Common.SYSTEM_MODE_STOP:
-            message = "システムモードが停止状態です。すべての入退室ログは記録されません。"
-            logger.info(f"[open] API Response. :success={False} "\
-                        f":message={message}")
-            return jsonify({
-                "success": False,
-                "message": message
-            })
 
-        # 現在の在室状況を取得
-        try:
-            is_closed = session \
-                .query(Toilet.is_closed) \
-                .filter(Toilet.id == toilet_id) \
-                .one() \
-                .is_closed
-        except NoResultFound:
-            message = f"トイレ #{toilet_id} が見つかりません。トイレマスター上のID設定とAPI呼び出し元のIDが合致することを確認して下さい。"
-            logger.error(f"[open] API Response. :success={False} "\
-                         f":message={message}")
-            return jsonify({
-                "success": False,
-                "message": message
-            })
-
-        if not is_closed:
-            message = f"トイレ #{toilet_id} は既に空室です。重複防止のため退室ログは記録されません。"
-            logger.info(f"[open] API Response. :success={False} "\
-                        f":message={message}")
-            return jsonify({
-                "success": False,
-                "message": message
-            })
+@sub_function.route("/close", methods=["PUT"])
+def close() -> Response:
+    """トイレのドアが閉められたことを記録します。
 
-        # 現在の在室状況を更新
-        try:
-            target_toilet = session \
-                .query(Toilet) \
-                .filter(Toilet.id == toilet_id) \
-                .one()
-        except NoResultFound:
-            message = f"トイレ #{toilet_id} が見つかりません。トイレマスター上のID設定とAPI呼び出し元のIDが合致することを確認して下さい。"
-            logger.error(f"[open] API Response. :success={False} "\
-                         f":message={message}")
-            return jsonify({
-                "success": False,
-                "message": message
-            })
-
-        # 前回更新からの経過時間を算出
-        timedelta = dt.now() - target_toilet.modified_time
-        if timedelta.total_seconds() < MIN_DOOR_EVENT_SPAN_SECONDS:
-            message = f"トイレ #{toilet_id} は {MIN_DOOR_EVENT_SPAN_SECONDS} 秒以内に更新されています。"\
-                      f"過剰反応防止のため、再度時間を置いてから呼び出して下さい。"
-            logger.warning(f"[open] API Response. :success={False} "\
-                         f":message={message}")
-            return jsonify({
-                "success": False,
-                "message": message
-            })
+    Arguments:
+        toilet_id {int} -- ターゲットトイレID
+
+    Returns:
+        Response -- application/json = {
+            success: True or False,
+            message: 補足メッセージ,
+            reason: 失敗理由コード,  // 失敗時のみ。TRANSITION_* のいずれか
+        }
+    """
+    toilet_id = request.json["toilet_id"]
+    logger.info(f"[close] API Called. :toilet_id={toilet_id}")
+    return jsonify(change_door_state("close", toilet_id, True))
 
-        target_toilet.is_closed = False
-        target_toilet.modified_time = dt.now()
-        session.add(target_toilet)
 
-        # トイレのドアが開いたことを表すイベントをトランザクションテーブルに追加
-        session.add(ToiletStatus(
-            toilet_id=toilet_id,
-            is_closed=False,
-            created_time=dt.now()
-        ))
+@sub_function.route("/events", methods=["POST"])
+def events() -> Response:
+    """センサーのゲートウェイ等でまとめられた複数のドアイベントを一括で記録します。
+    イベントは発生日時の順に1件ずつ開閉時と同じ規則で判定し、記録はすべて1つのトランザクションで行います。
 
+    Arguments:
+        events {list} -- ドアイベントのリスト (リクエストボディーそのもの、または events キーの値) = [
+            {
+                toilet_id: 11,                        // ターゲットトイレID
+                is_closed: True or False,             // True=ドアが閉められた, False=ドアが開いた
+                occurred_at: "2020-01-01T10:00:00",   // センサー側での発生日時 (ISO 8601 形式の文字列、またはUNIX時間の秒数)
+                seq: 1,                               // センサー側の連番 (省略可)、同じトイレで重複したものは記録されない
+            },
+            ...
+        ]
+
+    Returns:
+        Response -- application/json = {
+            success: True or False,    // リクエスト全体を処理できたかどうか
+            message: 補足メッセージ,
+            results: [                 // イベントごとの結果 (受け取った順)
+                {
+                    toilet_id: 11,
+                    seq: 1,
+                    success: True or False,
+                    reason: 失敗理由コード,  // 成功時は None。TRANSITION_* のいずれか
+                    message: 補足メッセージ,
+                },
+                ...
+            ]
+        }
+    """
+    body = request.get_json(silent=True)
+    door_events = body.get("events") if isinstance(body, dict) else body
+    if not isinstance(door_events, list):
+        message = "リクエストボディーにはドアイベントの配列を指定して下さい。"
+        logger.error(f"[events] API Response. :success={False} :message={message}")
+        return jsonify({
+            "success": False,
+            "message": message,
+            "results": []
+        })
+    logger.info(f"[events] API Called. :events_length={len(door_events)}")
+
+    with Common.create_session() as session:
+        results = apply_door_events(session, door_events)
         session.commit()
 
-    message = f"トイレ #{toilet_id} が空室になりました。"
-    logger.info(f"[open] API Response. :success={True} "\
-                f":message={message}")
+    succeeded_count = len([x for x in results if x["success"]])
+    if 0 < succeeded_count and door_journal is None:
+        # 現況が変化したことを全プロセスに通知する (write-behind モードではDBへの書き込み後に通知される)
+        Common.publish_status_change()
+        if usage_rollup_refresher is not None:
+            usage_rollup_refresher.request()
+
+    message = f"{len(results)} 件中 {succeeded_count} 件のイベントを記録しました。"
+    logger.info(f"[events] API Response. :success={True} :message={message}")
     return jsonify({
         "success": True,
-        "message": message
+        "message": message,
+        "results": results
     })
 
 
-@sub_function.route("/close", methods=["PUT"])
-def close() -> Response:
-    """トイレのドアが閉められたことを記録します。
+def change_door_state(api_name: str, toilet_id: int, is_closed: bool) -> dict:
+    """トイレのドアステートを切り替え、API応答用のデータを返します。
 
     Arguments:
+        api_name {str} -- ログ出力用のAPI名
         toilet_id {int} -- ターゲットトイレID
+        is_closed {bool} -- 切替先のステート (True=閉まった, False=開いた)
 
     Returns:
-        Response -- application/json = {
-            success: True or False,
-            message: 補足メッセージ,
-        }
+        dict -- API応答用のデータ
     """
-    toilet_id = request.json["toilet_id"]
+    with Common.create_session() as session:
+        result = transit_door_state(session, toilet_id, is_closed)
+        session.commit()
 
-    from model.toilet import Toilet
-    from model.toilet_status import ToiletStatus
-    logger.info(f"[close] API Called. :toilet_id={toilet_id}")
+    if result == TRANSITION_SUCCEEDED and door_journal is None:
+        # 現況が変化したことを全プロセスに通知する (write-behind モードではDBへの書き込み後に通知される)
+        Common.publish_status_change()
+        if usage_rollup_refresher is not None:
+            usage_rollup_refresher.request()
 
-    with Common.create_session() as session:
-        current_state = Common.get_system_mode(session)
-        if current_state is None:
-            message = "システムモードを取得できませんでした。サーバー上のエラーログを確認して下さい。"
-            return jsonify({
-                "success": False,
-                "message": message
-            })
-        if current_state == Common.SYSTEM_MODE_STOP:
-            message = "システムモードが停止状態です。すべての入退室ログは記録されません。"
-            logger.info(f"[close] API Response. :success={False} "\
-                        f":message={message}")
-            return jsonify({
-                "success": False,
-                "message": message
-            })
+    message = get_transition_message(result, toilet_id, is_closed)
+    if result == TRANSITION_SUCCEEDED:
+        logger.info(f"[{api_name}] API Response. :success={True} "\
+                    f":message={message}")
+        return {
+            "success": True,
+            "message": message
+        }
 
-        # 現在の在室状況を取得
-        try:
-            is_closed = session \
-                .query(Toilet.is_closed) \
-                .filter(Toilet.id == toilet_id) \
-                .one() \
-                .is_closed
-        except NoResultFound:
-            message = f"トイレ #{toilet_id} が見つかりません。トイレマスター上のID設定とAPI呼び出し元のIDが合致することを確認して下さい。"
-            logger.error(f"[close] API Response. :success={False} "\
-                         f":message={message}")
-            return jsonify({
-                "success": False,
-                "message": message
-            })
-
-        if is_closed:
-            message = f"トイレ #{toilet_id} は既に使用中です。重複防止のため入室ログは記録されません。"
-            logger.info(f"[close] API Response. :success={False} "\
-                        f":message={message}")
-            return jsonify({
-                "success": False,
-                "message": message
-            })
+    if result in (TRANSITION_SYSTEM_MODE_UNKNOWN, TRANSITION_NOT_FOUND):
+        log = logger.error
+    elif result == TRANSITION_TOO_EARLY:
+        log = logger.warning
+    else:
+        log = logger.info
+    log(f"[{api_name}] API Response. :success={False} "\
+        f":reason={result} :message={message}")
+    return {
+        "success": False,
+        "message": message,
+        "reason": result
+    }
+
+
+def apply_door_events(session: Session, events: list) -> list:
+    """センサー側で記録された複数のドアイベントを発生日時の順に適用します。
+    ステートの判定と最短呼出間隔の判定は1件ずつ呼び出した場合と同じ規則に従い、イベントの発生日時を基準に行います。
+    コミットは呼出元で行って下さい。
+
+    Arguments:
+        session {Session} -- DB接続セッション
+        events {list} -- ドアイベントのリスト [{toilet_id, is_closed, occurred_at, seq}, ...]
 
-        # 現在の在室状況を更新
+    Returns:
+        list -- イベントごとの適用結果 (受け取った順) [{toilet_id, seq, success, reason, message}, ...]
+    """
+    now = dt.now()
+    results = [None] * len(events)
+    targets = []
+    for index, event in enumerate(events):
         try:
-            target_toilet = session \
-                .query(Toilet) \
-                .filter(Toilet.id == toilet_id) \
-                .one()
-        except NoResultFound:
-            message = f"トイレ #{toilet_id} が見つかりません。トイレマスター上のID設定とAPI呼び出し元のIDが合致することを確認して下さい。"
-            logger.error(f"[close] API Response. :success={False} "\
-                         f":message={message}")
-            return jsonify({
-                "success": False,
-                "message": message
-            })
-
-        # 前回更新からの経過時間を算出
-        timedelta = dt.now() - target_toilet.modified_time
-        if timedelta.total_seconds() < MIN_DOOR_EVENT_SPAN_SECONDS:
-            message = f"トイレ #{toilet_id} は {MIN_DOOR_EVENT_SPAN_SECONDS} 秒以内に更新されています。"\
-                      f"過剰反応防止のため、再度時間を置いてから呼び出して下さい。"
-            logger.warning(f"[close] API Response. :success={False} "\
-                         f":message={message}")
-            return jsonify({
+            toilet_id = int(event["toilet_id"])
+            is_closed = event["is_closed"]
+            occurred_time = parse_occurred_at(event["occurred_at"])
+            seq = event.get("seq")
+            # ステートは JSON の真偽値、シーケンス番号は0以上の整数に限る ("false" などの文字列は受け付けない)
+            if not isinstance(is_closed, bool):
+                raise ValueError(f"is_closed={is_closed!r}")
+            if seq is not None and (isinstance(seq, bool) or not isinstance(seq, int) or seq < 0):
+                raise ValueError(f"seq={seq!r}")
+        except (KeyError, TypeError, ValueError, AttributeError):
+            results[index] = {
+                "toilet_id": event.get("toilet_id") if isinstance(event, dict) else None,
+                "seq": event.get("seq") if isinstance(event, dict) else None,
                 "success": False,
-                "message": message
-            })
+                "reason": TRANSITION_INVALID,
+                "message": get_transition_message(TRANSITION_INVALID, None, None)
+            }
+            continue
 
-        target_toilet.is_closed = True
-        target_toilet.modified_time = dt.now()
-        session.add(target_toilet)
+        if now < occurred_time:
+            # センサー側の時計が進んでいる場合は受信日時として扱う
+            occurred_time = now
+        targets.append((occurred_time, seq if seq is not None else -1, index, toilet_id, is_closed))
 
-        # トイレのドアが閉められたことを表すイベントをトランザクションテーブルに追加
-        session.add(ToiletStatus(
-            toilet_id=toilet_id,
-            is_closed=True,
-            created_time=dt.now()
-        ))
+    # 発生日時、同時刻であればシーケンス番号の順に適用する
+    targets.sort(key=lambda x: (x[0], x[1], x[2]))
+    applied_seqs = set()
+    for occurred_time, seq, index, toilet_id, is_closed in targets:
+        key = (toilet_id, seq)
+        if 0 <= seq and key in applied_seqs:
+            result = TRANSITION_DUPLICATE
+        else:
+            result = transit_door_state(session, toilet_id, is_closed, occurred_time)
+            applied_seqs.add(key)
 
-        session.commit()
+        results[index] = {
+            "toilet_id": toilet_id,
+            "seq": None if seq < 0 else seq,
+            "success": result == TRANSITION_SUCCEEDED,
+            "reason": None if result == TRANSITION_SUCCEEDED else result,
+            "message": get_transition_message(result, toilet_id, is_closed)
+        }
+    return results
 
-    message = f"トイレ #{toilet_id} が使用中になりました。"
-    logger.info(f"[close] API Response. :success={True} "\
-                f":message={message}")
-    return jsonify({
-        "success": True,
-        "message": message
-    })
+
+def parse_occurred_at(occurred_at) -> dt:
+    """ドアイベントの発生日時を解釈します。
+
+    Arguments:
+        occurred_at {int, float, str} -- UNIX時間 (秒) または ISO 8601 形式の日時文字列
+
+    Returns:
+        datetime -- 発生日時 (ローカル時刻)
+    """
+    if isinstance(occurred_at, bool):
+        raise ValueError(occurred_at)
+    if isinstance(occurred_at, (int, float)):
+        return dt.fromtimestamp(occurred_at)
+
+    occurred_time = dt.fromisoformat(occurred_at)
+    if occurred_time.tzinfo is not None:
+        occurred_time = occurred_time.astimezone().replace(tzinfo=None)
+    return occurred_time
+
+
+def transit_door_state(session: Session, toilet_id: int, is_closed: bool, occurred_time: dt = None) -> str:
+    """トイレのドアステートを切り替え、入退室トランザクションテーブルにイベントを追加します。
+    現在のステートと最短呼出間隔の判定は条件付きの UPDATE 1文で行うため、同時に呼び出されても二重に記録されることはありません。
+    write-behind モードの場合は判定をメモリー上のステートで行い、DBの代わりにドアイベントジャーナルへ追記します。
+    コミットは呼出元で行って下さい。
+
+    Arguments:
+        session {Session} -- DB接続セッション
+        toilet_id {int} -- ターゲットトイレID
+        is_closed {bool} -- 切替先のステート (True=閉まった, False=開いた)
+
+    Keyword Arguments:
+        occurred_time {datetime} -- イベントの発生日時、省略時は現在日時 (default: {None})
+
+    Returns:
+        str -- 切替結果 (TRANSITION_* のいずれか)
+    """
+    from model.toilet import Toilet
+    from model.toilet_status import ToiletStatus, get_toilet_group_ids
+
+    current_state = Common.get_system_mode(session)
+    if current_state is None:
+        return TRANSITION_SYSTEM_MODE_UNKNOWN
+    if current_state == Common.SYSTEM_MODE_STOP:
+        return TRANSITION_SYSTEM_STOPPED
+
+    now = occurred_time if occurred_time is not None else dt.now()
+    if door_journal is not None:
+        reason = door_journal.append(toilet_id, is_closed, now, judge_door_transition)
+        return reason if reason is not None else TRANSITION_SUCCEEDED
+
+    # 切替元のステートであり、かつ前回更新から最短呼出間隔が経過している場合に限り更新
+    updated_count = session \
+        .query(Toilet) \
+        .filter(
+            Toilet.id == toilet_id,
+            Toilet.is_closed == (not is_closed),
+            Toilet.modified_time <= now - datetime.timedelta(seconds=MIN_DOOR_EVENT_SPAN_SECONDS)
+        ) \
+        .update({
+            Toilet.is_closed: is_closed,
+            Toilet.modified_time: now
+        }, synchronize_session=False)
+
+    if updated_count == 0:
+        # 更新できなかった場合に限り、どの条件を満たさなかったのかを調べる
+        target_toilet = session \
+            .query(Toilet.is_closed, Toilet.modified_time) \
+            .filter(Toilet.id == toilet_id) \
+            .one_or_none()
+        return judge_door_transition(target_toilet, is_closed, now) or TRANSITION_TOO_EARLY
+
+    # トイレのドアが開いた/閉められたことを表すイベントをトランザクションテーブルに追加
+    toilet_status = ToiletStatus(
+        toilet_id=toilet_id,
+        is_closed=is_closed,
+        created_time=now,
+        toilet_group_id=get_toilet_group_ids(session).get(toilet_id)
+    )
+    if not is_closed:
+        # ドアが開いた場合は、直前の入室と組にしてセッションテーブルにも追加する
+        add_toilet_sessions(session, [toilet_status])
+    session.add(toilet_status)
+    return TRANSITION_SUCCEEDED
+
+
+def judge_door_transition(current_state: tuple, is_closed: bool, now: dt) -> str:
+    """トイレの現在のステートから、ドアステートを切り替えられるかどうかを判定します。
+
+    Arguments:
+        current_state {tuple} -- トイレの現在のステート (is_closed, modified_time)、トイレが存在しない場合はNone
+        is_closed {bool} -- 切替先のステート (True=閉まった, False=開いた)
+        now {datetime} -- イベントの発生日時
+
+    Returns:
+        str -- 切替できない理由 (TRANSITION_* のいずれか)、切替できる場合はNone
+    """
+    if current_state is None:
+        return TRANSITION_NOT_FOUND
+    current_is_closed, modified_time = current_state
+    if now < modified_time:
+        return TRANSITION_OUT_OF_ORDER
+    if current_is_closed == is_closed:
+        return TRANSITION_ALREADY
+    if now - datetime.timedelta(seconds=MIN_DOOR_EVENT_SPAN_SECONDS) < modified_time:
+        return TRANSITION_TOO_EARLY
+    return None
+
+
+def get_transition_message(result: str, toilet_id: int, is_closed: bool) -> str:
+    """ドアステートの切替結果に対応する補足メッセージを返します。
+
+    Arguments:
+        result {str} -- 切替結果 (TRANSITION_* のいずれか)
+        toilet_id {int} -- ターゲットトイレID
+        is_closed {bool} -- 切替先のステート (True=閉まった, False=開いた)
+
+    Returns:
+        str -- 補足メッセージ
+    """
+    if result == TRANSITION_SUCCEEDED:
+        return f"トイレ #{toilet_id} が使用中になりました。" if is_closed else \
+               f"トイレ #{toilet_id} が空室になりました。"
+    if result == TRANSITION_SYSTEM_MODE_UNKNOWN:
+        return "システムモードを取得できませんでした。サーバー上のエラーログを確認して下さい。"
+    if result == TRANSITION_SYSTEM_STOPPED:
+        return "システムモードが停止状態です。すべての入退室ログは記録されません。"
+    if result == TRANSITION_NOT_FOUND:
+        return f"トイレ #{toilet_id} が見つかりません。トイレマスター上のID設定とAPI呼び出し元のIDが合致することを確認して下さい。"
+    if result == TRANSITION_ALREADY:
+        return f"トイレ #{toilet_id} は既に使用中です。重複防止のため入室ログは記録されません。" if is_closed else \
+               f"トイレ #{toilet_id} は既に空室です。重複防止のため退室ログは記録されません。"
+    if result == TRANSITION_OUT_OF_ORDER:
+        return f"トイレ #{toilet_id} には発生日時よりも新しいイベントが記録されています。順序を保つためこのイベントは記録されません。"
+    if result == TRANSITION_DUPLICATE:
+        return f"トイレ #{toilet_id} に対して同じシーケンス番号のイベントが重複しています。"
+    if result == TRANSITION_INVALID:
+        return "イベントの形式が正しくありません。toilet_id, is_closed, occurred_at を指定して下さい。"
+    return f"トイレ #{toilet_id} は {MIN_DOOR_EVENT_SPAN_SECONDS} 秒以内に更新されています。"\
+           f"過剰反応防止のため、再度時間を置いてから呼び出して下さい。"
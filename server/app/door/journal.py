@@ -0,0 +1,385 @@
+###############################################################################
+#    ドアイベントの書き込みを遅延させるジャーナル (write-behind モード) を定義します。
+#    ドアステートの切替はメモリー上のトイレのステートで判定し、ローカルの追記専用ファイルに記録した時点で応答します。
+#    DB (toilet_status, toilet) へは、バックグラウンドのスレッドが一定間隔または一定件数ごとにまとめて書き込みます。
+###############################################################################
+import atexit
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime as dt
+import app.common as Common
+from app.logs.toilet_session import add_toilet_sessions
+logger = Common.get_logger("door.journal")
+
+### 定数定義
+# DBに反映済みのジャーナル番号を保持するアプリケーション状態マスター上のID
+JOURNAL_APP_STATE_ID = 2
+# ジャーナルファイルを読み込む際の1回あたりのバイト数
+READ_CHUNK_BYTES = 65536
+
+
+class DoorJournal(object):
+    """ドアイベントを追記専用ファイルに記録し、DBへの書き込みを遅延させるクラスです。
+    ジャーナルファイルは同一ホスト上の全プロセスで共有し、追記はファイルロックで排他します。
+    各エントリーには連番 (ジャーナル番号) を振り、DBに反映済みの番号は反映と同じトランザクションでアプリケーション状態マスターに記録します。
+    そのため、プロセスが異常終了しても次回起動時に未反映のエントリーだけを再生できます。
+    """
+
+    def __init__(self, path: str, flush_interval_seconds: float, flush_batch_size: int, fsync: bool = True,
+                 on_flushed=None):
+        self.path = path
+        self.flush_interval_seconds = flush_interval_seconds
+        self.flush_batch_size = flush_batch_size
+        self.fsync = fsync
+        # DBに書き込んだ後に呼び出す関数 (引数なし)、不要な場合はNone
+        self.on_flushed = on_flushed
+
+        # ジャーナルファイル、およびその読込位置
+        self.fd = None
+        self.inode = None
+        self.offset = 0
+        # 追記とフラッシュをプロセス間で排他するためのロックファイル
+        self.append_lock_fd = None
+        self.flush_lock_fd = None
+        # 同一プロセス内のスレッド間の排他
+        self.append_lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+
+        # メモリー上のトイレのステート {toilet_id: (is_closed, modified_time)}
+        self.toilets = {}
+        # 読み込んだうちDBに未反映の可能性があるエントリー (ジャーナル番号順)
+        self.entries = []
+        # 読み込んだ中で最大のジャーナル番号
+        self.last_jseq = 0
+        # 前回のフラッシュ以降にこのプロセスで追記したエントリー数
+        self.pending_count = 0
+
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """ジャーナルを開き、未反映のエントリーをDBに再生した上で、バックグラウンドの書き込みスレッドを開始します。
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.append_lock_fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o664)
+        self.flush_lock_fd = os.open(self.path + ".flush", os.O_RDWR | os.O_CREAT, 0o664)
+
+        # 他のプロセスが書き込み中でない状態で、DBのステートと反映済みのジャーナル番号を揃えて読み込む
+        with self.flush_locked(), self.append_locked():
+            self.open_file()
+            self.truncate_partial_entry()
+            with Common.create_session() as session:
+                self.last_jseq = self.get_flushed_jseq(session)
+                self.toilets = self.load_toilets(session)
+            self.sync()
+        logger.info(f"[DoorJournal] Started. :path={self.path} :last_jseq={self.last_jseq} "\
+                    f":unflushed={len(self.entries)}")
+
+        # 前回終了時に未反映だったエントリーを再生する
+        self.flush()
+
+        self.thread = threading.Thread(target=self.run, name="door-journal-flusher", daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def append(self, toilet_id: int, is_closed: bool, occurred_time: dt, judge) -> str:
+        """メモリー上のステートに基づいてドアステートの切替を判定し、成功する場合はジャーナルに追記します。
+
+        Arguments:
+            toilet_id {int} -- ターゲットトイレID
+            is_closed {bool} -- 切替先のステート (True=閉まった, False=開いた)
+            occurred_time {datetime} -- イベントの発生日時
+            judge {function} -- 切替可否の判定関数 (現在のステート, 切替先のステート, 発生日時) -> 切替できない理由
+
+        Returns:
+            str -- 切替できない理由 (判定関数の戻り値)、ジャーナルに追記した場合はNone
+        """
+        with self.append_locked():
+            self.sync()
+            state = self.toilets.get(toilet_id)
+            if state is None:
+                state = self.load_toilet(toilet_id)
+
+            reason = judge(state, is_closed, occurred_time)
+            if reason is not None:
+                return reason
+
+            entry = {
+                "jseq": self.last_jseq + 1,
+                "toilet_id": toilet_id,
+                "is_closed": is_closed,
+                "time": occurred_time.isoformat()
+            }
+            line = (json.dumps(entry, separators=(",", ":")) + "\n").encode()
+            os.write(self.fd, line)
+            if self.fsync:
+                os.fsync(self.fd)
+            self.offset += len(line)
+            self.apply(entry, occurred_time)
+            self.pending_count += 1
+            if self.flush_batch_size <= self.pending_count:
+                self.wakeup.set()
+        return None
+
+    def flush(self) -> int:
+        """ジャーナルのうちDBに未反映のエントリーを1つのトランザクションでまとめて書き込みます。
+
+        Returns:
+            int -- 書き込んだエントリー数
+        """
+        from model.toilet import Toilet
+        from model.toilet_status import ToiletStatus, get_toilet_group_ids
+
+        with self.flush_locked():
+            with self.append_locked():
+                self.sync()
+                self.pending_count = 0
+                entries = list(self.entries)
+            if not entries:
+                return 0
+
+            with Common.create_session() as session:
+                flushed_jseq = self.get_flushed_jseq(session)
+                targets = [x for x in entries if flushed_jseq < x["jseq"]]
+                if targets:
+                    # 入退室トランザクションとトイレ使用セッションはまとめて INSERT し、トイレマスターは最終ステートだけを反映する
+                    # トイレグループIDはトイレグループ紐付け用マスターを1回だけ読み込んで求めておく
+                    toilet_group_ids = get_toilet_group_ids(session)
+                    statuses = [{
+                        "toilet_id": x["toilet_id"],
+                        "is_closed": x["is_closed"],
+                        "created_time": dt.fromisoformat(x["time"]),
+                        "toilet_group_id": toilet_group_ids.get(x["toilet_id"])
+                    } for x in targets]
+                    add_toilet_sessions(session, [ToiletStatus(**x) for x in statuses])
+                    session.bulk_insert_mappings(ToiletStatus, statuses)
+                    final_states = {}
+                    for entry in targets:
+                        final_states[entry["toilet_id"]] = entry
+                    session.bulk_update_mappings(Toilet, [{
+                        "id": x["toilet_id"],
+                        "is_closed": x["is_closed"],
+                        "modified_time": dt.fromisoformat(x["time"])
+                    } for x in final_states.values()])
+                    flushed_jseq = targets[-1]["jseq"]
+                    self.set_flushed_jseq(session, flushed_jseq)
+                    session.commit()
+
+            with self.append_locked():
+                self.entries = [x for x in self.entries if flushed_jseq < x["jseq"]]
+                self.compact()
+
+        if targets:
+            logger.info(f"[DoorJournal] Flushed. :count={len(targets)} :flushed_jseq={flushed_jseq}")
+            # 現況が変化したことを全プロセスに通知する
+            Common.publish_status_change()
+            if self.on_flushed is not None:
+                self.on_flushed()
+        return len(targets)
+
+    def run(self):
+        """一定間隔、または一定件数の追記ごとにジャーナルをDBに書き込みます。
+        バックグラウンドのスレッドで実行されます。
+        """
+        while True:
+            self.wakeup.wait(self.flush_interval_seconds)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("[DoorJournal] Flush failed. 次回の書き込み時に再試行します")
+
+    @contextmanager
+    def append_locked(self):
+        """ジャーナルへの追記をスレッド間、およびプロセス間で排他します。
+        """
+        with self.append_lock:
+            fcntl.flock(self.append_lock_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self.append_lock_fd, fcntl.LOCK_UN)
+
+    @contextmanager
+    def flush_locked(self):
+        """DBへの書き込みをスレッド間、およびプロセス間で排他します。
+        """
+        with self.flush_lock:
+            fcntl.flock(self.flush_lock_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self.flush_lock_fd, fcntl.LOCK_UN)
+
+    def open_file(self):
+        """ジャーナルファイルを開き、読込位置を先頭に戻します。追記ロックの取得中に呼び出して下さい。
+        """
+        if self.fd is not None:
+            os.close(self.fd)
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o664)
+        self.inode = os.fstat(self.fd).st_ino
+        self.offset = 0
+
+    def truncate_partial_entry(self):
+        """書き込み途中で異常終了したエントリー (改行で終わっていない末尾) を切り捨てます。
+        追記ロックの取得中に呼び出して下さい。
+        """
+        size = os.fstat(self.fd).st_size
+        if size == 0:
+            return
+        data = self.read_from(0)
+        end = data.rfind(b"\n") + 1
+        if end < size:
+            logger.warning(f"[DoorJournal] 書き込み途中のエントリーを切り捨てます :bytes={size - end}")
+            os.ftruncate(self.fd, end)
+
+    def read_from(self, offset: int) -> bytes:
+        """ジャーナルファイルの指定位置から末尾までを読み込みます。
+
+        Arguments:
+            offset {int} -- 読込開始位置
+
+        Returns:
+            bytes -- 読み込んだデータ
+        """
+        chunks = []
+        while True:
+            chunk = os.pread(self.fd, READ_CHUNK_BYTES, offset)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            offset += len(chunk)
+        return b"".join(chunks)
+
+    def sync(self):
+        """他のプロセスが追記したエントリーを読み込み、メモリー上のステートに反映します。
+        ジャーナルファイルが圧縮により差し替えられている場合は、新しいファイルを開き直します。
+        追記ロックの取得中に呼び出して下さい。
+        """
+        while True:
+            data = self.read_from(self.offset)
+            end = data.rfind(b"\n") + 1
+            for line in data[:end].splitlines():
+                try:
+                    entry = json.loads(line)
+                    occurred_time = dt.fromisoformat(entry["time"])
+                except (ValueError, KeyError, TypeError):
+                    logger.warning(f"[DoorJournal] 解釈できないエントリーを読み飛ばします :line={line[:200]}")
+                    continue
+                self.apply(entry, occurred_time)
+            self.offset += end
+
+            try:
+                inode = os.stat(self.path).st_ino
+            except FileNotFoundError:
+                inode = None
+            if inode == self.inode:
+                return
+            self.open_file()
+
+    def apply(self, entry: dict, occurred_time: dt):
+        """エントリーをメモリー上のステートに反映します。反映済みのジャーナル番号以下のものは無視します。
+
+        Arguments:
+            entry {dict} -- ジャーナルのエントリー {jseq, toilet_id, is_closed, time}
+            occurred_time {datetime} -- エントリーの発生日時
+        """
+        if entry["jseq"] <= self.last_jseq:
+            return
+        self.toilets[entry["toilet_id"]] = (entry["is_closed"], occurred_time)
+        self.entries.append(entry)
+        self.last_jseq = entry["jseq"]
+
+    def compact(self):
+        """DBに未反映のエントリーだけを残した新しいジャーナルファイルに差し替えます。
+        他のプロセスは次回の追記時にファイルの差し替えを検知して開き直します。
+        追記ロックの取得中に呼び出して下さい。
+        """
+        self.sync()
+        temp_path = self.path + ".tmp"
+        temp_fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o664)
+        try:
+            data = "".join(json.dumps(x, separators=(",", ":")) + "\n" for x in self.entries).encode()
+            if data:
+                os.write(temp_fd, data)
+            if self.fsync:
+                os.fsync(temp_fd)
+        finally:
+            os.close(temp_fd)
+        os.replace(temp_path, self.path)
+        self.open_file()
+        self.offset = len(data)
+
+    def load_toilets(self, session) -> dict:
+        """トイレマスターから全トイレのステートを読み込みます。
+
+        Arguments:
+            session {Session} -- DB接続セッション
+
+        Returns:
+            dict -- トイレのステート {toilet_id: (is_closed, modified_time)}
+        """
+        from model.toilet import Toilet
+        return {x.id: (x.is_closed, x.modified_time) for x in session
+                .query(Toilet.id, Toilet.is_closed, Toilet.modified_time)
+                .all()}
+
+    def load_toilet(self, toilet_id: int) -> tuple:
+        """起動後に追加されたトイレのステートをトイレマスターから読み込みます。
+        ジャーナルにエントリーが無いトイレに限り呼び出して下さい。
+
+        Arguments:
+            toilet_id {int} -- ターゲットトイレID
+
+        Returns:
+            tuple -- トイレのステート (is_closed, modified_time)、存在しない場合はNone
+        """
+        from model.toilet import Toilet
+        with Common.create_session() as session:
+            toilet = session \
+                .query(Toilet.is_closed, Toilet.modified_time) \
+                .filter(Toilet.id == toilet_id) \
+                .one_or_none()
+        if toilet is None:
+            return None
+        self.toilets[toilet_id] = (toilet.is_closed, toilet.modified_time)
+        return self.toilets[toilet_id]
+
+    def get_flushed_jseq(self, session) -> int:
+        """DBに反映済みのジャーナル番号を返します。
+
+        Arguments:
+            session {Session} -- DB接続セッション
+
+        Returns:
+            int -- 反映済みのジャーナル番号、一度も反映していない場合は0
+        """
+        from model.app_state import AppState
+        app_state = session \
+            .query(AppState.state) \
+            .filter(AppState.id == JOURNAL_APP_STATE_ID) \
+            .one_or_none()
+        return app_state.state if app_state is not None else 0
+
+    def set_flushed_jseq(self, session, jseq: int):
+        """DBに反映済みのジャーナル番号を記録します。コミットは呼出元で行って下さい。
+
+        Arguments:
+            session {Session} -- DB接続セッション
+            jseq {int} -- 反映済みのジャーナル番号
+        """
+        from model.app_state import AppState
+        app_state = session.query(AppState).filter(AppState.id == JOURNAL_APP_STATE_ID).one_or_none()
+        if app_state is None:
+            app_state = AppState(
+                id=JOURNAL_APP_STATE_ID, name="ドアイベントジャーナル",
+                comment="DBに反映済みのジャーナル番号"
+            )
+            session.add(app_state)
+        app_state.state = jseq
+        app_state.modified_time = dt.now()
@@ -32,8 +32,8 @@ def emergency() -> Response:
     logger.info(f"[emergency] API Called.")
 
     with Common.create_session() as session:
-        # 現在のシステムモードを取得
-        current_state = Common.get_system_mode(session)
+        # 現在のシステムモードを取得: 反転元となるため必ずマスターから取り直す
+        current_state = Common.get_system_mode(session, use_cache=False)
         if current_state is None:
             message = "システムモードを取得できませんでした。サーバー上のエラーログを確認して下さい。"
             return jsonify({
@@ -68,6 +68,10 @@ def emergency() -> Response:
 
         session.commit()
 
+    # 切替後のシステムモードでキャッシュを差し替え、現況が変化したことを全プロセスに通知する
+    Common.system_mode_cache.set(next_state)
+    Common.publish_status_change()
+
     logger.info(f"[emergency] API Response. "\
                 f":valid={next_state} :action={next_state_name}")
 
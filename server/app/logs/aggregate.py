@@ -0,0 +1,140 @@
+###############################################################################
+#    ログ取得APIで使用する集計処理を定義します。
+#    NumPy がインストールされている場合はそれを使い、無い場合は標準ライブラリーの bisect で同じ結果を求めます。
+#    Lambda 版 (server-for-lambda/functions/aggregate.py) とは使う関数が異なるため、こちらにはログ取得APIが使うものだけを置きます。
+#    占有秒数は、Lambda 版ではイベントの列を走査して求めますが、こちらではトイレ使用セッションテーブルの区間から求めます。
+#    いずれもドアが閉められたイベントが続く場合は最初のものを入室とするため、同じイベントからは同じ結果になります。
+###############################################################################
+from bisect import bisect_right
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def count_events_per_bucket(event_times: list, bucket_begins: list, bucket_ends: list) -> list:
+    """イベントの発生日時を集計区間ごとに数えます。
+    集計区間は [開始日時, 終了日時) の半開区間で、いずれも開始日時の昇順に並び、すべて同じ長さであるものとします。
+    区間どうしが重なっている場合、その両方に含まれるイベントはそれぞれの区間で数えます。
+    イベント1件あたり二分探索2回で済むため、期間を長くしても計算量はイベント数に比例したまま保たれます。
+    日時の代わりにエポックミリ秒などの整数を渡すこともできます (集計区間の境界も同じ単位の整数とします)。
+
+    Arguments:
+        event_times {list} -- イベントの発生日時のリスト (順不同)
+        bucket_begins {list} -- 集計区間の開始日時のリスト (昇順)
+        bucket_ends {list} -- 集計区間の終了日時のリスト (昇順)
+
+    Returns:
+        list -- 集計区間ごとのイベント件数
+    """
+    return sum_values_per_bucket(event_times, None, bucket_begins, bucket_ends)
+
+
+def sum_values_per_bucket(event_times: list, values: list, bucket_begins: list, bucket_ends: list) -> list:
+    """イベントごとの値を、その発生日時を含む集計区間ごとに合計します。
+    集計区間の条件は count_events_per_bucket() と同じです。
+
+    Arguments:
+        event_times {list} -- イベントの発生日時のリスト (順不同)
+        values {list} -- イベントごとの値のリスト (event_times と同じ順)、Noneの場合はすべて1として件数を数える
+        bucket_begins {list} -- 集計区間の開始日時のリスト (昇順)
+        bucket_ends {list} -- 集計区間の終了日時のリスト (昇順)
+
+    Returns:
+        list -- 集計区間ごとの合計値
+    """
+    bucket_count = len(bucket_begins)
+    if bucket_count == 0:
+        return []
+
+    # イベントを含む区間は [終了日時がイベントより後になる最初の区間, 開始日時がイベント以前になる最後の区間] の範囲となる
+    # 区間が重ならない限り範囲は1区間だけなので、範囲内の区間に直接加算しても計算量はイベント数に比例する
+    if numpy is not None and event_times:
+        times = to_microseconds_array(event_times)
+        first_indexes = numpy.searchsorted(to_microseconds_array(bucket_ends), times, side="right")
+        last_indexes = numpy.searchsorted(to_microseconds_array(bucket_begins), times, side="right")
+        lengths = numpy.maximum(last_indexes - first_indexes, 0)
+        # 範囲内の区間のインデックスを展開する: 例えば範囲 [3, 5) と [7, 8) は 3, 4, 7 となる
+        offsets = numpy.arange(lengths.sum()) - numpy.repeat(numpy.cumsum(lengths) - lengths, lengths)
+        indexes = numpy.repeat(first_indexes, lengths) + offsets
+        weights = None if values is None else numpy.repeat(numpy.asarray(values), lengths)
+        totals = numpy.bincount(indexes, weights=weights, minlength=bucket_count)
+        if weights is None or weights.dtype.kind in "biu":
+            return [int(x) for x in totals]
+        return [float(x) for x in totals]
+
+    totals = [0] * bucket_count
+    for index, event_time in enumerate(event_times):
+        value = 1 if values is None else values[index]
+        for bucket_index in range(bisect_right(bucket_ends, event_time), bisect_right(bucket_begins, event_time)):
+            totals[bucket_index] += value
+    return totals
+
+
+def sum_interval_seconds_per_bucket(begin_times: list, end_times: list, bucket_begins: list, bucket_ends: list) -> list:
+    """区間 (入室から退室まで等) が集計区間と重なる秒数を、集計区間ごとに合計します。
+    区間1件あたり、重なる最初の集計区間を二分探索で求めてから重なる集計区間だけを辿るため、計算量は区間数と重なりの数の和に比例します。
+
+    Arguments:
+        begin_times {list} -- 区間の開始日時のリスト (順不同)
+        end_times {list} -- 区間の終了日時のリスト (begin_times と同じ順)
+        bucket_begins {list} -- 集計区間の開始日時のリスト (昇順)
+        bucket_ends {list} -- 集計区間の終了日時のリスト (昇順)
+
+    Returns:
+        list -- 集計区間ごとの重なり秒数の合計
+    """
+    bucket_count = len(bucket_begins)
+    totals = [0.0] * bucket_count
+    for begin_time, end_time in zip(begin_times, end_times):
+        bucket_index = bisect_right(bucket_ends, begin_time)
+        while bucket_index < bucket_count and bucket_begins[bucket_index] < end_time:
+            overlap_begin = max(begin_time, bucket_begins[bucket_index])
+            overlap_end = min(end_time, bucket_ends[bucket_index])
+            if overlap_begin < overlap_end:
+                totals[bucket_index] += (overlap_end - overlap_begin).total_seconds()
+            bucket_index += 1
+    return totals
+
+
+def sum_values_per_index(indexes: list, values: list, length: int) -> list:
+    """値を、それぞれに対応するインデックスの位置ごとに合計します。
+    集計区間の境界を探索する必要が無い場合 (曜日×時間帯など、あらかじめ区間番号が分かっている場合) に使います。
+
+    Arguments:
+        indexes {list} -- 値ごとのインデックスのリスト (0 以上 length 未満)
+        values {list} -- 値のリスト (indexes と同じ順)
+        length {int} -- 結果の長さ
+
+    Returns:
+        list -- インデックスごとの合計値
+    """
+    if numpy is not None and indexes:
+        totals = numpy.bincount(numpy.asarray(indexes, dtype=numpy.int64),
+                                weights=numpy.asarray(values, dtype=numpy.float64), minlength=length)
+        return totals.tolist()
+
+    totals = [0.0] * length
+    for index, value in zip(indexes, values):
+        totals[index] += value
+    return totals
+
+
+def to_microseconds_array(values: list):
+    """日時のリストを、西暦1年1月1日からの経過マイクロ秒数を表す NumPy の整数配列に変換します。
+    datetime64 への変換よりも速く、タイムゾーンや夏時間の影響も受けません。
+    整数のリスト (エポックミリ秒など) はそのまま整数配列にするため、比較する値どうしの単位は呼出元で揃えて下さい。
+
+    Arguments:
+        values {list} -- 日時 (タイムゾーン情報無し) または整数のリスト
+
+    Returns:
+        numpy.ndarray -- 経過マイクロ秒数の配列
+    """
+    if values and isinstance(values[0], int):
+        return numpy.fromiter(values, dtype=numpy.int64, count=len(values))
+    return numpy.fromiter((
+        ((x.toordinal() * 86400 + x.hour * 3600 + x.minute * 60 + x.second) * 1000000 + x.microsecond)
+        for x in values
+    ), dtype=numpy.int64, count=len(values))
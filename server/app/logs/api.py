@@ -1,21 +1,75 @@
 ###############################################################################
 #    ログ取得APIを定義します。
+#    集計のための読み取りは読み取り専用の集計・分析用のDB接続 (analytics) で行い、ドアイベントの記録と接続やキャッシュを取り合わないようにします。
 ###############################################################################
 import sys
 sys.path.insert(0, ".")
+import collections
 import datetime
 from datetime import datetime as dt
-from sqlalchemy import func, asc, desc
+from sqlalchemy import func, asc, desc, select, and_, extract
 from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy.orm.session import Session
 
 # Flask サブモジュールとして必要なパッケージの取り込みと設定を行う
 from flask import Blueprint, request, jsonify, Response
 from flask_cors import CORS
 import app.common as Common
+from app.logs.aggregate import count_events_per_bucket, sum_values_per_bucket, sum_interval_seconds_per_bucket, \
+    sum_values_per_index
+from app.logs.rollup import get_reflected_id, get_unreflected_usages
+from app.logs.cache import LogResultCache
+from app.logs.duration import get_duration_sketches
 sub_function = Blueprint("logs", __name__, url_prefix="/logs")
 CORS(sub_function)
 logger = Common.get_logger("logs")
 
+### 定数定義
+# トイレ使用状況集計テーブル (1時間単位) から集計するかどうか
+# 無効にすると、毎回トイレ入退室トランザクションテーブルを走査して集計する
+USE_USAGE_ROLLUP = Common.get_setting("logs.use_rollup", True, type=bool)
+
+# 入退室トランザクションテーブルを走査して集計する際に、レコード作成日時の代わりにエポックミリ秒の列で絞り込むかどうか
+# 有効にする前に、エポックミリ秒の列を追加するマイグレーションを適用しておく必要がある
+USE_EPOCH_TIMESTAMPS = Common.get_setting("logs.epoch_timestamps", False, type=bool)
+
+# すべての集計区間が終わった日の集計結果を日単位で保持するキャッシュ
+log_result_cache = LogResultCache(
+    Common.get_setting("logs.cache_size", 1000, type=int),
+    Common.get_setting("logs.cache_file", None),
+    Common.get_setting("logs.cache_file_size", 10000, type=int)
+)
+
+# 応答形式: Chart.js のグラフデータ (既定)
+LOG_FORMAT_GRAPHS = "graphs"
+# 応答形式: 集計区間の定義を1回だけ送り、系列ごとの値を配列で送る列指向形式
+LOG_FORMAT_COLUMNAR = "columnar"
+# 列指向形式で占有率を整数で表す際の倍率 (小数点以下4桁)
+COLUMNAR_OCCUPANCY_SCALE = 10000
+# 集計区間の解像度: サンプリング間隔を期間の長さに応じて自動で選ぶ
+LOG_RESOLUTION_AUTO = "auto"
+# 解像度を自動で選ぶ際の、系列あたりの集計区間数の既定の上限
+MAX_BUCKETS_PER_SERIES = Common.get_setting("logs.max_buckets_per_series", 500, type=int)
+# 解像度を自動で選ぶ際のサンプリング間隔の候補 (分)、日当たりの時間帯全体を1区間とするものはこれとは別に候補とする
+AUTO_STEP_MINUTES = [5, 10, 15, 30, 60, 120, 180, 240, 360, 720]
+# 集計元: 入退室トランザクションとトイレ使用セッションから集計する (1時間単位に揃わない集計区間)
+LOG_SOURCE_RAW = "raw"
+# 集計元: トイレ使用状況集計テーブル (1時間単位) から集計する
+LOG_SOURCE_HOURLY = "hourly"
+# 集計元: トイレ使用状況集計テーブルをDB側で日単位にまとめてから集計する (日当たり1区間の場合)
+LOG_SOURCE_DAILY = "daily"
+
+# 集計テーブルから取得した集計値
+RollupUsage = collections.namedtuple("RollupUsage", ["toilet_id", "hour", "closed_count", "occupied_seconds"])
+# 使用時間の分布APIで返す分位点 (キー, 分位)
+DURATION_QUANTILES = [("p50", 0.5), ("p90", 0.9), ("p99", 0.99)]
+# ヒートマップAPIで対象とする週の数の上限
+HEATMAP_MAX_WEEKS = Common.get_setting("logs.heatmap_max_weeks", 104, type=int)
+# 1週あたりの時間帯の数 (曜日×時間帯)
+HOURS_PER_WEEK = 7 * 24
+# ヒートマップAPIの集計結果をログ取得APIのキャッシュに保持する際のキーの先頭
+LOG_HEATMAP_CACHE_KEY = "heatmap"
+
 
 @sub_function.route("/", methods=["GET"])
 def log():
@@ -28,11 +82,19 @@ def log():
         begin_hours_per_day {int} -- 日当たりの集計始端時間 (0-23)
         end_hours_per_day {int} -- 日当たりの集計終端時間 (0-23)
         step_hours {int} -- 期間内におけるサンプリング間隔 (1-24)、始端時間から終端時間の差をこの値で割り切れない場合は割り切れる時間まで延長します。
+        step_minutes {int} -- 期間内におけるサンプリング間隔 (分)、指定した場合は step_hours よりも優先します。
+        resolution {str} -- auto を指定すると、系列あたりの集計区間数が max_buckets 以下となる最も細かいサンプリング間隔を自動で選びます。step_hours, step_minutes は無視します。
+        max_buckets {int} -- resolution=auto の場合の系列あたりの集計区間数の上限 (default: logs.max_buckets_per_series)
+        format {str} -- 応答形式 (graphs=Chart.js のグラフデータ, columnar=列指向形式) (default: graphs)
 
     Returns:
         Response -- application/json = {
           "success": True of False,
           "message": 補足メッセージ,        // エラー発生時のみ。正常完了時は空文字
+          "resolution": {
+            "step_minutes": 120,           // 実際に使用したサンプリング間隔 (分)
+            "source": "hourly"             // 集計元 (raw=入退室トランザクション, hourly=1時間単位の集計テーブル, daily=集計テーブルを日単位にまとめたもの)
+          },
           "graphs": [
             {
               "type": "bar",
@@ -64,6 +126,31 @@ def log():
             ...
           ]
         }
+
+        format=columnar の場合は、ラベル文字列を含めずに集計区間の定義を1回だけ返します。
+        Response -- application/json = {
+          "success": True of False,
+          "message": 補足メッセージ,
+          "format": "columnar",
+          "resolution": { 省略 },
+          "grid": {
+            "begin_date": "2019-01-01",    // 期間開始日
+            "begin_hours_per_day": 10,     // 日当たりの集計始端時間
+            "end_hours_per_day": 19,       // 日当たりの集計終端時間
+            "step_minutes": 120,           // サンプリング間隔 (分)
+            "count": 50                    // 集計区間の数
+          },
+          "occupancy_scale": 10000,        // 占有率の倍率
+          "series": [
+            {
+              "id": 10,                    // トイレグループID
+              "name": "4F 男性用トイレ",    // トイレグループ名
+              "frequency": [0, 1, 1, ...], // 集計区間ごとのドアクローズのイベント数合計値
+              "occupancy": [2500, 10000, 0, ...]  // 集計区間ごとの占有率に倍率を掛けて整数に丸めたもの
+            },
+            ...
+          ]
+        }
     """
     end_date_default = dt.now()
     begin_date_default = end_date_default - datetime.timedelta(days=10)
@@ -72,6 +159,10 @@ def log():
     begin_hours_per_day = request.args.get("begin_hours_per_day", 10, type=int)
     end_hours_per_day = request.args.get("end_hours_per_day", 19, type=int)
     step_hours = request.args.get("step_hours", 2, type=int)
+    step_minutes = request.args.get("step_minutes", step_hours * 60, type=int)
+    resolution = request.args.get("resolution", "")
+    max_buckets = request.args.get("max_buckets", MAX_BUCKETS_PER_SERIES, type=int)
+    response_format = request.args.get("format", LOG_FORMAT_GRAPHS)
 
     from model.toilet import Toilet
     from model.toilet_group import ToiletGroup
@@ -80,7 +171,8 @@ def log():
     logger.info(f"[log] API Called. "\
                 f":begin_date={begin_date} :end_date={end_date} "\
                 f":begin_hours_per_day={begin_hours_per_day} :end_hours_per_day={end_hours_per_day} "\
-                f":step_hours={step_hours}")
+                f":step_minutes={step_minutes} :resolution={resolution} :max_buckets={max_buckets} "\
+                f":format={response_format}")
 
     # パラメーター形式変換
     begin_datetime = dt.strptime(begin_date, Common.PARAM_DATETIME_FORMAT)
@@ -99,21 +191,80 @@ def log():
         end_hours_per_day = temp
         logger.warning(f"[log] API Parameter Check. :begin_hours_per_day={end_hours_per_day}->{begin_hours_per_day} "\
                        f":end_hours_per_day={begin_hours_per_day}->{end_hours_per_day}")
-    if (end_hours_per_day - begin_hours_per_day) < step_hours:
+    if resolution == LOG_RESOLUTION_AUTO:
+        # 系列あたりの集計区間数が上限に収まる最も細かいサンプリング間隔を選ぶ
+        raw_step_minutes = step_minutes
+        step_minutes = choose_step_minutes(
+            (end_datetime - begin_datetime).days + 1,
+            end_hours_per_day - begin_hours_per_day,
+            max_buckets
+        )
+        logger.info(f"[log] API Parameter Check. :step_minutes={raw_step_minutes}->{step_minutes}")
+    if (end_hours_per_day - begin_hours_per_day) * 60 < step_minutes:
         # サンプリング間隔は始端時間と終端時間の差を超えることはできない: 日単位とする
-        raw_step_hours = step_hours
-        step_hours = end_hours_per_day - begin_hours_per_day
-        logger.warning(f"[log] API Parameter Check. :step_hours={raw_step_hours}->{step_hours}")
-    elif step_hours <= 0:
+        raw_step_minutes = step_minutes
+        step_minutes = (end_hours_per_day - begin_hours_per_day) * 60
+        logger.warning(f"[log] API Parameter Check. :step_minutes={raw_step_minutes}->{step_minutes}")
+    elif step_minutes <= 0:
         # サンプリング間隔が正しくない場合はデフォルトで3時間刻みとする
-        raw_step_hours = step_hours
-        step_hours = 3
-        logger.warning(f"[log] API Parameter Check. :step_hours={raw_step_hours}->{step_hours}")
+        raw_step_minutes = step_minutes
+        step_minutes = 3 * 60
+        logger.warning(f"[log] API Parameter Check. :step_minutes={raw_step_minutes}->{step_minutes}")
+
+    if response_format not in (LOG_FORMAT_GRAPHS, LOG_FORMAT_COLUMNAR):
+        # 応答形式が正しくない場合は既定の形式とする
+        logger.warning(f"[log] API Parameter Check. :format={response_format}->{LOG_FORMAT_GRAPHS}")
+        response_format = LOG_FORMAT_GRAPHS
 
     # 日付計算の都合上、終端日時は 24:00 とする
     end_datetime = end_datetime + datetime.timedelta(hours=24)
 
-    with Common.create_session() as session:
+    # 集計区間の境界が毎時0分に揃う場合は集計テーブルから、さらに日当たり1区間であれば日単位にまとめてから集計する
+    if not USE_USAGE_ROLLUP or step_minutes % 60 != 0:
+        source = LOG_SOURCE_RAW
+    elif step_minutes == (end_hours_per_day - begin_hours_per_day) * 60:
+        source = LOG_SOURCE_DAILY
+    else:
+        source = LOG_SOURCE_HOURLY
+
+    # 集計区間を生成し、日ごとにまとめる
+    target_begin_and_end_pairs = []
+    days = []
+    begin_minutes_per_day = begin_hours_per_day * 60
+    end_minutes_per_day = end_hours_per_day * 60
+    current_begin_minutes = begin_minutes_per_day
+    current_end_minutes = current_begin_minutes + step_minutes
+    current_datetime = begin_datetime
+
+    while current_datetime < end_datetime:
+        current_begin_datetime = current_datetime + datetime.timedelta(minutes=current_begin_minutes)
+        current_end_datetime = current_datetime + datetime.timedelta(minutes=current_end_minutes)
+        if current_begin_minutes == begin_minutes_per_day:
+            days.append({
+                "date": current_datetime,
+                "begin_index": len(target_begin_and_end_pairs)
+            })
+        target_begin_and_end_pairs.append({
+            "begin": current_begin_datetime,
+            "end": current_end_datetime
+        })
+
+        if end_minutes_per_day <= current_end_minutes:
+            # 次の日へ回す
+            current_begin_minutes = begin_minutes_per_day
+            current_datetime += datetime.timedelta(days=1)
+        else:
+            current_begin_minutes += step_minutes
+        current_end_minutes = current_begin_minutes + step_minutes
+
+    for i, day in enumerate(days):
+        day["end_index"] = days[i + 1]["begin_index"] if i + 1 < len(days) else len(target_begin_and_end_pairs)
+        day["data_end"] = target_begin_and_end_pairs[day["end_index"] - 1]["end"]
+
+    bucket_begins = [x["begin"] for x in target_begin_and_end_pairs]
+    bucket_ends = [x["end"] for x in target_begin_and_end_pairs]
+
+    with Common.create_session(Common.ANALYTICS_ENGINE_NAME) as session:
         # トイレマスターを取得
         toilets = session \
             .query( \
@@ -151,188 +302,968 @@ def log():
                 "message": message
             })
 
-        ##### 使用頻度 (抽出開始時刻よりも前から継続して入室中だったデータはカウント対象に含まれないので注意) #####
-        # 横軸ラベルを生成
-        graphs = []
-        labels = []
-        target_begin_and_end_pairs = []
-        current_begin_hours = begin_hours_per_day
-        current_end_hours = current_begin_hours + step_hours
-        current_datetime = begin_datetime
-
-        while current_datetime < end_datetime:
-            current_begin_datetime = current_datetime + datetime.timedelta(hours=current_begin_hours)
-            current_end_datetime = current_datetime + datetime.timedelta(hours=current_end_hours)
-            target_begin_and_end_pairs.append({
-                "begin": current_begin_datetime,
-                "end": current_end_datetime
-            })
-            labels.append(
-                f"{dt.strftime(current_begin_datetime, '%m-%d %H:%M')}~"\
-                f"{dt.strftime(current_end_datetime, '%H:%M')}"
-            )
+        # 系列ごとに属するトイレIDを求めておく
+        toilet_ids_by_group = [
+            [
+                x.Toilet.id
+                for x in toilets
+                if x.ToiletGroupMap is not None and x.ToiletGroupMap.toilet_group_id == series_toilet.ToiletGroup.id
+            ]
+            for series_toilet in grouped_toilets
+        ]
+
+        # すべての集計区間が終わった日の集計結果はキャッシュから取り出し、最初にキャッシュに無かった日以降だけを集計する
+        # トイレグループの構成が変わった場合は別のキーとなる
+        cache_key_base = (
+            begin_hours_per_day, end_hours_per_day, step_minutes,
+            tuple((x.ToiletGroup.id, tuple(sorted(y))) for x, y in zip(grouped_toilets, toilet_ids_by_group))
+        )
+        cache_keys = [cache_key_base + (x["date"].date().isoformat(),) for x in days]
+        cached_days = log_result_cache.get_days(session, cache_keys)
+        compute_day_index = len(days)
+        for i, key in enumerate(cache_keys):
+            if key not in cached_days:
+                compute_day_index = i
+                break
+
+        frequencies_by_group = [[] for x in grouped_toilets]
+        occupancies_by_group = [[] for x in grouped_toilets]
+        for key in cache_keys[:compute_day_index]:
+            for i, x in enumerate(cached_days[key]["frequencies"]):
+                frequencies_by_group[i].extend(x)
+            for i, x in enumerate(cached_days[key]["occupancies"]):
+                occupancies_by_group[i].extend(x)
 
-            if end_hours_per_day <= current_end_hours:
-                # 次の日へ回す
-                current_begin_hours = begin_hours_per_day
-                current_datetime += datetime.timedelta(days=1)
+        if compute_day_index < len(days):
+            # 集計テーブルから集計する場合は、集計テーブルに未反映のイベントでキャッシュが無効になるよう反映済みのIDを記録する
+            if source == LOG_SOURCE_RAW:
+                computed_id = session.query(func.max(ToiletStatus.id)).scalar() or 0
             else:
-                current_begin_hours += step_hours
-            current_end_hours = current_begin_hours + step_hours
+                computed_id = get_reflected_id(session)
+            compute_begin_index = days[compute_day_index]["begin_index"]
+            computed_frequencies, computed_occupancies = aggregate_log_series(
+                session,
+                toilets,
+                toilet_ids_by_group,
+                days[compute_day_index]["date"],
+                end_datetime,
+                bucket_begins[compute_begin_index:],
+                bucket_ends[compute_begin_index:],
+                step_minutes,
+                source,
+                group_ids=[x.ToiletGroup.id for x in grouped_toilets]
+            )
+            for i in range(len(grouped_toilets)):
+                frequencies_by_group[i].extend(computed_frequencies[i])
+                occupancies_by_group[i].extend(computed_occupancies[i])
 
-        # 系列ごとにグラフデータを分けて作成
-        for i, series_toilet in enumerate(grouped_toilets):
-            graph = {
-              "type": "bar",
-              "data": {
-                "labels": labels,
-                "datasets": [{
-                  "label": f"{series_toilet.ToiletGroup.name} - {step_hours}時間あたりの使用頻度",
-                  "data": []
-                }]
-              }
-            }
+            # すべての集計区間が終わった日の集計結果をキャッシュする
+            now = dt.now()
+            for day, key in zip(days[compute_day_index:], cache_keys[compute_day_index:]):
+                if now < day["data_end"]:
+                    break
+                log_result_cache.put(key, {
+                    "computed_id": computed_id,
+                    "data_end": day["data_end"],
+                    "frequencies": [x[day["begin_index"]:day["end_index"]] for x in frequencies_by_group],
+                    "occupancies": [x[day["begin_index"]:day["end_index"]] for x in occupancies_by_group]
+                })
+        logger.info(f"[log] Aggregated. :cached_days={compute_day_index} :computed_days={len(days) - compute_day_index}")
+
+        # API側はデータを返すだけで、見た目やオプションはクライアント側で付加してもらうポリシーとする
+        group_ids = [x.ToiletGroup.id for x in grouped_toilets]
+        group_names = [x.ToiletGroup.name for x in grouped_toilets]
+
+    if response_format == LOG_FORMAT_COLUMNAR:
+        result = build_columnar_logs(
+            group_ids,
+            group_names,
+            begin_datetime,
+            begin_hours_per_day,
+            end_hours_per_day,
+            step_minutes,
+            frequencies_by_group,
+            occupancies_by_group
+        )
+    else:
+        result = build_log_graphs(
+            group_names,
+            target_begin_and_end_pairs,
+            step_minutes,
+            frequencies_by_group,
+            occupancies_by_group
+        )
+    result["resolution"] = {
+        "step_minutes": step_minutes,
+        "source": source
+    }
+    logger.info(f"[log] API Response. :success={True} :format={response_format} :source={source} "\
+                f":buckets_length={len(target_begin_and_end_pairs)} :series_length={len(group_ids)}")
+    return jsonify(result)
+
+
+@sub_function.route("/durations", methods=["GET"])
+def durations():
+    """指定期間におけるトイレグループごとの使用時間 (入室から退室まで) の分布と分位点を返します。
+    日・時間帯単位で記録した使用時間の分布 (スケッチ) を足し合わせて求めるため、分位点は区間の代表値による推定値となります。
+    時間帯ごとの集計は入室した時刻によります。
+
+    Arguments:
+        begin_date {str} -- 期間開始日 (%Y%m%d)
+        end_date {str} -- 期間終了日 (%Y%m%d)
+
+    Returns:
+        Response -- application/json = {
+          "success": True of False,
+          "message": 補足メッセージ,        // エラー発生時のみ。正常完了時は空文字
+          "groups": [
+            {
+              "id": 10,                    // トイレグループID
+              "name": "4F 男性用トイレ",    // トイレグループ名
+              "count": 120,                // 使用回数
+              "mean": 312.5,               // 平均使用秒数、使用回数が0の場合はnull
+              "quantiles": {
+                "p50": 250.1, "p90": 640.3, "p99": 1210.8  // 使用秒数の分位点、使用回数が0の場合はnull
+              },
+              "histogram": [
+                {"lower": 237.6, "upper": 249.5, "count": 3},  // 使用秒数の区間ごとの使用回数 (使用回数が0の区間は省略)
+                ...
+              ],
+              "hours": [
+                {"hour": 0, "count": 0, "mean": null, "quantiles": { 省略 }},  // 入室した時間帯 (0-23) ごと
+                ...
+              ]
+            },
+            ...
+          ]
+        }
+    """
+    end_date_default = dt.now()
+    begin_date_default = end_date_default - datetime.timedelta(days=10)
+    begin_date = request.args.get("begin_date", dt.strftime(begin_date_default, Common.PARAM_DATETIME_FORMAT))
+    end_date = request.args.get("end_date", dt.strftime(end_date_default, Common.PARAM_DATETIME_FORMAT))
+
+    from model.toilet_group import ToiletGroup
+    from model.toilet_group_map import ToiletGroupMap
+    logger.info(f"[durations] API Called. :begin_date={begin_date} :end_date={end_date}")
+
+    # パラメーター形式変換
+    begin_datetime = dt.strptime(begin_date, Common.PARAM_DATETIME_FORMAT)
+    end_datetime = dt.strptime(end_date, Common.PARAM_DATETIME_FORMAT)
+    if end_datetime < begin_datetime:
+        # 始端日と終端日の指定が逆になっていると判断
+        temp = begin_datetime
+        begin_datetime = end_datetime
+        end_datetime = temp
+        logger.warning(f"[durations] API Parameter Check. :begin_datetime={end_datetime}->{begin_datetime} "\
+                       f":end_datetime={begin_datetime}->{end_datetime}")
+
+    with Common.create_session(Common.ANALYTICS_ENGINE_NAME) as session:
+        current_state = Common.get_system_mode(session)
+        if current_state is None:
+            message = "システムモードを取得できませんでした。サーバー上のエラーログを確認して下さい。"
+            return jsonify({
+                "success": False,
+                "message": message
+            })
+        if current_state == Common.SYSTEM_MODE_STOP:
+            message = "システムモードが停止状態です。使用時間の分布は返却しません。"
+            logger.info(f"[durations] API Response. :success={False} "\
+                        f":message={message}")
+            return jsonify({
+                "success": False,
+                "message": message
+            })
+
+        # トイレグループマスターを取得: 系列ごとに属するトイレIDを求めておく
+        groups = session \
+            .query(ToiletGroup) \
+            .order_by(asc(ToiletGroup.id)) \
+            .all()
+        toilet_ids_by_group = {x.id: [] for x in groups}
+        for group_map in session.query(ToiletGroupMap).all():
+            if group_map.toilet_group_id in toilet_ids_by_group:
+                toilet_ids_by_group[group_map.toilet_group_id].append(group_map.toilet_id)
+
+        sketches_by_group = get_duration_sketches(session, toilet_ids_by_group, begin_datetime, end_datetime)
+        group_ids = [x.id for x in groups]
+        group_names = [x.name for x in groups]
+
+    results = []
+    for group_id, group_name in zip(group_ids, group_names):
+        total_sketch, hourly_sketches = sketches_by_group[group_id]
+        result = summarize_duration_sketch(total_sketch)
+        result.update({
+            "id": group_id,
+            "name": group_name,
+            "histogram": total_sketch.histogram(),
+            "hours": [dict(summarize_duration_sketch(x), hour=hour) for hour, x in enumerate(hourly_sketches)]
+        })
+        results.append(result)
+
+    logger.info(f"[durations] API Response. :success={True} :series_length={len(results)}")
+    return jsonify({
+        "success": True,
+        "message": "",
+        "groups": results
+    })
+
+
+def summarize_duration_sketch(sketch) -> dict:
+    """使用時間の分布から使用回数、平均、分位点を求めます。
+
+    Arguments:
+        sketch {DurationSketch} -- 使用時間の分布
+
+    Returns:
+        dict -- {count, mean, quantiles}
+    """
+    return {
+        "count": sketch.count,
+        "mean": sketch.total_seconds / sketch.count if 0 < sketch.count else None,
+        "quantiles": {key: sketch.quantile(q) for key, q in DURATION_QUANTILES}
+    }
+
+
+@sub_function.route("/heatmap", methods=["GET"])
+def heatmap():
+    """直近N週間について、トイレグループごとに曜日×時間帯 (7×24) の平均使用頻度と平均占有率を返します。
+    週は月曜日の0時に始まるものとし、今週を含むN週間を対象とします。まだ始まっていない今週の時間帯は平均に含めません。
+    すべての時間帯が終わった週の集計結果はキャッシュします。
+
+    Arguments:
+        weeks {int} -- 対象とする週の数 (1-logs.heatmap_max_weeks) (default: 4)
+
+    Returns:
+        Response -- application/json = {
+          "success": True of False,
+          "message": 補足メッセージ,        // エラー発生時のみ。正常完了時は空文字
+          "weeks": 4,                      // 実際に対象とした週の数
+          "begin_date": "2019-01-07",      // 対象期間の開始日 (月曜日)
+          "end_date": "2019-02-03",        // 対象期間の終了日 (日曜日)
+          "groups": [
+            {
+              "id": 10,                    // トイレグループID
+              "name": "4F 男性用トイレ",    // トイレグループ名
+              "frequency": [               // [曜日 (0=月曜日 - 6=日曜日)][時間帯 (0-23)] ごとの、1週あたりのドアクローズのイベント数の平均値
+                [0.0, 0.25, ...],
+                ...
+              ],
+              "occupancy": [               // [曜日][時間帯] ごとの占有率の平均値
+                [0.0, 0.01, ...],
+                ...
+              ]
+            },
+            ...
+          ]
+        }
+        まだ1週も始まっていない時間帯 (weeks=1 の場合の今後の時間帯) は null とします。
+    """
+    weeks = request.args.get("weeks", 4, type=int)
+    logger.info(f"[heatmap] API Called. :weeks={weeks}")
+
+    from model.toilet import Toilet
+    from model.toilet_group import ToiletGroup
+    from model.toilet_group_map import ToiletGroupMap
+    from model.toilet_status import ToiletStatus
+
+    if weeks is None or weeks <= 0:
+        # 週の数が正しくない場合はデフォルトで4週間とする
+        logger.warning(f"[heatmap] API Parameter Check. :weeks={weeks}->4")
+        weeks = 4
+    elif HEATMAP_MAX_WEEKS < weeks:
+        logger.warning(f"[heatmap] API Parameter Check. :weeks={weeks}->{HEATMAP_MAX_WEEKS}")
+        weeks = HEATMAP_MAX_WEEKS
+
+    # 今週の月曜日0時を起点に、対象とする週を求める
+    now = dt.now()
+    current_week_begin = dt(now.year, now.month, now.day) - datetime.timedelta(days=now.weekday())
+    week_begins = [current_week_begin - datetime.timedelta(weeks=weeks - 1 - x) for x in range(weeks)]
+    end_datetime = current_week_begin + datetime.timedelta(weeks=1)
+
+    with Common.create_session(Common.ANALYTICS_ENGINE_NAME) as session:
+        # トイレマスターを取得
+        toilets = session \
+            .query( \
+                Toilet,
+                ToiletGroupMap
+            ) \
+            .outerjoin(ToiletGroupMap, Toilet.id == ToiletGroupMap.toilet_id) \
+            .all()
+
+        # トイレグループマスターを取得
+        groups = session \
+            .query(ToiletGroup) \
+            .order_by(asc(ToiletGroup.id)) \
+            .all()
+
+        current_state = Common.get_system_mode(session)
+        if current_state is None:
+            message = "システムモードを取得できませんでした。サーバー上のエラーログを確認して下さい。"
+            return jsonify({
+                "success": False,
+                "message": message
+            })
+        if current_state == Common.SYSTEM_MODE_STOP:
+            message = "システムモードが停止状態です。入退室ログは返却しません。"
+            logger.info(f"[heatmap] API Response. :success={False} "\
+                        f":message={message}")
+            return jsonify({
+                "success": False,
+                "message": message
+            })
 
-            # この系列に属するトイレマスターのレコードを抽出
-            target_toilets_id_list = [
+        # 系列ごとに属するトイレIDを求めておく
+        toilet_ids_by_group = [
+            [
                 x.Toilet.id
                 for x in toilets
-                if x.ToiletGroupMap.toilet_group_id == series_toilet.ToiletGroupMap.toilet_group_id
+                if x.ToiletGroupMap is not None and x.ToiletGroupMap.toilet_group_id == group.id
             ]
+            for group in groups
+        ]
 
-            # この系列に属するトイレ入退室トランザクションテーブルで区間内に該当するレコードを抽出
-            target_statuses_all = session \
-                .query(ToiletStatus) \
-                .filter(
-                    begin_datetime <= ToiletStatus.created_time,
-                    ToiletStatus.created_time < end_datetime,
-                    ToiletStatus.toilet_id.in_(target_toilets_id_list)
-                ) \
-                .order_by(asc(ToiletStatus.created_time)) \
-                .all()
-
-            # 先頭のサンプリング時間から順にドアクローズイベントの件数を抽出していく
-            data_frequency = []
-            start_index = 0
-            for one_of_begin_and_end_pairs in target_begin_and_end_pairs:
-                sampling_count = 0
-
-                for n, target_status in enumerate(target_statuses_all[start_index:]):
-                    if one_of_begin_and_end_pairs["begin"] <= target_status.created_time and \
-                            target_status.created_time < one_of_begin_and_end_pairs["end"] and \
-                            target_status.is_closed:
-                        # 対象区間内のレコードであればカウント
-                        sampling_count += 1
-                    elif one_of_begin_and_end_pairs["end"] <= target_status.created_time:
-                        # 対象区間から出た時点で抜ける
-                        start_index = n
-                        break
-
-                data_frequency.append(sampling_count)
-
-            # 出来上がったグラフデータをグラフリストに格納
-            graph["data"]["datasets"][0]["data"] = data_frequency
-            graphs.append(graph)
-
-        ##### 占有率 (抽出開始時刻よりも前から継続して入室中だったデータはカウント対象に含まれないので注意) #####
-        # 系列ごとにグラフデータを分けて作成
-        for i, series_toilet in enumerate(grouped_toilets):
-            graph = {
-              "type": "line",
-              "data": {
-                "labels": labels,
-                "datasets": [{
-                  "label": f"{series_toilet.ToiletGroup.name} - {step_hours}時間あたりの占有率",
-                  "data": []
-                }]
-              }
-            }
+        # すべての時間帯が終わった週の集計結果はキャッシュから取り出し、最初にキャッシュに無かった週以降だけを集計する
+        # キャッシュはログ取得APIと共用し、キーの先頭で区別する
+        cache_key_base = (
+            LOG_HEATMAP_CACHE_KEY,
+            tuple((x.id, tuple(sorted(y))) for x, y in zip(groups, toilet_ids_by_group))
+        )
+        cache_keys = [cache_key_base + (x.date().isoformat(),) for x in week_begins]
+        cached_weeks = log_result_cache.get_days(session, cache_keys)
+        compute_week_index = len(week_begins)
+        for i, key in enumerate(cache_keys):
+            if key not in cached_weeks:
+                compute_week_index = i
+                break
 
-            # この系列に属するトイレマスターのレコードを抽出
-            target_toilets_id_list = [
-                x.Toilet.id
+        # 系列ごと、週ごとの曜日×時間帯の集計値 (長さ HOURS_PER_WEEK)
+        frequencies_by_group = [[] for x in groups]
+        occupancies_by_group = [[] for x in groups]
+        for key in cache_keys[:compute_week_index]:
+            for i, x in enumerate(cached_weeks[key]["frequencies"]):
+                frequencies_by_group[i].append(x)
+            for i, x in enumerate(cached_weeks[key]["occupancies"]):
+                occupancies_by_group[i].append(x)
+
+        if compute_week_index < len(week_begins):
+            # 集計テーブルから集計する場合は、集計テーブルに未反映のイベントでキャッシュが無効になるよう反映済みのIDを記録する
+            if not USE_USAGE_ROLLUP:
+                computed_id = session.query(func.max(ToiletStatus.id)).scalar() or 0
+            else:
+                computed_id = get_reflected_id(session)
+            computed_frequencies, computed_occupancies = aggregate_weekly_usage(
+                session,
+                toilets,
+                toilet_ids_by_group,
+                week_begins[compute_week_index],
+                len(week_begins) - compute_week_index,
+                group_ids=[x.id for x in groups]
+            )
+            for i in range(len(groups)):
+                frequencies_by_group[i].extend(computed_frequencies[i])
+                occupancies_by_group[i].extend(computed_occupancies[i])
+
+            # すべての時間帯が終わった週の集計結果をキャッシュする
+            for week_index in range(compute_week_index, len(week_begins)):
+                week_end = week_begins[week_index] + datetime.timedelta(weeks=1)
+                if now < week_end:
+                    break
+                log_result_cache.put(cache_keys[week_index], {
+                    "computed_id": computed_id,
+                    "data_end": week_end,
+                    "frequencies": [x[week_index] for x in frequencies_by_group],
+                    "occupancies": [x[week_index] for x in occupancies_by_group]
+                })
+        logger.info(f"[heatmap] Aggregated. :cached_weeks={compute_week_index} "\
+                    f":computed_weeks={len(week_begins) - compute_week_index}")
+
+        group_ids = [x.id for x in groups]
+        group_names = [x.name for x in groups]
+
+    # 曜日×時間帯ごとに、その時間帯が始まっている週の数で平均する
+    elapsed_hours = int((now - current_week_begin).total_seconds() // 3600)
+    week_counts = [weeks if x <= elapsed_hours else weeks - 1 for x in range(HOURS_PER_WEEK)]
+    results = []
+    for group_id, group_name, frequencies, occupancies in \
+            zip(group_ids, group_names, frequencies_by_group, occupancies_by_group):
+        mean_frequencies = [
+            sum(x) / week_count if 0 < week_count else None
+            for x, week_count in zip(zip(*frequencies), week_counts)
+        ]
+        mean_occupancies = [
+            sum(x) / week_count if 0 < week_count else None
+            for x, week_count in zip(zip(*occupancies), week_counts)
+        ]
+        results.append({
+            "id": group_id,
+            "name": group_name,
+            "frequency": [mean_frequencies[x:x + 24] for x in range(0, HOURS_PER_WEEK, 24)],
+            "occupancy": [mean_occupancies[x:x + 24] for x in range(0, HOURS_PER_WEEK, 24)]
+        })
+
+    logger.info(f"[heatmap] API Response. :success={True} :weeks={weeks} :series_length={len(results)}")
+    return jsonify({
+        "success": True,
+        "message": "",
+        "weeks": weeks,
+        "begin_date": week_begins[0].date().isoformat(),
+        "end_date": (end_datetime - datetime.timedelta(days=1)).date().isoformat(),
+        "groups": results
+    })
+
+
+def aggregate_weekly_usage(session: Session, toilets: list, toilet_ids_by_group: list,
+                           begin_datetime: dt, week_count: int, group_ids: list = None) -> tuple:
+    """指定した週 (月曜日0時始まり) 以降の連続した週について、系列ごと・週ごとに曜日×時間帯の使用回数と占有率を求めます。
+    集計テーブルを使う場合は、期間内の集計値を1回で取得し、トイレ×週×曜日×時間帯の位置ごとにまとめて合計します。
+    集計テーブルを使わない場合は、1時間刻みの集計区間で aggregate_log_series() により集計します。
+
+    Arguments:
+        session {Session} -- DB接続セッション
+        toilets {list} -- トイレマスターとトイレグループ紐付けの組 (Toilet, ToiletGroupMap) のリスト
+        toilet_ids_by_group {list} -- 系列ごとに属するトイレIDのリスト
+        begin_datetime {datetime} -- 最初の週の開始日時 (月曜日0時)
+        week_count {int} -- 週の数
+
+    Keyword Arguments:
+        group_ids {list} -- 系列ごとのトイレグループID、aggregate_log_series() にそのまま渡す (default: {None})
+
+    Returns:
+        tuple -- (系列ごと・週ごとの使用回数のリスト, 系列ごと・週ごとの占有率のリスト)、いずれも週ごとに長さ HOURS_PER_WEEK
+    """
+    from model.toilet_usage_hourly import ToiletUsageHourly
+
+    hour_count = week_count * HOURS_PER_WEEK
+    end_datetime = begin_datetime + datetime.timedelta(hours=hour_count)
+    # 入室中のものは現在日時まで占有しているものとして扱い、まだ来ていない時間帯には含めない
+    now = dt.now()
+
+    if not USE_USAGE_ROLLUP:
+        bucket_begins = [begin_datetime + datetime.timedelta(hours=x) for x in range(hour_count)]
+        bucket_ends = [x + datetime.timedelta(hours=1) for x in bucket_begins]
+        frequencies_by_group, occupancies_by_group = aggregate_log_series(
+            session,
+            toilets,
+            toilet_ids_by_group,
+            begin_datetime,
+            min(now, end_datetime),
+            bucket_begins,
+            bucket_ends,
+            60,
+            LOG_SOURCE_RAW,
+            group_ids=group_ids
+        )
+    else:
+        # 集計テーブルから、期間に含まれる時間ごとの集計値を取得する
+        group_indexes_by_toilet = {}
+        for i, toilet_ids in enumerate(toilet_ids_by_group):
+            for toilet_id in toilet_ids:
+                group_indexes_by_toilet.setdefault(toilet_id, []).append(i)
+        # ORMオブジェクトもクエリー結果の行オブジェクトも介さず、値のタプルで受け取る
+        # 経過時間数はDBの種類に依存する日付関数を使わず、取得した集計日時から求める
+        usages = session.execute(
+            select([
+                ToiletUsageHourly.toilet_id,
+                ToiletUsageHourly.hour,
+                ToiletUsageHourly.closed_count,
+                ToiletUsageHourly.occupied_seconds
+            ])
+            .where(and_(
+                begin_datetime <= ToiletUsageHourly.hour,
+                ToiletUsageHourly.hour < end_datetime,
+                ToiletUsageHourly.toilet_id.in_(list(group_indexes_by_toilet.keys()))
+            ))
+        ).fetchall()
+
+        # 系列の位置と経過時間数から一次元のインデックスを求め、全系列分をまとめて1回で合計する
+        indexes = []
+        closed_counts = []
+        occupied_seconds = []
+        for toilet_id, hour, closed_count, occupied_second in usages:
+            offset = int((hour - begin_datetime).total_seconds() // 3600)
+            for i in group_indexes_by_toilet[toilet_id]:
+                indexes.append(i * hour_count + offset)
+                closed_counts.append(closed_count)
+                occupied_seconds.append(occupied_second)
+
+        # 集計テーブルに未反映のイベントは、入退室トランザクションとトイレ使用セッションから直接補う
+        # 反映済みのIDは集計テーブルを読んだ後に取得し、並行して反映が進んでも同じイベントを二重に数えないようにする
+        unreflected_statuses, unreflected_sessions = get_unreflected_usages(
+            session, get_reflected_id(session), begin_datetime, end_datetime
+        )
+        for status in unreflected_statuses:
+            offset = int((status.created_time - begin_datetime).total_seconds() // 3600)
+            for i in group_indexes_by_toilet.get(status.toilet_id, []):
+                indexes.append(i * hour_count + offset)
+                closed_counts.append(1)
+                occupied_seconds.append(0)
+
+        # 入室中のまま退室していないものは集計テーブルに含まれないため、トイレマスターの現在のステートから補う
+        # 退室が未反映のトイレ使用セッションとあわせて、トイレごとの (入室日時, 退室日時) として時間帯ごとに振り分ける
+        intervals = [
+            (toilet.id, toilet.modified_time, min(now, end_datetime))
+            for toilet in {
+                x.Toilet.id: x.Toilet
                 for x in toilets
-                if x.ToiletGroupMap.toilet_group_id == series_toilet.ToiletGroupMap.toilet_group_id
-            ]
+                if x.Toilet.is_closed and x.Toilet.modified_time < min(now, end_datetime)
+            }.values()
+        ]
+        intervals.extend([(x.toilet_id, x.started_at, min(x.ended_at, end_datetime)) for x in unreflected_sessions])
+        for toilet_id, interval_begin, interval_end in intervals:
+            interval_begin = max(interval_begin, begin_datetime)
+            first_offset = int((interval_begin - begin_datetime).total_seconds() // 3600)
+            bucket_begins = [begin_datetime + datetime.timedelta(hours=x) for x in range(first_offset, hour_count)]
+            bucket_ends = [x + datetime.timedelta(hours=1) for x in bucket_begins]
+            interval_times = sum_interval_seconds_per_bucket([interval_begin], [interval_end], bucket_begins, bucket_ends)
+            for i in group_indexes_by_toilet.get(toilet_id, []):
+                for offset, interval_time in enumerate(interval_times, start=first_offset):
+                    if 0 < interval_time:
+                        indexes.append(i * hour_count + offset)
+                        closed_counts.append(0)
+                        occupied_seconds.append(interval_time)
+
+        closed_count_totals = sum_values_per_index(indexes, closed_counts, len(toilet_ids_by_group) * hour_count)
+        occupied_second_totals = sum_values_per_index(indexes, occupied_seconds, len(toilet_ids_by_group) * hour_count)
+
+        frequencies_by_group = []
+        occupancies_by_group = []
+        for i, toilet_ids in enumerate(toilet_ids_by_group):
+            frequencies_by_group.append(closed_count_totals[i * hour_count:(i + 1) * hour_count])
+            # 占有率は系列内の個室全体で相加平均したものとし、個室が1つも紐付いていない系列は常に0とする
+            max_occupancy_time = 3600 * len(toilet_ids)
+            occupancies_by_group.append([
+                x / max_occupancy_time if toilet_ids else 0
+                for x in occupied_second_totals[i * hour_count:(i + 1) * hour_count]
+            ])
+
+    # 週ごとに分ける
+    return (
+        [
+            [x[week * HOURS_PER_WEEK:(week + 1) * HOURS_PER_WEEK] for week in range(week_count)]
+            for x in frequencies_by_group
+        ],
+        [
+            [x[week * HOURS_PER_WEEK:(week + 1) * HOURS_PER_WEEK] for week in range(week_count)]
+            for x in occupancies_by_group
+        ]
+    )
 
-            # この系列に属するトイレ入退室トランザクションテーブルで区間内に該当するレコードを抽出
-            target_statuses_all = session \
-                .query(ToiletStatus) \
-                .filter(
-                    begin_datetime <= ToiletStatus.created_time,
-                    ToiletStatus.created_time < end_datetime,
-                    ToiletStatus.toilet_id.in_(target_toilets_id_list)
-                ) \
-                .order_by(asc(ToiletStatus.created_time)) \
-                .all()
-
-            data_occupancy = []
-            start_index = 0
-
-            # 個室1室あたりが最大占有率になる時間秒数
-            max_occupancy_time = step_hours * 60 * 60
-
-            # トイレIDごとに直前に入室した時刻を記憶できるようにしておく
-            temp_last_start_times = {
-                x: None
-                for x in target_toilets_id_list
-            }
-
-            # 先頭のサンプリング時間から順に抽出していく
-            for m, one_of_begin_and_end_pairs in enumerate(target_begin_and_end_pairs):
-                # 抽出対象区間をまたいで占有している場合は現在の抽出開始時刻に合わせておく
-                temp_last_start_times = {
-                    x: None if temp_last_start_times[x] is None else one_of_begin_and_end_pairs["begin"]
-                    for x in target_toilets_id_list
-                }
-
-                # 抽出対象区間内における個室ごとの占有時間累計秒数
-                occupied_times = {
-                    x: 0
-                    for x in target_toilets_id_list
-                }
-
-                for n, target_status in enumerate(target_statuses_all[start_index:]):
-                    if one_of_begin_and_end_pairs["begin"] <= target_status.created_time and \
-                            target_status.created_time < one_of_begin_and_end_pairs["end"]:
-                        if target_status.is_closed:
-                            # 対象区間内の入室記録にヒットしたら占有時間の計算を開始する
-                            temp_last_start_times[target_status.toilet_id] = target_status.created_time
-                        elif temp_last_start_times[target_status.toilet_id] is not None:
-                            # 対象区間内の退室記録にヒットしたら占有時間の計算を完了する
-                            time_delta = target_status.created_time - temp_last_start_times[target_status.toilet_id]
-                            occupied_times[target_status.toilet_id] += time_delta.total_seconds()
-                            temp_last_start_times[target_status.toilet_id] = None
-                    elif one_of_begin_and_end_pairs["end"] <= target_status.created_time:
-                        # 抽出対象区間から抜けたらその時間の集計を完了する
-                        start_index = n
-
-                        # 抽出対象区間の終端まで入室中だったものはその終端で区切る
-                        for id, last_start_time in temp_last_start_times.items():
-                            if last_start_time is not None:
-                                time_delta = one_of_begin_and_end_pairs["end"] - temp_last_start_times[target_status.toilet_id]
-                                occupied_times[target_status.toilet_id] += time_delta.total_seconds()
-                                # NOTE: 次の抽出対象区間に回った後にその抽出開始時刻で占有時間の計算を開始する
-
-                        break
-
-                # トイレグループ内の個室ごとの占有時間を理論上のMAX占有時間で割った割合について、トイレグループ内の個室全体で相加平均したものをこのトイレグループの占有率とする
-                data_occupancy.append(
-                  sum([
-                    (occupied_time / max_occupancy_time)
-                    for x, occupied_time in occupied_times.items()
-                  ]) / len(occupied_times)
-                )
 
-            # 出来上がったグラフデータをグラフリストに格納
-            graph["data"]["datasets"][0]["data"] = data_occupancy
-            graphs.append(graph)
+def build_log_graphs(group_names: list, pairs: list, step_minutes: int,
+                     frequencies_by_group: list, occupancies_by_group: list) -> dict:
+    """集計結果から Chart.js のグラフデータ形式の応答データを生成します。
 
-    # API側はデータを返すだけで、見た目やオプションはクライアント側で付加してもらうポリシーとする
-    result = {
+    Arguments:
+        group_names {list} -- 系列ごとのトイレグループ名
+        pairs {list} -- 集計区間のリスト [{begin, end}, ...]
+        step_minutes {int} -- サンプリング間隔 (分)
+        frequencies_by_group {list} -- 系列ごとの使用頻度のリスト
+        occupancies_by_group {list} -- 系列ごとの占有率のリスト
+
+    Returns:
+        dict -- 応答データ
+    """
+    # 横軸ラベルを生成
+    step_name = format_step_name(step_minutes)
+    labels = [
+        f"{dt.strftime(x['begin'], '%m-%d %H:%M')}~"\
+        f"{dt.strftime(x['end'], '%H:%M')}"
+        for x in pairs
+    ]
+
+    ##### 使用頻度 (抽出開始時刻よりも前から継続して入室中だったデータはカウント対象に含まれないので注意) #####
+    # 系列ごとにグラフデータを分けて作成
+    graphs = []
+    for group_name, data_frequency in zip(group_names, frequencies_by_group):
+        graphs.append({
+          "type": "bar",
+          "data": {
+            "labels": labels,
+            "datasets": [{
+              "label": f"{group_name} - {step_name}あたりの使用頻度",
+              "data": data_frequency
+            }]
+          }
+        })
+
+    ##### 占有率 (抽出開始時刻よりも前から継続して入室中だったものは、その開始時刻から占有しているものとして扱う) #####
+    # 系列ごとにグラフデータを分けて作成
+    for group_name, data_occupancy in zip(group_names, occupancies_by_group):
+        graphs.append({
+          "type": "line",
+          "data": {
+            "labels": labels,
+            "datasets": [{
+              "label": f"{group_name} - {step_name}あたりの占有率",
+              "data": data_occupancy
+            }]
+          }
+        })
+
+    return {
         "success": True,
         "message": "",
         "graphs": graphs
     }
-    logger.info(f"[log] API Response. :success={True} :graphs_length={len(graphs)}")
-    return jsonify(result)
+
+
+def build_columnar_logs(group_ids: list, group_names: list, begin_datetime: dt, begin_hours_per_day: int,
+                        end_hours_per_day: int, step_minutes: int,
+                        frequencies_by_group: list, occupancies_by_group: list) -> dict:
+    """集計結果から列指向形式の応答データを生成します。
+    集計区間はクライアント側で期間開始日と日当たりの時間帯の定義から復元するため、ラベル文字列は含めません。
+
+    Arguments:
+        group_ids {list} -- 系列ごとのトイレグループID
+        group_names {list} -- 系列ごとのトイレグループ名
+        begin_datetime {datetime} -- 期間開始日
+        begin_hours_per_day {int} -- 日当たりの集計始端時間
+        end_hours_per_day {int} -- 日当たりの集計終端時間
+        step_minutes {int} -- サンプリング間隔 (分)
+        frequencies_by_group {list} -- 系列ごとの使用頻度のリスト
+        occupancies_by_group {list} -- 系列ごとの占有率のリスト
+
+    Returns:
+        dict -- 応答データ
+    """
+    return {
+        "success": True,
+        "message": "",
+        "format": LOG_FORMAT_COLUMNAR,
+        "grid": {
+            "begin_date": begin_datetime.date().isoformat(),
+            "begin_hours_per_day": begin_hours_per_day,
+            "end_hours_per_day": end_hours_per_day,
+            "step_minutes": step_minutes,
+            "count": len(frequencies_by_group[0]) if frequencies_by_group else 0
+        },
+        "occupancy_scale": COLUMNAR_OCCUPANCY_SCALE,
+        "series": [{
+            "id": group_id,
+            "name": group_name,
+            "frequency": data_frequency,
+            "occupancy": [round(x * COLUMNAR_OCCUPANCY_SCALE) for x in data_occupancy]
+        } for group_id, group_name, data_frequency, data_occupancy in zip(
+            group_ids, group_names, frequencies_by_group, occupancies_by_group
+        )]
+    }
+
+
+def aggregate_log_series(session: Session, toilets: list, toilet_ids_by_group: list, begin_datetime: dt, end_datetime: dt,
+                         bucket_begins: list, bucket_ends: list, step_minutes: int, source: str,
+                         group_ids: list = None) -> tuple:
+    """指定期間について、系列 (トイレグループ) ごと、集計区間ごとの使用頻度と占有率を求めます。
+
+    Arguments:
+        session {Session} -- DB接続セッション
+        toilets {list} -- トイレマスターとトイレグループ紐付けの組 (Toilet, ToiletGroupMap) のリスト
+        toilet_ids_by_group {list} -- 系列ごとに属するトイレIDのリスト
+        begin_datetime {datetime} -- 期間開始日時
+        end_datetime {datetime} -- 期間終了日時
+        bucket_begins {list} -- 集計区間の開始日時のリスト (昇順、期間開始日時以降)
+        bucket_ends {list} -- 集計区間の終了日時のリスト (昇順)
+        step_minutes {int} -- サンプリング間隔 (分)
+        source {str} -- 集計元 (LOG_SOURCE_* のいずれか)
+
+    Keyword Arguments:
+        group_ids {list} -- 系列ごとのトイレグループID、指定した場合は入退室トランザクションをトイレグループIDの列で絞り込む (default: {None})
+
+    Returns:
+        tuple -- (系列ごとの使用頻度のリスト, 系列ごとの占有率のリスト)
+    """
+    from model.toilet_status import ToiletStatus, to_epoch_milliseconds
+    from model.toilet_usage_hourly import ToiletUsageHourly
+    from model.toilet_session import ToiletSession
+
+    # トイレIDごとの所属系列のインデックスを求めておく
+    group_indexes_by_toilet = {}
+    for i, toilet_ids in enumerate(toilet_ids_by_group):
+        for toilet_id in toilet_ids:
+            group_indexes_by_toilet.setdefault(toilet_id, []).append(i)
+
+    # 入退室トランザクションに写したトイレグループIDで振り分けられるのは、どのトイレも1つのトイレグループだけに紐付いている場合に限る
+    # 複数のトイレグループに紐付いたトイレがある場合は、トイレIDから振り分ける
+    use_group_column = group_ids is not None and all(len(x) == 1 for x in group_indexes_by_toilet.values())
+
+    statuses_by_group = [[] for x in toilet_ids_by_group]
+    usages_by_group = [[] for x in toilet_ids_by_group]
+    toilet_sessions_by_group = [[] for x in toilet_ids_by_group]
+
+    # 入室中のまま退室していないものは集計テーブル・セッションテーブルのいずれにも含まれないため、トイレマスターの現在のステートから補う
+    # 期間の終端より後に入室したものは対象外とする
+    ongoing_toilets = list({
+        x.Toilet.id: x.Toilet
+        for x in toilets
+        if x.Toilet.is_closed and x.Toilet.modified_time < end_datetime
+    }.values())
+
+    if source == LOG_SOURCE_HOURLY:
+        # 区間内の時間帯ごとの集計値を全グループ分まとめて1回で取得する
+        for usage in session \
+                .query(
+                    ToiletUsageHourly.toilet_id,
+                    ToiletUsageHourly.hour,
+                    ToiletUsageHourly.closed_count,
+                    ToiletUsageHourly.occupied_seconds
+                ) \
+                .filter(
+                    begin_datetime <= ToiletUsageHourly.hour,
+                    ToiletUsageHourly.hour < end_datetime
+                ) \
+                .all():
+            for i in group_indexes_by_toilet.get(usage.toilet_id, []):
+                usages_by_group[i].append(usage)
+    elif source == LOG_SOURCE_DAILY:
+        # 日当たりの時間帯に含まれる集計値をDB側で日ごとに合計して取得する
+        # 取得件数はトイレ数×日数で済むため、期間を長くしても応答時間がほとんど変わらない
+        begin_hour = bucket_begins[0].hour if bucket_begins else 0
+        end_hour = begin_hour + step_minutes // 60
+        # 日付と時刻は、DBの種類ごとの日付関数に読み替えられる EXTRACT で取り出す
+        days = [extract(x, ToiletUsageHourly.hour) for x in ["year", "month", "day"]]
+        hour_of_day = extract("hour", ToiletUsageHourly.hour)
+        for usage in session \
+                .query(
+                    ToiletUsageHourly.toilet_id,
+                    days[0].label("year"),
+                    days[1].label("month"),
+                    days[2].label("day"),
+                    func.sum(ToiletUsageHourly.closed_count).label("closed_count"),
+                    func.sum(ToiletUsageHourly.occupied_seconds).label("occupied_seconds")
+                ) \
+                .filter(
+                    begin_datetime <= ToiletUsageHourly.hour,
+                    ToiletUsageHourly.hour < end_datetime,
+                    begin_hour <= hour_of_day,
+                    hour_of_day < end_hour
+                ) \
+                .group_by(ToiletUsageHourly.toilet_id, *days) \
+                .all():
+            # 日ごとの合計値は、その日の集計区間の開始日時に発生したものとして扱う
+            daily_usage = RollupUsage(
+                usage.toilet_id,
+                dt(int(usage.year), int(usage.month), int(usage.day), begin_hour),
+                usage.closed_count,
+                usage.occupied_seconds
+            )
+            for i in group_indexes_by_toilet.get(usage.toilet_id, []):
+                usages_by_group[i].append(daily_usage)
+    else:
+        if use_group_column:
+            # トイレ入退室トランザクションをトイレグループごとに区間で絞り込み、トイレグループ・発生日時の順に取得する
+            # トイレIDの一覧による絞り込みとトイレグループ紐付けの参照が不要になり、使用頻度に数えないドアが開いたイベントもDB側で除く
+            # エポックミリ秒を使う場合は、トイレグループIDとエポックミリ秒のインデックスで絞り込む
+            if USE_EPOCH_TIMESTAMPS:
+                time_column = ToiletStatus.created_ms
+                begin_value, end_value = to_epoch_milliseconds(begin_datetime), to_epoch_milliseconds(end_datetime)
+            else:
+                time_column = ToiletStatus.created_time
+                begin_value, end_value = begin_datetime, end_datetime
+            group_indexes = {x: i for i, x in enumerate(group_ids)}
+            for target_status in session \
+                    .query(
+                        ToiletStatus.toilet_group_id,
+                        ToiletStatus.is_closed,
+                        time_column
+                    ) \
+                    .filter(
+                        ToiletStatus.toilet_group_id.in_([x for x, y in zip(group_ids, toilet_ids_by_group) if y]),
+                        begin_value <= time_column,
+                        time_column < end_value,
+                        ToiletStatus.is_closed == True
+                    ) \
+                    .order_by(asc(ToiletStatus.toilet_group_id), asc(time_column)) \
+                    .all():
+                statuses_by_group[group_indexes[target_status.toilet_group_id]].append(target_status)
+        elif USE_EPOCH_TIMESTAMPS:
+            # 区間内のトイレ入退室トランザクションをエポックミリ秒の整数の範囲で絞り込んで取得し、トイレグループごとに振り分ける
+            # 日時の文字列への変換・比較と日時オブジェクトの生成を省き、整数のまま集計区間に振り分ける
+            for target_status in session \
+                    .query(
+                        ToiletStatus.toilet_id,
+                        ToiletStatus.is_closed,
+                        ToiletStatus.created_ms
+                    ) \
+                    .filter(
+                        to_epoch_milliseconds(begin_datetime) <= ToiletStatus.created_ms,
+                        ToiletStatus.created_ms < to_epoch_milliseconds(end_datetime)
+                    ) \
+                    .order_by(asc(ToiletStatus.created_ms)) \
+                    .all():
+                for i in group_indexes_by_toilet.get(target_status.toilet_id, []):
+                    statuses_by_group[i].append(target_status)
+        else:
+            # 区間内のトイレ入退室トランザクションを全グループ分まとめて1回で取得し、トイレグループごとに振り分ける
+            # ORMオブジェクトは生成せず、集計に必要な列だけをタプルで受け取る
+            for target_status in session \
+                    .query(
+                        ToiletStatus.toilet_id,
+                        ToiletStatus.is_closed,
+                        ToiletStatus.created_time
+                    ) \
+                    .filter(
+                        begin_datetime <= ToiletStatus.created_time,
+                        ToiletStatus.created_time < end_datetime
+                    ) \
+                    .order_by(asc(ToiletStatus.created_time)) \
+                    .all():
+                for i in group_indexes_by_toilet.get(target_status.toilet_id, []):
+                    statuses_by_group[i].append(target_status)
+
+        # 区間と重なるトイレ使用セッションを全グループ分まとめて1回で取得し、トイレグループごとに振り分ける
+        # 区間の開始より前に入室したものも含まれるため、開始時点で入室中だったトイレを別途求める必要は無い
+        for toilet_session in session \
+                .query(
+                    ToiletSession.toilet_id,
+                    ToiletSession.started_at,
+                    ToiletSession.ended_at
+                ) \
+                .filter(
+                    ToiletSession.started_at < end_datetime,
+                    begin_datetime < ToiletSession.ended_at
+                ) \
+                .all():
+            for i in group_indexes_by_toilet.get(toilet_session.toilet_id, []):
+                toilet_sessions_by_group[i].append(toilet_session)
+
+    if source != LOG_SOURCE_RAW:
+        # 集計テーブルに未反映のイベントは、入退室トランザクションとトイレ使用セッションから直接補う
+        # 反映済みのIDは集計テーブルを読んだ後に取得し、並行して反映が進んでも同じイベントを二重に数えないようにする
+        unreflected_statuses, unreflected_sessions = get_unreflected_usages(
+            session, get_reflected_id(session), begin_datetime, end_datetime
+        )
+        for status in unreflected_statuses:
+            for i in group_indexes_by_toilet.get(status.toilet_id, []):
+                statuses_by_group[i].append(status)
+        for toilet_session in unreflected_sessions:
+            for i in group_indexes_by_toilet.get(toilet_session.toilet_id, []):
+                toilet_sessions_by_group[i].append(toilet_session)
+
+    if source == LOG_SOURCE_RAW and USE_EPOCH_TIMESTAMPS:
+        # イベントの発生日時と同じ単位の整数で集計区間の境界を表しておく
+        bucket_begins_ms = [to_epoch_milliseconds(x) for x in bucket_begins]
+        bucket_ends_ms = [to_epoch_milliseconds(x) for x in bucket_ends]
+
+    frequencies_by_group = []
+    occupancies_by_group = []
+    for i, target_toilets_id_list in enumerate(toilet_ids_by_group):
+        # サンプリング時間ごとにドアクローズイベントの件数を数える
+        if source != LOG_SOURCE_RAW:
+            # 集計テーブルの値に、未反映のドアクローズイベントの件数を加える
+            data_frequency = [
+                rollup_count + unreflected_count
+                for rollup_count, unreflected_count in zip(
+                    sum_values_per_bucket(
+                        [x.hour for x in usages_by_group[i]],
+                        [x.closed_count for x in usages_by_group[i]],
+                        bucket_begins,
+                        bucket_ends
+                    ),
+                    count_events_per_bucket(
+                        [x.created_time for x in statuses_by_group[i] if x.is_closed],
+                        bucket_begins,
+                        bucket_ends
+                    )
+                )
+            ]
+        elif USE_EPOCH_TIMESTAMPS:
+            data_frequency = count_events_per_bucket(
+                [x.created_ms for x in statuses_by_group[i] if x.is_closed],
+                bucket_begins_ms,
+                bucket_ends_ms
+            )
+        else:
+            data_frequency = count_events_per_bucket(
+                [x.created_time for x in statuses_by_group[i] if x.is_closed],
+                bucket_begins,
+                bucket_ends
+            )
+        frequencies_by_group.append(data_frequency)
+
+        # 個室1室あたりが最大占有率になる時間秒数
+        max_occupancy_time = step_minutes * 60
+
+        # 入室中のものは、入室日時からサンプリング時間の終端まで占有しているものとして扱う
+        target_ongoing_toilets = [x for x in ongoing_toilets if x.id in target_toilets_id_list]
+        ongoing_times = sum_interval_seconds_per_bucket(
+            [x.modified_time for x in target_ongoing_toilets],
+            [end_datetime for x in target_ongoing_toilets],
+            bucket_begins,
+            bucket_ends
+        )
+
+        if source != LOG_SOURCE_RAW:
+            # 退室済みの占有秒数は集計テーブルから求め、退室が未反映のトイレ使用セッションの分を加える
+            finished_times = [
+                rollup_time + unreflected_time
+                for rollup_time, unreflected_time in zip(
+                    sum_values_per_bucket(
+                        [x.hour for x in usages_by_group[i]],
+                        [x.occupied_seconds for x in usages_by_group[i]],
+                        bucket_begins,
+                        bucket_ends
+                    ),
+                    sum_interval_seconds_per_bucket(
+                        [x.started_at for x in toilet_sessions_by_group[i]],
+                        [x.ended_at for x in toilet_sessions_by_group[i]],
+                        bucket_begins,
+                        bucket_ends
+                    )
+                )
+            ]
+        else:
+            # 退室済みの占有秒数は、トイレ使用セッションごとにサンプリング時間と重なる秒数を合計して求める
+            finished_times = sum_interval_seconds_per_bucket(
+                [x.started_at for x in toilet_sessions_by_group[i]],
+                [x.ended_at for x in toilet_sessions_by_group[i]],
+                bucket_begins,
+                bucket_ends
+            )
+        occupied_times = [
+            finished_time + ongoing_time
+            for finished_time, ongoing_time in zip(finished_times, ongoing_times)
+        ]
+
+        # トイレグループ内の個室ごとの占有時間を理論上のMAX占有時間で割った割合について、トイレグループ内の個室全体で相加平均したものをこのトイレグループの占有率とする
+        # 個室が1つも紐付いていないトイレグループは常に0とする
+        occupancies_by_group.append([
+            occupied_time / max_occupancy_time / len(target_toilets_id_list) if target_toilets_id_list else 0
+            for occupied_time in occupied_times
+        ])
+    return frequencies_by_group, occupancies_by_group
+
+
+def choose_step_minutes(days: int, hours_per_day: int, max_buckets: int) -> int:
+    """系列あたりの集計区間数が上限に収まる、最も細かいサンプリング間隔を選びます。
+    いずれの候補でも上限を超える場合は、日当たりの時間帯全体を1区間とします。
+
+    Arguments:
+        days {int} -- 期間の日数
+        hours_per_day {int} -- 日当たりの集計時間帯の長さ (時間)
+        max_buckets {int} -- 系列あたりの集計区間数の上限
+
+    Returns:
+        int -- サンプリング間隔 (分)
+    """
+    minutes_per_day = hours_per_day * 60
+    for step_minutes in AUTO_STEP_MINUTES:
+        if minutes_per_day <= step_minutes:
+            break
+        buckets_per_day = -(-minutes_per_day // step_minutes)
+        if buckets_per_day * days <= max_buckets:
+            return step_minutes
+    return minutes_per_day
+
+
+def format_step_name(step_minutes: int) -> str:
+    """サンプリング間隔をグラフの系列名に使う表記に変換します。
+
+    Arguments:
+        step_minutes {int} -- サンプリング間隔 (分)
+
+    Returns:
+        str -- サンプリング間隔の表記 (例: 2時間, 30分)
+    """
+    if step_minutes % 60 == 0:
+        return f"{step_minutes // 60}時間"
+    return f"{step_minutes}分"
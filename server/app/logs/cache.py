@@ -0,0 +1,207 @@
+###############################################################################
+#    ログ取得APIの集計結果を日単位で保持するキャッシュを定義します。
+#    すべての集計区間が終わった日の集計結果は、その日までに始まった使用 (入室から退室まで) に関わるイベントが後から記録されない限り変化しないため使い回します。
+#    プロセス内のメモリー (LRU) に加え、設定によりローカルの SQLite ファイルにも保持します。
+###############################################################################
+import collections
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime as dt
+from sqlalchemy import func
+from sqlalchemy.orm.session import Session
+import app.common as Common
+from app.logs.rollup import get_session_started_time
+logger = Common.get_logger("logs.cache")
+
+
+class LogResultCache(object):
+    """ログ取得APIの集計結果を日単位で保持するキャッシュクラスです。
+    各エントリーには集計時点で記録済みだったトイレ入退室トランザクションの最大IDを持たせ、
+    それよりも後に記録されたイベントが関わる使用 (入室から退室まで) の入室日時が、その日の最後の集計区間の終了日時よりも前であれば無効とします。
+    翌日以降に退室した場合も、入室した日以降の集計結果が無効になります。
+    判定はDB上のIDをもとに行うため、他のプロセスで記録されたイベントや後から追加された過去のイベントにも対応できます。
+    """
+
+    def __init__(self, max_entries: int, file_path: str = None, max_file_entries: int = 0):
+        self.max_entries = max_entries
+        self.file_path = file_path or None
+        self.max_file_entries = max_file_entries
+        # キー -> エントリー {computed_id, data_end, frequencies, occupancies} (参照された順)
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        # ファイル上のキャッシュへの接続はスレッドごとに持つ
+        self.local = threading.local()
+
+    @property
+    def enabled(self) -> bool:
+        return 0 < self.max_entries
+
+    def get_days(self, session: Session, keys: list) -> dict:
+        """指定したキーのうち、有効なエントリーを返します。
+
+        Arguments:
+            session {Session} -- DB接続セッション
+            keys {list} -- キャッシュキーのリスト
+
+        Returns:
+            dict -- キャッシュキー -> エントリー {computed_id, data_end, frequencies, occupancies}
+        """
+        from model.toilet_status import ToiletStatus
+        if not self.enabled or not keys:
+            return {}
+
+        found = {}
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    self.entries.move_to_end(key)
+                    found[key] = entry
+        for key in keys:
+            if key not in found:
+                entry = self.load(key)
+                if entry is not None:
+                    found[key] = entry
+        if not found:
+            return {}
+
+        # 最も古いエントリー以降に記録されたイベントが関わる使用のうち、最も古い入室日時を求める
+        # トイレごとに最も古いイベントの時点で入室中であれば、その入室から影響を受けるものとする
+        # 通常は当日に入室したものしか無いため、終わった日のエントリーは無効にならない
+        latest_id = session.query(func.max(ToiletStatus.id)).scalar() or 0
+        oldest_computed_id = min([x["computed_id"] for x in found.values()])
+        earliest_new_time = None
+        for new_status in session \
+                .query(ToiletStatus.toilet_id, func.min(ToiletStatus.created_time).label("created_time")) \
+                .filter(oldest_computed_id < ToiletStatus.id) \
+                .group_by(ToiletStatus.toilet_id) \
+                .all():
+            affected_time = get_session_started_time(session, new_status.toilet_id, new_status.created_time) \
+                or new_status.created_time
+            if earliest_new_time is None or affected_time < earliest_new_time:
+                earliest_new_time = affected_time
+
+        results = {}
+        for key, entry in found.items():
+            if latest_id < entry["computed_id"]:
+                # トイレ入退室トランザクションが削除されている
+                continue
+            if earliest_new_time is not None and entry["computed_id"] < latest_id and earliest_new_time < entry["data_end"]:
+                continue
+            # 現時点までのイベントでは無効にならないことを確かめたため、次回は現時点以降のイベントだけを調べればよい
+            entry = dict(entry, computed_id=latest_id)
+            results[key] = entry
+            self.put(key, entry, persist=False)
+
+        invalidated_count = len(found) - len(results)
+        if 0 < invalidated_count:
+            logger.info(f"[LogResultCache] Invalidated. :count={invalidated_count} :earliest_new_time={earliest_new_time}")
+            with self.lock:
+                for key in found:
+                    if key not in results:
+                        self.entries.pop(key, None)
+            self.delete([x for x in found if x not in results])
+        return results
+
+    def put(self, key: tuple, entry: dict, persist: bool = True):
+        """エントリーを保持します。上限を超えた場合は最も長く参照されていないものから破棄します。
+
+        Arguments:
+            key {tuple} -- キャッシュキー
+            entry {dict} -- エントリー {computed_id, data_end, frequencies, occupancies}
+
+        Keyword Arguments:
+            persist {bool} -- ファイル上のキャッシュにも書き込むかどうか (default: {True})
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while self.max_entries < len(self.entries):
+                self.entries.popitem(last=False)
+        if persist:
+            self.store(key, entry)
+
+    def connect(self) -> sqlite3.Connection:
+        """ファイル上のキャッシュへの接続を返します。無効の場合はNoneを返します。
+
+        Returns:
+            Connection -- SQLite の接続
+        """
+        if self.file_path is None:
+            return None
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            directory = os.path.dirname(self.file_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.file_path, timeout=5)
+            connection.execute("CREATE TABLE IF NOT EXISTS log_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_time REAL NOT NULL)")
+            connection.commit()
+            self.local.connection = connection
+        return connection
+
+    def load(self, key: tuple) -> dict:
+        """ファイル上のキャッシュからエントリーを読み込みます。
+
+        Arguments:
+            key {tuple} -- キャッシュキー
+
+        Returns:
+            dict -- エントリー、無い場合はNone
+        """
+        connection = self.connect()
+        if connection is None:
+            return None
+        try:
+            row = connection.execute("SELECT value FROM log_cache WHERE key = ?", (json.dumps(key),)).fetchone()
+        except sqlite3.Error:
+            logger.exception("[LogResultCache] ファイル上のキャッシュを読み込めませんでした")
+            return None
+        if row is None:
+            return None
+        entry = json.loads(row[0])
+        entry["data_end"] = dt.fromisoformat(entry["data_end"])
+        return entry
+
+    def store(self, key: tuple, entry: dict):
+        """ファイル上のキャッシュにエントリーを書き込みます。上限を超えた場合は古く書き込まれたものから破棄します。
+
+        Arguments:
+            key {tuple} -- キャッシュキー
+            entry {dict} -- エントリー
+        """
+        connection = self.connect()
+        if connection is None:
+            return
+        value = json.dumps(dict(entry, data_end=entry["data_end"].isoformat()))
+        try:
+            connection.execute("INSERT OR REPLACE INTO log_cache (key, value, stored_time) VALUES (?, ?, julianday('now'))",
+                               (json.dumps(key), value))
+            if 0 < self.max_file_entries:
+                connection.execute("DELETE FROM log_cache WHERE key NOT IN "
+                                   "(SELECT key FROM log_cache ORDER BY stored_time DESC LIMIT ?)",
+                                   (self.max_file_entries,))
+            connection.commit()
+        except sqlite3.Error:
+            connection.rollback()
+            logger.exception("[LogResultCache] ファイル上のキャッシュに書き込めませんでした")
+
+    def delete(self, keys: list):
+        """ファイル上のキャッシュからエントリーを削除します。
+
+        Arguments:
+            keys {list} -- キャッシュキーのリスト
+        """
+        connection = self.connect()
+        if connection is None or not keys:
+            return
+        try:
+            connection.executemany("DELETE FROM log_cache WHERE key = ?", [(json.dumps(x),) for x in keys])
+            connection.commit()
+        except sqlite3.Error:
+            connection.rollback()
+            logger.exception("[LogResultCache] ファイル上のキャッシュから削除できませんでした")
@@ -0,0 +1,268 @@
+###############################################################################
+#    トイレの使用時間の分布 (スケッチ) を定義します。
+#    使用時間は対数スケールの固定区間に数え上げるため、日・時間帯ごとのスケッチを足し合わせるだけで任意の期間の分布と分位点が求まります。
+#    区間の幅は下限の DURATION_SKETCH_GAMMA 倍とし、分位点の相対誤差は (DURATION_SKETCH_GAMMA - 1) / (DURATION_SKETCH_GAMMA + 1) 以内になります。
+###############################################################################
+import json
+import math
+from datetime import datetime as dt, timedelta
+from sqlalchemy.orm.session import Session
+import app.common as Common
+logger = Common.get_logger("logs.duration")
+
+### 定数定義
+DURATION_SKETCH_GAMMA = 1.05
+DURATION_SKETCH_LOG_GAMMA = math.log(DURATION_SKETCH_GAMMA)
+DURATION_SKETCH_MIN_SECONDS = 1.0
+
+
+class DurationSketch(object):
+    """使用時間の分布を対数スケールの固定区間ごとの回数で保持するクラスです。
+    区間番号 i は (GAMMA^(i-1), GAMMA^i] 秒の使用時間を表します。1秒以下はすべて区間番号 0 に数えます。
+    """
+
+    def __init__(self, buckets: dict = None, count: int = 0, total_seconds: float = 0.0):
+        # 区間番号 -> 使用回数
+        self.buckets = buckets or {}
+        self.count = count
+        self.total_seconds = total_seconds
+
+    @staticmethod
+    def get_index(seconds: float) -> int:
+        """使用秒数が属する区間番号を返します。
+
+        Arguments:
+            seconds {float} -- 使用秒数
+
+        Returns:
+            int -- 区間番号
+        """
+        if seconds <= DURATION_SKETCH_MIN_SECONDS:
+            return 0
+        return int(math.ceil(math.log(seconds) / DURATION_SKETCH_LOG_GAMMA))
+
+    @staticmethod
+    def get_bounds(index: int) -> tuple:
+        """区間番号が表す使用秒数の範囲を返します。
+
+        Arguments:
+            index {int} -- 区間番号
+
+        Returns:
+            tuple -- (下限秒数, 上限秒数)
+        """
+        if index <= 0:
+            return (0.0, DURATION_SKETCH_MIN_SECONDS)
+        return (DURATION_SKETCH_GAMMA ** (index - 1), DURATION_SKETCH_GAMMA ** index)
+
+    def add(self, seconds: float, count: int = 1):
+        """使用秒数を数え上げます。
+
+        Arguments:
+            seconds {float} -- 使用秒数
+
+        Keyword Arguments:
+            count {int} -- 回数 (default: {1})
+        """
+        index = self.get_index(seconds)
+        self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += count
+        self.total_seconds += seconds * count
+
+    def merge(self, other: "DurationSketch"):
+        """他のスケッチを足し合わせます。
+
+        Arguments:
+            other {DurationSketch} -- 足し合わせるスケッチ
+        """
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total_seconds += other.total_seconds
+
+    def quantile(self, q: float) -> float:
+        """分位点の推定値を返します。区間の代表値には相対誤差が最小となる値を用います。
+
+        Arguments:
+            q {float} -- 0-1 の分位
+
+        Returns:
+            float -- 使用秒数、数え上げていない場合はNone
+        """
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        accumulated = 0
+        for index in sorted(self.buckets):
+            accumulated += self.buckets[index]
+            if rank < accumulated:
+                break
+        if index <= 0:
+            return DURATION_SKETCH_MIN_SECONDS
+        return 2 * DURATION_SKETCH_GAMMA ** index / (DURATION_SKETCH_GAMMA + 1)
+
+    def histogram(self) -> list:
+        """数え上げた区間を使用秒数の昇順に返します。
+
+        Returns:
+            list -- [{lower, upper, count}]
+        """
+        results = []
+        for index in sorted(self.buckets):
+            lower, upper = self.get_bounds(index)
+            results.append({
+                "lower": lower,
+                "upper": upper,
+                "count": self.buckets[index]
+            })
+        return results
+
+    def dumps(self) -> str:
+        """区間ごとの回数を保存用の文字列に変換します。
+
+        Returns:
+            str -- JSON 文字列
+        """
+        return json.dumps({str(x): self.buckets[x] for x in sorted(self.buckets)}, separators=(",", ":"))
+
+    @classmethod
+    def loads(cls, buckets: str, count: int, total_seconds: float) -> "DurationSketch":
+        """保存用の文字列からスケッチを復元します。
+
+        Arguments:
+            buckets {str} -- JSON 文字列
+            count {int} -- 使用回数
+            total_seconds {float} -- 使用秒数の合計
+
+        Returns:
+            DurationSketch -- スケッチ
+        """
+        return cls({int(x): y for x, y in json.loads(buckets).items()}, count, total_seconds)
+
+
+def add_duration_sketches(session: Session, toilet_sessions: list) -> int:
+    """トイレ使用セッションを入室した日・時間帯ごとのスケッチに数え上げます。
+    既存のスケッチは読み込んで足し合わせるため、セッションテーブルへの追加と同じトランザクションで呼び出して下さい。
+    コミットは呼出元で行って下さい。
+
+    Arguments:
+        session {Session} -- DB接続セッション
+        toilet_sessions {list} -- トイレ使用セッション (toilet_id, started_at, duration_s を持つ dict)
+
+    Returns:
+        int -- 更新したスケッチの件数
+    """
+    from model.toilet_duration_daily import ToiletDurationDaily
+
+    sketches = {}
+    for toilet_session in toilet_sessions:
+        started_time = toilet_session["started_at"]
+        key = (toilet_session["toilet_id"], dt(started_time.year, started_time.month, started_time.day), started_time.hour)
+        if key not in sketches:
+            sketches[key] = DurationSketch()
+        sketches[key].add(toilet_session["duration_s"])
+
+    now = dt.now()
+    for (toilet_id, day, hour), sketch in sketches.items():
+        record = session.query(ToiletDurationDaily).get((toilet_id, day, hour))
+        if record is None:
+            record = ToiletDurationDaily(
+                toilet_id=toilet_id,
+                day=day,
+                hour=hour,
+                count=0,
+                total_seconds=0.0,
+                buckets="{}"
+            )
+            session.add(record)
+        merged_sketch = DurationSketch.loads(record.buckets, record.count, record.total_seconds)
+        merged_sketch.merge(sketch)
+        record.count = merged_sketch.count
+        record.total_seconds = merged_sketch.total_seconds
+        record.buckets = merged_sketch.dumps()
+        record.modified_time = now
+
+    return len(sketches)
+
+
+def rebuild_duration_sketches(session: Session) -> int:
+    """スケッチテーブルを空にして、すべてのトイレ使用セッションから作り直します。
+    コミットは呼出元で行って下さい。
+
+    Arguments:
+        session {Session} -- DB接続セッション
+
+    Returns:
+        int -- 追加したスケッチの件数
+    """
+    from model.toilet_session import ToiletSession
+    from model.toilet_duration_daily import ToiletDurationDaily
+
+    session.query(ToiletDurationDaily).delete(synchronize_session=False)
+
+    sketches = {}
+    for toilet_session in session \
+            .query(ToiletSession.toilet_id, ToiletSession.started_at, ToiletSession.duration_s) \
+            .yield_per(10000):
+        started_time = toilet_session.started_at
+        key = (toilet_session.toilet_id, dt(started_time.year, started_time.month, started_time.day), started_time.hour)
+        if key not in sketches:
+            sketches[key] = DurationSketch()
+        sketches[key].add(toilet_session.duration_s)
+
+    now = dt.now()
+    session.bulk_insert_mappings(ToiletDurationDaily, [
+        {
+            "toilet_id": toilet_id,
+            "day": day,
+            "hour": hour,
+            "count": sketch.count,
+            "total_seconds": sketch.total_seconds,
+            "buckets": sketch.dumps(),
+            "modified_time": now
+        }
+        for (toilet_id, day, hour), sketch in sketches.items()
+    ])
+    logger.info(f"[rebuild_duration_sketches] Rebuilt. :count={len(sketches)}")
+    return len(sketches)
+
+
+def get_duration_sketches(session: Session, toilet_ids_by_group: dict, begin_datetime: dt, end_datetime: dt) -> dict:
+    """指定した日付範囲のスケッチをグループごと・時間帯ごとに足し合わせます。
+
+    Arguments:
+        session {Session} -- DB接続セッション
+        toilet_ids_by_group {dict} -- トイレグループID -> トイレIDのリスト
+        begin_datetime {datetime} -- 開始日 (0時0分0秒)
+        end_datetime {datetime} -- 終了日 (0時0分0秒、この日を含む)
+
+    Returns:
+        dict -- トイレグループID -> (全体のスケッチ, 時間帯 (0-23) ごとのスケッチのリスト)
+    """
+    from model.toilet_duration_daily import ToiletDurationDaily
+
+    group_ids_by_toilet = {}
+    for group_id, toilet_ids in toilet_ids_by_group.items():
+        for toilet_id in toilet_ids:
+            group_ids_by_toilet.setdefault(toilet_id, []).append(group_id)
+
+    results = {x: (DurationSketch(), [DurationSketch() for _ in range(24)]) for x in toilet_ids_by_group}
+    if not group_ids_by_toilet:
+        return results
+
+    records = session \
+        .query(ToiletDurationDaily.toilet_id, ToiletDurationDaily.hour, ToiletDurationDaily.count,
+               ToiletDurationDaily.total_seconds, ToiletDurationDaily.buckets) \
+        .filter(ToiletDurationDaily.toilet_id.in_(list(group_ids_by_toilet.keys()))) \
+        .filter(begin_datetime <= ToiletDurationDaily.day) \
+        .filter(ToiletDurationDaily.day < end_datetime + timedelta(days=1)) \
+        .all()
+    for record in records:
+        sketch = DurationSketch.loads(record.buckets, record.count, record.total_seconds)
+        for group_id in group_ids_by_toilet[record.toilet_id]:
+            total_sketch, hourly_sketches = results[group_id]
+            total_sketch.merge(sketch)
+            hourly_sketches[record.hour].merge(sketch)
+
+    logger.info(f"[get_duration_sketches] Merged. :records={len(records)}")
+    return results
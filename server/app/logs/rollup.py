@@ -0,0 +1,377 @@
+###############################################################################
+#    トイレ使用状況集計テーブル (1時間単位) を最新化する処理を定義します。
+#    ドアイベントを記録したプロセスがバックグラウンドのスレッドで反映するほか、コマンドラインからも実行できます。
+#    ログ取得APIは集計テーブルを読み取るだけで、反映は行いません。
+#    使い方: /server/ 直下で python3 -m app.logs.rollup [rebuild]
+#        引数なし -- 前回の反映以降に追加されたトイレ入退室トランザクションだけを反映します (cron などで定期的に実行する場合もこちら)
+#        rebuild  -- 集計テーブルを空にして、すべてのトイレ入退室トランザクションから作り直します (マイグレーション直後のバックフィル用)
+###############################################################################
+import sys
+sys.path.insert(0, ".")
+import datetime
+import threading
+from datetime import datetime as dt
+from sqlalchemy import func, asc, desc, and_, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.session import Session
+import app.common as Common
+logger = Common.get_logger("logs.rollup")
+
+### 定数定義
+# 集計テーブルに反映済みのトイレ入退室トランザクションIDを保持するアプリケーション状態マスター上のID
+USAGE_ROLLUP_APP_STATE_ID = 3
+
+
+def refresh_usage_rollups(session: Session) -> int:
+    """前回の反映以降に追加されたトイレ入退室トランザクションを集計テーブルに反映し、コミットします。
+    反映済みのIDは条件付きの UPDATE で進めるため、複数のプロセスから同時に呼び出されても二重に反映されることはありません。
+    発生日時が過去のイベントが後から追加された場合も、そのイベントを含む時間帯以降を作り直します。
+
+    Arguments:
+        session {Session} -- DB接続セッション
+
+    Returns:
+        int -- 反映したトイレ入退室トランザクションの件数、他のプロセスが先に反映した場合は0
+    """
+    from model.app_state import AppState
+    from model.toilet_status import ToiletStatus
+
+    reflected_id = session \
+        .query(AppState.state) \
+        .filter(AppState.id == USAGE_ROLLUP_APP_STATE_ID) \
+        .scalar()
+    if reflected_id is None:
+        # 反映済みIDのレコードが無い場合は最初から反映する
+        try:
+            session.add(AppState(
+                id=USAGE_ROLLUP_APP_STATE_ID, name="トイレ使用状況集計", state=0,
+                comment="集計テーブルに反映済みのトイレ入退室トランザクションID",
+                modified_time=dt.now()
+            ))
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+        reflected_id = 0
+
+    latest_id = session.query(func.max(ToiletStatus.id)).scalar() or 0
+    if latest_id <= reflected_id:
+        return 0
+
+    updated_count = session \
+        .query(AppState) \
+        .filter(
+            AppState.id == USAGE_ROLLUP_APP_STATE_ID,
+            AppState.state == reflected_id
+        ) \
+        .update({
+            AppState.state: latest_id,
+            AppState.modified_time: dt.now()
+        }, synchronize_session=False)
+    if updated_count == 0:
+        session.rollback()
+        return 0
+
+    # 追加分をトイレごとにまとめ、最も古い発生日時を含む時間帯以降を作り直す
+    targets = session \
+        .query(
+            ToiletStatus.toilet_id,
+            func.min(ToiletStatus.created_time).label("created_time"),
+            func.count().label("count")
+        ) \
+        .filter(
+            reflected_id < ToiletStatus.id,
+            ToiletStatus.id <= latest_id
+        ) \
+        .group_by(ToiletStatus.toilet_id) \
+        .all()
+    for target in targets:
+        rebuild_toilet_usage(session, target.toilet_id, target.created_time)
+    session.commit()
+
+    reflected_count = sum([x.count for x in targets])
+    logger.info(f"[refresh_usage_rollups] Reflected. :count={reflected_count} :latest_id={latest_id}")
+    return reflected_count
+
+
+def get_reflected_id(session: Session) -> int:
+    """集計テーブルに反映済みのトイレ入退室トランザクションIDを返します。
+
+    Arguments:
+        session {Session} -- DB接続セッション
+
+    Returns:
+        int -- 反映済みのトイレ入退室トランザクションID、一度も反映していない場合は0
+    """
+    from model.app_state import AppState
+    return session \
+        .query(AppState.state) \
+        .filter(AppState.id == USAGE_ROLLUP_APP_STATE_ID) \
+        .scalar() or 0
+
+
+def get_unreflected_usages(session: Session, reflected_id: int, begin_datetime: dt, end_datetime: dt) -> tuple:
+    """集計テーブルに未反映のトイレ入退室トランザクションのうち、指定期間の集計に関わるものを返します。
+    集計テーブルの値に加えることで、反映を待たずに記録済みのイベントすべてを数えた集計値になります。
+    退室が未反映の使用は集計テーブルにもトイレマスターの現在のステート (入室中) にも含まれないため、トイレ使用セッションテーブルから求めます。
+
+    Arguments:
+        session {Session} -- DB接続セッション
+        reflected_id {int} -- 集計テーブルに反映済みのトイレ入退室トランザクションID
+        begin_datetime {datetime} -- 期間開始日時
+        end_datetime {datetime} -- 期間終了日時
+
+    Returns:
+        tuple -- (期間内の未反映のドアが閉められたイベント (toilet_id, is_closed, created_time) のリスト,
+                  未反映のドアが開いたイベントで退室した、期間と重なるトイレ使用セッション (toilet_id, started_at, ended_at) のリスト)
+    """
+    from model.toilet_status import ToiletStatus
+    from model.toilet_session import ToiletSession
+
+    # 期間の終端より後に退室したものも、期間内に入室していれば期間と重なるため、終端では絞り込まない
+    closed_statuses = []
+    opened_times_by_toilet = {}
+    for status in session \
+            .query(ToiletStatus.toilet_id, ToiletStatus.is_closed, ToiletStatus.created_time) \
+            .filter(
+                reflected_id < ToiletStatus.id,
+                begin_datetime <= ToiletStatus.created_time
+            ) \
+            .all():
+        if status.is_closed:
+            if status.created_time < end_datetime:
+                closed_statuses.append(status)
+        else:
+            opened_times_by_toilet.setdefault(status.toilet_id, set()).add(status.created_time)
+
+    # 未反映のドアが開いたイベントで退室したセッションは、そのうち最も早いものの入室以降に入室している
+    toilet_sessions = []
+    for toilet_id, opened_times in opened_times_by_toilet.items():
+        since = min(opened_times)
+        since = get_session_started_time(session, toilet_id, since) or since
+        for toilet_session in session \
+                .query(ToiletSession.toilet_id, ToiletSession.started_at, ToiletSession.ended_at) \
+                .filter(
+                    ToiletSession.toilet_id == toilet_id,
+                    since <= ToiletSession.started_at,
+                    ToiletSession.started_at < end_datetime
+                ) \
+                .all():
+            if toilet_session.ended_at in opened_times:
+                toilet_sessions.append(toilet_session)
+    return closed_statuses, toilet_sessions
+
+
+class UsageRollupRefresher(object):
+    """集計テーブルへの反映をバックグラウンドのスレッドで行うクラスです。
+    ドアイベントを記録した後に request() で反映を依頼すると、記録した要求とは別のトランザクションで反映します。
+    他のプロセスで記録されたイベントも取りこぼさないよう、依頼が無くても一定間隔ごとに反映します。
+    """
+
+    def __init__(self, interval_seconds: float):
+        self.interval_seconds = interval_seconds
+        self.requested = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """反映を行うスレッドを開始します。
+        """
+        self.thread = threading.Thread(target=self.run, name="usage-rollup-refresher", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """反映を行うスレッドを停止します。
+        """
+        self.stopped.set()
+        self.requested.set()
+
+    def request(self):
+        """集計テーブルへの反映を依頼します。
+        続けて依頼された場合は、まとめて1回で反映します。
+        """
+        self.requested.set()
+
+    def run(self):
+        """反映の依頼、または一定間隔ごとに集計テーブルに反映します。
+        バックグラウンドのスレッドで実行されます。
+        """
+        while not self.stopped.is_set():
+            self.requested.wait(self.interval_seconds)
+            self.requested.clear()
+            if self.stopped.is_set():
+                break
+            try:
+                with Common.create_session() as session:
+                    refresh_usage_rollups(session)
+            except Exception:
+                logger.exception("[UsageRollupRefresher] Refresh failed. 次回の依頼または間隔で再試行します")
+
+
+def rebuild_toilet_usage(session: Session, toilet_id: int, since: dt):
+    """指定した日時を含む時間帯以降について、1つのトイレの集計テーブルのレコードを作り直します。
+    入室中のまま退室していない区間の占有秒数は、退室のイベントが反映されるまで集計テーブルに含めません。
+    コミットは呼出元で行って下さい。
+
+    Arguments:
+        session {Session} -- DB接続セッション
+        toilet_id {int} -- ターゲットトイレID
+        since {datetime} -- 作り直す期間の開始日時
+    """
+    from model.toilet_status import ToiletStatus
+    from model.toilet_usage_hourly import ToiletUsageHourly
+
+    # 指定日時の時点で入室中だった場合は、その入室の時刻から作り直す
+    started_time = get_session_started_time(session, toilet_id, since)
+    if started_time is not None:
+        since = started_time
+    begin_hour = truncate_to_hour(since)
+
+    # 作り直す時間帯の開始時点で入室中であれば、その時点から占有しているものとして扱う
+    seed_status = get_last_status_before(session, toilet_id, begin_hour)
+    closed_time = begin_hour if seed_status is not None and seed_status.is_closed else None
+
+    # 時間帯ごとの [ドアが閉められた回数, 占有秒数]
+    usages = {}
+    for status in session \
+            .query(ToiletStatus.is_closed, ToiletStatus.created_time) \
+            .filter(
+                ToiletStatus.toilet_id == toilet_id,
+                begin_hour <= ToiletStatus.created_time
+            ) \
+            .order_by(asc(ToiletStatus.created_time), asc(ToiletStatus.id)) \
+            .all():
+        if status.is_closed:
+            usages.setdefault(truncate_to_hour(status.created_time), [0, 0.0])[0] += 1
+            if closed_time is None:
+                closed_time = status.created_time
+        elif closed_time is not None:
+            spread_occupied_seconds(usages, closed_time, status.created_time)
+            closed_time = None
+
+    now = dt.now()
+    session \
+        .query(ToiletUsageHourly) \
+        .filter(
+            ToiletUsageHourly.toilet_id == toilet_id,
+            begin_hour <= ToiletUsageHourly.hour
+        ) \
+        .delete(synchronize_session=False)
+    session.bulk_insert_mappings(ToiletUsageHourly, [{
+        "toilet_id": toilet_id,
+        "hour": hour,
+        "closed_count": closed_count,
+        "occupied_seconds": occupied_seconds,
+        "modified_time": now
+    } for hour, (closed_count, occupied_seconds) in usages.items()])
+
+
+def get_last_status_before(session: Session, toilet_id: int, before: dt):
+    """指定した日時より前の、トイレの直近のイベントを返します。
+
+    Arguments:
+        session {Session} -- DB接続セッション
+        toilet_id {int} -- ターゲットトイレID
+        before {datetime} -- 基準日時
+
+    Returns:
+        tuple -- (is_closed, created_time)、該当するイベントが無い場合はNone
+    """
+    from model.toilet_status import ToiletStatus
+    return session \
+        .query(ToiletStatus.is_closed, ToiletStatus.created_time) \
+        .filter(
+            ToiletStatus.toilet_id == toilet_id,
+            ToiletStatus.created_time < before
+        ) \
+        .order_by(desc(ToiletStatus.created_time), desc(ToiletStatus.id)) \
+        .first()
+
+
+def get_session_started_time(session: Session, toilet_id: int, before: dt) -> dt:
+    """指定した日時の時点で入室中であれば、その入室の日時を返します。
+    ドアが閉められたイベントが続いている場合は、その最初のものを入室とします。
+    トイレ使用セッションテーブル・集計テーブルのいずれも、退室をこの入室と組にして求めます。
+
+    Arguments:
+        session {Session} -- DB接続セッション
+        toilet_id {int} -- ターゲットトイレID
+        before {datetime} -- 基準日時
+
+    Returns:
+        datetime -- 入室日時、基準日時の時点で入室中でなければNone
+    """
+    from model.toilet_status import ToiletStatus
+    previous_status = get_last_status_before(session, toilet_id, before)
+    if previous_status is None or not previous_status.is_closed:
+        return None
+
+    # 直前のドアが開いたイベントより後の、最初のドアが閉められたイベントを入室とする
+    opened_status = session \
+        .query(ToiletStatus.id, ToiletStatus.created_time) \
+        .filter(
+            ToiletStatus.toilet_id == toilet_id,
+            ToiletStatus.created_time < before,
+            ToiletStatus.is_closed == False
+        ) \
+        .order_by(desc(ToiletStatus.created_time), desc(ToiletStatus.id)) \
+        .first()
+    query = session \
+        .query(ToiletStatus.created_time) \
+        .filter(
+            ToiletStatus.toilet_id == toilet_id,
+            ToiletStatus.created_time < before,
+            ToiletStatus.is_closed == True
+        )
+    if opened_status is not None:
+        query = query.filter(or_(
+            opened_status.created_time < ToiletStatus.created_time,
+            and_(opened_status.created_time == ToiletStatus.created_time, opened_status.id < ToiletStatus.id)
+        ))
+    return query.order_by(asc(ToiletStatus.created_time), asc(ToiletStatus.id)).first().created_time
+
+
+def spread_occupied_seconds(usages: dict, begin_time: dt, end_time: dt):
+    """入室から退室までの占有秒数を、またがる時間帯ごとに振り分けて加算します。
+
+    Arguments:
+        usages {dict} -- 時間帯ごとの [ドアが閉められた回数, 占有秒数]
+        begin_time {datetime} -- 入室日時
+        end_time {datetime} -- 退室日時
+    """
+    hour = truncate_to_hour(begin_time)
+    while hour < end_time:
+        next_hour = hour + datetime.timedelta(hours=1)
+        occupied_seconds = (min(end_time, next_hour) - max(begin_time, hour)).total_seconds()
+        usages.setdefault(hour, [0, 0.0])[1] += occupied_seconds
+        hour = next_hour
+
+
+def truncate_to_hour(value: dt) -> dt:
+    """日時を時間帯の開始日時 (毎時0分0秒) に切り捨てます。
+
+    Arguments:
+        value {datetime} -- 日時
+
+    Returns:
+        datetime -- 時間帯の開始日時
+    """
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+if __name__ == "__main__":
+    from model.app_state import AppState
+    from model.toilet_usage_hourly import ToiletUsageHourly
+
+    with Common.create_session() as session:
+        if "rebuild" in sys.argv[1:]:
+            session.query(ToiletUsageHourly).delete(synchronize_session=False)
+            session \
+                .query(AppState) \
+                .filter(AppState.id == USAGE_ROLLUP_APP_STATE_ID) \
+                .update({
+                    AppState.state: 0,
+                    AppState.modified_time: dt.now()
+                }, synchronize_session=False)
+            session.commit()
+        reflected_count = refresh_usage_rollups(session)
+    print(f"{reflected_count} 件のトイレ入退室トランザクションを集計テーブルに反映しました。")
@@ -0,0 +1,124 @@
+###############################################################################
+#    トイレ使用セッションテーブル (入室から退室までの組) を維持する処理を定義します。
+#    ドアが開いたイベントを記録する際に、同じトランザクションで直前の入室と組にして追加します。
+#    使い方: /server/ 直下で python3 -m app.logs.toilet_session rebuild
+#        rebuild  -- セッションテーブルを空にして、すべてのトイレ入退室トランザクションから作り直します (マイグレーション直後のバックフィル用)
+#                    使用時間の分布 (スケッチ) テーブルも作り直したセッションから作り直します
+###############################################################################
+import sys
+sys.path.insert(0, ".")
+from datetime import datetime as dt
+from sqlalchemy import asc
+from sqlalchemy.orm.session import Session
+import app.common as Common
+from app.logs.rollup import get_session_started_time
+from app.logs.duration import add_duration_sketches, rebuild_duration_sketches
+logger = Common.get_logger("logs.toilet_session")
+
+
+def add_toilet_sessions(session: Session, statuses: list) -> int:
+    """新たに記録する入退室イベントのうち、ドアが開いたものを直前の入室と組にしてセッションテーブルに追加します。
+    追加したセッションは使用時間の分布 (スケッチ) にも数え上げます。
+    それぞれのトイレで最初のイベントがドアが開いたものである場合、その入室は記録済みのイベントから求めます。
+    ドアが閉められたイベントが続いている場合は、rebuild_toilet_sessions() や集計テーブルと同じく、その最初のものを入室とします。
+    記録済みのイベントは発生日時がそれよりも前のものに限って参照するため、イベントの INSERT の前後どちらで呼び出しても構いません。
+    コミットは呼出元で行って下さい。
+
+    Arguments:
+        session {Session} -- DB接続セッション
+        statuses {list} -- 新たに記録する入退室イベント (toilet_id, is_closed, created_time を持つもの、トイレごとに発生日時の昇順)
+
+    Returns:
+        int -- 追加したセッションの件数
+    """
+    from model.toilet_session import ToiletSession
+
+    # トイレごとの入室日時、入室中でなければNone
+    started_times = {}
+    toilet_sessions = []
+    for status in statuses:
+        if status.toilet_id not in started_times:
+            started_times[status.toilet_id] = get_session_started_time(session, status.toilet_id, status.created_time)
+
+        started_time = started_times[status.toilet_id]
+        if status.is_closed:
+            if started_time is None:
+                started_times[status.toilet_id] = status.created_time
+        elif started_time is not None:
+            toilet_sessions.append(build_toilet_session(status.toilet_id, started_time, status.created_time))
+            started_times[status.toilet_id] = None
+
+    if toilet_sessions:
+        session.bulk_insert_mappings(ToiletSession, toilet_sessions)
+        add_duration_sketches(session, toilet_sessions)
+    return len(toilet_sessions)
+
+
+def rebuild_toilet_sessions(session: Session) -> int:
+    """セッションテーブルを空にして、すべてのトイレ入退室トランザクションから作り直します。
+    コミットは呼出元で行って下さい。
+
+    Arguments:
+        session {Session} -- DB接続セッション
+
+    Returns:
+        int -- 追加したセッションの件数
+    """
+    from model.toilet_status import ToiletStatus
+    from model.toilet_session import ToiletSession
+
+    session.query(ToiletSession).delete(synchronize_session=False)
+
+    # トイレごとに発生日時の順に走査し、入室 (最初に閉められたもの) と退室を組にする
+    toilet_sessions = []
+    current_toilet_id = None
+    started_time = None
+    for status in session \
+            .query(ToiletStatus.toilet_id, ToiletStatus.is_closed, ToiletStatus.created_time) \
+            .order_by(asc(ToiletStatus.toilet_id), asc(ToiletStatus.created_time), asc(ToiletStatus.id)) \
+            .yield_per(10000):
+        if status.toilet_id != current_toilet_id:
+            current_toilet_id = status.toilet_id
+            started_time = None
+
+        if status.is_closed:
+            if started_time is None:
+                started_time = status.created_time
+        elif started_time is not None:
+            toilet_sessions.append(build_toilet_session(status.toilet_id, started_time, status.created_time))
+            started_time = None
+
+    session.bulk_insert_mappings(ToiletSession, toilet_sessions)
+    logger.info(f"[rebuild_toilet_sessions] Rebuilt. :count={len(toilet_sessions)}")
+    return len(toilet_sessions)
+
+
+def build_toilet_session(toilet_id: int, started_time: dt, ended_time: dt) -> dict:
+    """セッションテーブルに追加するレコードを生成します。
+
+    Arguments:
+        toilet_id {int} -- ターゲットトイレID
+        started_time {datetime} -- 入室日時
+        ended_time {datetime} -- 退室日時
+
+    Returns:
+        dict -- セッションテーブルのレコード
+    """
+    return {
+        "toilet_id": toilet_id,
+        "started_at": started_time,
+        "ended_at": ended_time,
+        "duration_s": (ended_time - started_time).total_seconds()
+    }
+
+
+if __name__ == "__main__":
+    if "rebuild" not in sys.argv[1:]:
+        print("使い方: python3 -m app.logs.toilet_session rebuild")
+        sys.exit(1)
+
+    with Common.create_session() as session:
+        rebuilt_count = rebuild_toilet_sessions(session)
+        session.flush()
+        sketch_count = rebuild_duration_sketches(session)
+    print(f"{rebuilt_count} 件のトイレ使用セッションと {sketch_count} 件の使用時間の分布を作り直しました。")
@@ -5,7 +5,9 @@
 from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
 app = Flask(__name__)
-CORS(app)
+# 現況取得APIの ETag とバージョン番号をクライアント側のスクリプトから参照できるようにし、
+# If-None-Match を付けた要求のプリフライト結果はブラウザー側でキャッシュさせる
+CORS(app, expose_headers=["ETag", "X-Status-Version"], max_age=600)
 
 import sys
 sys.path.insert(0, ".")
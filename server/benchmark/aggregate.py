@@ -0,0 +1,91 @@
+###############################################################################
+#    ログ取得APIの使用頻度の集計 (集計区間ごとのドアクローズイベント件数) の所要時間を計測します。
+#    使い方: /server/ 直下で python3 -m benchmark.aggregate [日数] [1日あたりの入室回数]
+#    既定では1年分のイベントを1時間刻みで集計します。DBは使用せず、メモリー上のデータのみで計測します。
+###############################################################################
+import random
+import sys
+from collections import namedtuple
+from datetime import datetime as dt
+from datetime import timedelta
+sys.path.insert(0, ".")
+from benchmark.common import measure, report
+
+# トイレ入退室トランザクションの取得結果に相当するタプル
+Status = namedtuple("Status", ["toilet_id", "is_closed", "created_time"])
+
+
+def create_statuses(begin_datetime: dt, days: int, visits_per_day: int) -> list:
+    """入室と退室が交互に並ぶトイレ入退室トランザクションを生成します。
+
+    Arguments:
+        begin_datetime {datetime} -- 期間開始日時
+        days {int} -- 日数
+        visits_per_day {int} -- 1日あたりの入室回数
+
+    Returns:
+        list -- 発生日時の昇順に並んだ Status のリスト
+    """
+    random.seed(0)
+    statuses = []
+    for day in range(days):
+        for minutes in sorted(random.sample(range(24 * 60 - 10), visits_per_day)):
+            closed_time = begin_datetime + timedelta(days=day, minutes=minutes, seconds=random.randint(0, 59))
+            statuses.append(Status(1, True, closed_time))
+            statuses.append(Status(1, False, closed_time + timedelta(minutes=random.randint(1, 9))))
+    statuses.sort(key=lambda x: x.created_time)
+    return statuses
+
+
+def slice_loop(statuses: list, pairs: list) -> list:
+    """変更前の実装: 集計区間ごとに残りのリストを切り出して走査する
+    """
+    data_frequency = []
+    start_index = 0
+    for one_of_begin_and_end_pairs in pairs:
+        sampling_count = 0
+        for n, target_status in enumerate(statuses[start_index:]):
+            if one_of_begin_and_end_pairs["begin"] <= target_status.created_time and \
+                    target_status.created_time < one_of_begin_and_end_pairs["end"] and \
+                    target_status.is_closed:
+                sampling_count += 1
+            elif one_of_begin_and_end_pairs["end"] <= target_status.created_time:
+                start_index = n
+                break
+        data_frequency.append(sampling_count)
+    return data_frequency
+
+
+if __name__ == "__main__":
+    days = int(sys.argv[1]) if 1 < len(sys.argv) else 365
+    visits_per_day = int(sys.argv[2]) if 2 < len(sys.argv) else 100
+
+    import app.logs.aggregate as Aggregate
+    begin_datetime = dt(2020, 1, 1)
+    statuses = create_statuses(begin_datetime, days, visits_per_day)
+    pairs = [{
+        "begin": begin_datetime + timedelta(hours=x),
+        "end": begin_datetime + timedelta(hours=x + 1)
+    } for x in range(days * 24)]
+    bucket_begins = [x["begin"] for x in pairs]
+    bucket_ends = [x["end"] for x in pairs]
+    print(f"events={len(statuses)} buckets={len(pairs)}")
+
+    def bucketing_engine():
+        return Aggregate.count_events_per_bucket(
+            [x.created_time for x in statuses if x.is_closed], bucket_begins, bucket_ends)
+
+    expected = slice_loop(statuses, pairs)
+    report("slice loop (before)", measure(lambda: slice_loop(statuses, pairs), 3))
+
+    numpy = Aggregate.numpy
+    Aggregate.numpy = None
+    assert bucketing_engine() == expected
+    report("bisect", measure(bucketing_engine, 10))
+    Aggregate.numpy = numpy
+
+    if numpy is not None:
+        assert bucketing_engine() == expected
+        report("numpy searchsorted + bincount", measure(bucketing_engine, 10))
+    else:
+        print("numpy is not installed: skipped")
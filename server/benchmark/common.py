@@ -0,0 +1,95 @@
+###############################################################################
+#    ベンチマークスクリプトで共有する処理を定義します。
+#    いずれのスクリプトも起動ディレクトリーは /server/ 直下にしておく必要があります。
+###############################################################################
+import os
+import sys
+import tempfile
+import time
+sys.path.insert(0, ".")
+
+
+def prepare_database(name: str = "benchmark") -> str:
+    """一時ディレクトリー上にベンチマーク用の SQLite データベースを作成し、アプリケーションの接続先として設定します。
+    アプリケーションのモジュールを読み込むよりも前に呼び出して下さい。
+
+    Keyword Arguments:
+        name {str} -- データベースファイル名 (拡張子を除く) (default: {"benchmark"})
+
+    Returns:
+        str -- DB接続文字列
+    """
+    db_dir = tempfile.mkdtemp(prefix="door-watcher-")
+    db_path = f"sqlite:///{os.path.join(db_dir, name)}.db"
+    os.environ["DOOR_WATCHER_DB_URL"] = db_path
+    os.environ["DOOR_WATCHER_STATUS_VERSION_FILE"] = os.path.join(db_dir, "status.version")
+
+    from sqlalchemy import create_engine
+    from model import Base
+    engine = create_engine(db_path)
+    Base.metadata.create_all(engine)
+    engine.dispose()
+    return db_path
+
+
+def seed_master(session, groups: int = 4, toilets_per_group: int = 2):
+    """ベンチマーク用のマスターデータを流し込みます。
+
+    Arguments:
+        session {Session} -- DB接続セッション
+
+    Keyword Arguments:
+        groups {int} -- トイレグループ数 (default: {4})
+        toilets_per_group {int} -- トイレグループあたりのトイレ数 (default: {2})
+    """
+    from datetime import datetime as dt
+    from datetime import timedelta
+    from model.app_state import AppState
+    from model.toilet import Toilet
+    from model.toilet_group import ToiletGroup
+    from model.toilet_group_map import ToiletGroupMap
+
+    # デバウンス判定に掛からないよう、更新日時は過去にずらしておく
+    past = dt.now() - timedelta(days=1)
+    session.add(AppState(id=1, name="システムモード", state=1, comment="", modified_time=past))
+    for group_id in range(1, groups + 1):
+        session.add(ToiletGroup(id=group_id, name=f"グループ {group_id}", valid=True, modified_time=past))
+        for n in range(toilets_per_group):
+            toilet_id = group_id * toilets_per_group + n
+            session.add(Toilet(id=toilet_id, name=f"トイレ {toilet_id}", valid=True, is_closed=False, modified_time=past))
+            session.add(ToiletGroupMap(id=toilet_id, toilet_id=toilet_id, toilet_group_id=group_id))
+    session.commit()
+
+
+def measure(func, count: int) -> list:
+    """関数を指定回数呼び出し、1回あたりの所要時間 (秒) のリストを返します。
+
+    Arguments:
+        func {function} -- 計測対象の関数
+        count {int} -- 呼出回数
+
+    Returns:
+        list -- 所要時間 (秒) のリスト
+    """
+    elapsed = []
+    for _ in range(count):
+        begin = time.perf_counter()
+        func()
+        elapsed.append(time.perf_counter() - begin)
+    return elapsed
+
+
+def report(title: str, elapsed: list):
+    """計測結果の統計値を標準出力に表示します。
+
+    Arguments:
+        title {str} -- 計測対象の名前
+        elapsed {list} -- 所要時間 (秒) のリスト
+    """
+    ordered = sorted(elapsed)
+    count = len(ordered)
+    mean = sum(ordered) / count
+    p50 = ordered[int(count * 0.50)]
+    p99 = ordered[min(count - 1, int(count * 0.99))]
+    print(f"{title:<40} n={count:<7} mean={mean * 1000:9.3f}ms "
+          f"p50={p50 * 1000:9.3f}ms p99={p99 * 1000:9.3f}ms")
@@ -0,0 +1,125 @@
+###############################################################################
+#    ドアイベントの記録とログ取得が同時に行われる場合の応答時間とロックエラーを、SQLite の PRAGMA プロファイルごとに比較します。
+#    使い方: /server/ 直下で python3 -m benchmark.concurrency [記録スレッド数] [ログ取得スレッド数] [計測秒数]
+#    設定値はエンジン生成時に確定するため、プロファイルごとに子プロセスを起動して計測します。
+#    ログ取得は集計テーブルとキャッシュを使わずに入退室トランザクションを走査させ、読み取りのトランザクションを長くします。
+###############################################################################
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+sys.path.insert(0, ".")
+from datetime import datetime as dt
+from datetime import timedelta
+from benchmark.common import prepare_database, seed_master, report
+
+
+def run_mixed_load(profile: str, writers: int, readers: int, seconds: float):
+    """記録スレッドとログ取得スレッドを同時に動かし、それぞれの応答時間とロックエラーの件数を計測します。
+
+    Arguments:
+        profile {str} -- 計測結果の表示名
+        writers {int} -- ドアの開閉を記録するスレッド数
+        readers {int} -- ログを取得するスレッド数
+        seconds {float} -- 計測秒数
+    """
+    prepare_database("concurrency")
+    # スレッドごとの接続がプールから溢れて別スレッドで破棄されないよう、プールの大きさをスレッド数に合わせる
+    os.environ["DOOR_WATCHER_DB_POOL_SIZE"] = str(writers + readers + 1)
+
+    import app.common as Common
+    from model.toilet_status import ToiletStatus
+    with Common.create_session() as session:
+        seed_master(session, groups=writers, toilets_per_group=1)
+
+        # ログ取得で走査させる30日分のイベントを流し込む
+        random.seed(0)
+        now = dt.now()
+        statuses = []
+        for toilet_id in range(1, writers + 1):
+            created_time = now - timedelta(days=30)
+            is_closed = False
+            while created_time < now - timedelta(hours=1):
+                is_closed = not is_closed
+                statuses.append({"toilet_id": toilet_id, "is_closed": is_closed, "created_time": created_time})
+                created_time += timedelta(minutes=random.randint(1, 20))
+        session.bulk_insert_mappings(ToiletStatus, statuses)
+
+    import logging
+    logging.disable(logging.CRITICAL)
+    import app.door.api as Door
+    import app.logs.api as Logs
+    from app.main import app
+    # 同じトイレを連続して開閉するため、最短呼出間隔の判定は無効にしておく
+    Door.MIN_DOOR_EVENT_SPAN_SECONDS = 0
+    Logs.USE_USAGE_ROLLUP = False
+    Logs.log_result_cache.max_entries = 0
+    # ロックエラーを応答コード 500 ではなく例外のメッセージで判別できるようにする
+    app.config["PROPAGATE_EXCEPTIONS"] = True
+
+    elapsed = {"write": [], "read": []}
+    errors = {"write": [], "read": []}
+    deadline = time.perf_counter() + seconds
+    barrier = threading.Barrier(writers + readers)
+    logs_url = f"/logs/?begin_date={now - timedelta(days=29):%Y%m%d}&end_date={now:%Y%m%d}&step_hours=1&format=columnar"
+
+    def call(kind: str, func):
+        begin = time.perf_counter()
+        try:
+            response = func()
+            if response.status_code != 200 or not response.get_json()["success"]:
+                errors[kind].append(str(response.status_code))
+        except Exception as e:
+            errors[kind].append(str(e).splitlines()[0])
+        elapsed[kind].append(time.perf_counter() - begin)
+
+    def writer(toilet_id: int):
+        client = app.test_client()
+        barrier.wait()
+        n = 0
+        while time.perf_counter() < deadline:
+            url = "/door/close" if n % 2 == 0 else "/door/open"
+            call("write", lambda: client.put(url, json={"toilet_id": toilet_id}))
+            n += 1
+
+    def reader():
+        client = app.test_client()
+        barrier.wait()
+        while time.perf_counter() < deadline:
+            call("read", lambda: client.get(logs_url))
+
+    workers = [threading.Thread(target=writer, args=(x + 1,)) for x in range(writers)]
+    workers += [threading.Thread(target=reader) for x in range(readers)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    for kind in ["write", "read"]:
+        report(f"{profile} {kind}", elapsed[kind])
+        locked_count = len([x for x in errors[kind] if "locked" in x])
+        print(f"{'':<40} throughput={len(elapsed[kind]) / seconds:.1f}/s "
+              f"errors={len(errors[kind])} locked={locked_count}")
+
+
+if __name__ == "__main__":
+    writers = int(sys.argv[1]) if 1 < len(sys.argv) else 8
+    readers = int(sys.argv[2]) if 2 < len(sys.argv) else 4
+    seconds = float(sys.argv[3]) if 3 < len(sys.argv) else 10
+
+    if os.environ.get("DOOR_WATCHER_BENCHMARK_MODE"):
+        run_mixed_load(os.environ["DOOR_WATCHER_BENCHMARK_MODE"], writers, readers, seconds)
+        sys.exit(0)
+
+    for profile in ["default", "tuned"]:
+        env = dict(os.environ)
+        env["DOOR_WATCHER_BENCHMARK_MODE"] = profile
+        env["DOOR_WATCHER_DB_SQLITE_PROFILE"] = profile
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmark.concurrency", str(writers), str(readers), str(seconds)],
+            env=env, stdout=subprocess.PIPE, check=True
+        ).stdout.decode()
+        # DB接続文字列などの出力は読み飛ばし、計測結果だけを表示する
+        print("".join(x + "\n" for x in output.splitlines() if x.startswith(profile) or x.startswith(" ")), end="")
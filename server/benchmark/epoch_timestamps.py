@@ -0,0 +1,68 @@
+###############################################################################
+#    入退室トランザクションテーブルを走査するログ取得の応答時間を、レコード作成日時で絞り込む場合とエポックミリ秒で絞り込む場合で比較します。
+#    使い方: /server/ 直下で python3 -m benchmark.epoch_timestamps [イベント数]
+#    イベント数の既定は100万件です。本番相当の規模を確かめる場合は 10000000 を指定して下さい (流し込みに数分掛かります)。
+#    集計テーブルとキャッシュは使わず、両方の方式で集計結果が一致することも確かめます。
+#    どのトイレも1つのトイレグループだけに紐付いているため、いずれの方式もトイレグループIDとの組のインデックスを使って取得します。
+###############################################################################
+import sys
+sys.path.insert(0, ".")
+from datetime import datetime as dt
+from datetime import timedelta
+from benchmark.common import prepare_database, seed_master, measure, report
+
+
+if __name__ == "__main__":
+    event_count = int(sys.argv[1]) if 1 < len(sys.argv) else 1000000
+    days = 365
+    prepare_database("epoch_timestamps")
+
+    import app.common as Common
+    from sqlalchemy import text
+    from model.toilet import Toilet
+    from model.toilet_status import to_epoch_milliseconds
+    with Common.create_session() as session:
+        seed_master(session)
+
+        # 件数が多いため、イベントはDB側で再帰クエリーによって生成する
+        # トイレを順に巡りながら一定間隔でイベントを並べ、トイレごとに入室と退室を交互に繰り返す
+        now = dt.now()
+        begin_datetime = now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days)
+        toilet_ids = [x.id for x in session.query(Toilet.id).order_by(Toilet.id).all()]
+        session.execute(text(
+            "WITH RECURSIVE seq(n) AS (SELECT 0 UNION ALL SELECT n + 1 FROM seq WHERE n + 1 < :count), "
+            "events(n, toilet_index, ms) AS (SELECT n, n % :toilets, :begin_ms + n * :step_ms FROM seq) "
+            "INSERT INTO toilet_status (toilet_id, is_closed, created_time, created_ms, toilet_group_id) "
+            "SELECT :first_id + toilet_index, (n / :toilets) % 2 = 0, "
+            "strftime('%Y-%m-%d %H:%M:%S', ms / 1000, 'unixepoch') || printf('.%06d', ms % 1000 * 1000), ms, "
+            "(SELECT m.toilet_group_id FROM toilet_group_map m WHERE m.toilet_id = :first_id + toilet_index ORDER BY m.id LIMIT 1) "
+            "FROM events"
+        ), {
+            "count": event_count,
+            "toilets": len(toilet_ids),
+            "first_id": toilet_ids[0],
+            "begin_ms": to_epoch_milliseconds(begin_datetime),
+            "step_ms": days * 24 * 60 * 60 * 1000 // event_count
+        })
+    print(f"events={event_count} days={days}")
+
+    from app.main import app
+    import app.logs.api as Logs
+    Logs.USE_USAGE_ROLLUP = False
+    Logs.log_result_cache.max_entries = 0
+    client = app.test_client()
+
+    import logging
+    logging.disable(logging.INFO)
+    for window_days in [7, 30, days]:
+        url = f"/logs/?begin_date={now - timedelta(days=window_days):%Y%m%d}&end_date={now:%Y%m%d}" \
+              f"&step_minutes=30&format=columnar"
+        results = {}
+        for use_epoch_timestamps in [False, True]:
+            Logs.USE_EPOCH_TIMESTAMPS = use_epoch_timestamps
+            results[use_epoch_timestamps] = client.get(url).get_json()
+            title = f"days={window_days:>3} {'created_ms' if use_epoch_timestamps else 'created_time'}"
+            report(title, measure(lambda: client.get(url), 3))
+        if results[False] != results[True]:
+            print(f"集計結果が一致しません。 :days={window_days}")
+            sys.exit(1)
@@ -0,0 +1,58 @@
+###############################################################################
+#    ヒートマップAPI (曜日×時間帯) の応答時間を計測します。
+#    使い方: /server/ 直下で python3 -m benchmark.heatmap [1日あたりの入室回数]
+#    1年分のイベントを流し込み、週の数を変えながら、キャッシュが無い場合と終わった週がキャッシュ済みの場合を比べます。
+###############################################################################
+import random
+import sys
+sys.path.insert(0, ".")
+from datetime import datetime as dt
+from datetime import timedelta
+from benchmark.common import prepare_database, seed_master, measure, report
+
+
+if __name__ == "__main__":
+    visits_per_day = int(sys.argv[1]) if 1 < len(sys.argv) else 100
+    days = 365
+    prepare_database("heatmap")
+
+    import app.common as Common
+    from model.toilet import Toilet
+    from model.toilet_status import ToiletStatus
+    from app.logs.rollup import refresh_usage_rollups
+    with Common.create_session() as session:
+        seed_master(session)
+
+        # トイレごとに入室と退室が交互に並ぶイベントを流し込む
+        random.seed(0)
+        now = dt.now()
+        begin_datetime = now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days)
+        toilet_ids = [x.id for x in session.query(Toilet.id).all()]
+        statuses = []
+        for toilet_id in toilet_ids:
+            for day in range(days):
+                for minutes in sorted(random.sample(range(0, 24 * 60, 10), visits_per_day // len(toilet_ids))):
+                    closed_time = begin_datetime + timedelta(days=day, minutes=minutes)
+                    statuses.append({"toilet_id": toilet_id, "is_closed": True, "created_time": closed_time})
+                    statuses.append({"toilet_id": toilet_id, "is_closed": False,
+                                     "created_time": closed_time + timedelta(minutes=random.randint(1, 9))})
+        session.bulk_insert_mappings(ToiletStatus, statuses)
+        session.commit()
+        refresh_usage_rollups(session)
+    print(f"events={len(statuses)} days={days}")
+
+    from app.main import app
+    import app.logs.api as Logs
+    client = app.test_client()
+
+    import logging
+    logging.disable(logging.INFO)
+    for weeks in [4, 13, 52]:
+        url = f"/logs/heatmap?weeks={weeks}"
+
+        def request_without_cache():
+            Logs.log_result_cache.entries.clear()
+            return client.get(url)
+        report(f"weeks={weeks:>2} no cache", measure(request_without_cache, 5))
+        client.get(url)
+        report(f"weeks={weeks:>2} finished weeks cached", measure(lambda: client.get(url), 5))
@@ -0,0 +1,92 @@
+###############################################################################
+#    ドアイベントが集中した場合の記録APIの応答時間を、write-behind モードの有無で比較します。
+#    使い方: /server/ 直下で python3 -m benchmark.ingest [スレッド数] [スレッドあたりの呼出回数]
+#    設定値はモジュール読込時に確定するため、モードごとに子プロセスを起動して計測します。
+###############################################################################
+import os
+import subprocess
+import sys
+import threading
+import time
+sys.path.insert(0, ".")
+from benchmark.common import prepare_database, seed_master, report
+
+
+def run_burst(mode: str, threads: int, count: int):
+    """複数のスレッドから同時にドアの開閉を記録し、1回あたりの応答時間を計測します。
+
+    Arguments:
+        mode {str} -- 計測結果の表示名
+        threads {int} -- 同時に呼び出すスレッド数
+        count {int} -- スレッドあたりの呼出回数
+    """
+    prepare_database("ingest")
+    # スレッドごとの接続がプールから溢れて別スレッドで破棄されないよう、プールの大きさをスレッド数に合わせる
+    os.environ["DOOR_WATCHER_DB_POOL_SIZE"] = str(threads + 1)
+    if os.environ.get("DOOR_WATCHER_DOOR_WRITE_BEHIND") == "true":
+        os.environ["DOOR_WATCHER_DOOR_JOURNAL_FILE"] = \
+            os.path.join(os.path.dirname(os.environ["DOOR_WATCHER_STATUS_VERSION_FILE"]), "door.journal")
+
+    import app.common as Common
+    with Common.create_session() as session:
+        seed_master(session, groups=threads, toilets_per_group=1)
+
+    import logging
+    logging.disable(logging.INFO)
+    import app.door.api as Door
+    from app.main import app
+    from model.toilet_status import ToiletStatus
+    # 同じトイレを連続して開閉するため、最短呼出間隔の判定は無効にしておく
+    Door.MIN_DOOR_EVENT_SPAN_SECONDS = 0
+
+    elapsed = []
+    failures = []
+    barrier = threading.Barrier(threads)
+
+    def worker(toilet_id: int):
+        client = app.test_client()
+        barrier.wait()
+        for n in range(count):
+            url = "/door/close" if n % 2 == 0 else "/door/open"
+            begin = time.perf_counter()
+            result = client.put(url, json={"toilet_id": toilet_id}).get_json()
+            elapsed.append(time.perf_counter() - begin)
+            if not result["success"]:
+                failures.append(result["reason"])
+
+    workers = [threading.Thread(target=worker, args=(x + 1,)) for x in range(threads)]
+    begin = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    total = time.perf_counter() - begin
+
+    if Door.door_journal is not None:
+        Door.door_journal.flush()
+    with Common.create_session() as session:
+        recorded = session.query(ToiletStatus).count()
+
+    report(mode, elapsed)
+    print(f"{'':<40} total={total:.3f}s throughput={len(elapsed) / total:.1f}/s "
+          f"recorded={recorded} failures={len(failures)}")
+
+
+if __name__ == "__main__":
+    threads = int(sys.argv[1]) if 1 < len(sys.argv) else 20
+    count = int(sys.argv[2]) if 2 < len(sys.argv) else 50
+
+    if os.environ.get("DOOR_WATCHER_BENCHMARK_MODE"):
+        run_burst(os.environ["DOOR_WATCHER_BENCHMARK_MODE"], threads, count)
+        sys.exit(0)
+
+    for mode, write_behind in [("synchronous UPDATE", "false"), ("write-behind journal", "true")]:
+        env = dict(os.environ)
+        env["DOOR_WATCHER_BENCHMARK_MODE"] = mode
+        env["DOOR_WATCHER_DOOR_WRITE_BEHIND"] = write_behind
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmark.ingest", str(threads), str(count)],
+            env=env, stdout=subprocess.PIPE, check=True
+        ).stdout.decode()
+        # DB接続文字列などの出力は読み飛ばし、計測結果だけを表示する
+        print("".join(x + "\n" for x in output.splitlines() if x.startswith(mode) or x.startswith(" ")), end="")
@@ -0,0 +1,59 @@
+###############################################################################
+#    ログ取得APIの日単位の集計結果キャッシュの効果を計測します。
+#    使い方: /server/ 直下で python3 -m benchmark.log_cache [日数] [1日あたりの入室回数]
+###############################################################################
+import random
+import sys
+sys.path.insert(0, ".")
+from datetime import datetime as dt
+from datetime import timedelta
+from benchmark.common import prepare_database, seed_master, measure, report
+
+
+if __name__ == "__main__":
+    days = int(sys.argv[1]) if 1 < len(sys.argv) else 10
+    visits_per_day = int(sys.argv[2]) if 2 < len(sys.argv) else 200
+    prepare_database("log_cache")
+
+    import app.common as Common
+    from model.toilet import Toilet
+    from model.toilet_status import ToiletStatus
+    with Common.create_session() as session:
+        seed_master(session)
+
+        # トイレごとに入室と退室が交互に並ぶイベントを流し込む
+        random.seed(0)
+        now = dt.now()
+        begin_datetime = now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days - 1)
+        toilet_ids = [x.id for x in session.query(Toilet.id).all()]
+        statuses = []
+        for toilet_id in toilet_ids:
+            for day in range(days):
+                for minutes in sorted(random.sample(range(0, 24 * 60, 10), visits_per_day // len(toilet_ids))):
+                    closed_time = begin_datetime + timedelta(days=day, minutes=minutes)
+                    if now <= closed_time + timedelta(minutes=9):
+                        continue
+                    statuses.append({"toilet_id": toilet_id, "is_closed": True, "created_time": closed_time})
+                    statuses.append({"toilet_id": toilet_id, "is_closed": False,
+                                     "created_time": closed_time + timedelta(minutes=random.randint(1, 9))})
+        session.bulk_insert_mappings(ToiletStatus, statuses)
+    print(f"events={len(statuses)} days={days}")
+
+    from app.main import app
+    import app.logs.api as Logs
+    client = app.test_client()
+    url = f"/logs/?begin_date={begin_datetime:%Y%m%d}&end_date={now:%Y%m%d}"\
+          f"&begin_hours_per_day=0&end_hours_per_day=24&step_hours=1"
+
+    import logging
+    logging.disable(logging.INFO)
+    expected = client.get(url).get_json()
+
+    max_entries = Logs.log_result_cache.max_entries
+    Logs.log_result_cache.max_entries = 0
+    assert client.get(url).get_json() == expected
+    report("no cache", measure(lambda: client.get(url), 20))
+
+    Logs.log_result_cache.max_entries = max_entries
+    assert client.get(url).get_json() == expected
+    report("per-day cache (finished days)", measure(lambda: client.get(url), 20))
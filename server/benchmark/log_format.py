@@ -0,0 +1,46 @@
+###############################################################################
+#    ログ取得APIの応答形式ごとのデータサイズとシリアライズ所要時間を計測します。
+#    使い方: /server/ 直下で python3 -m benchmark.log_format [日数] [トイレグループ数]
+#    既定では1年分を1時間刻みで集計した結果を、Chart.js のグラフデータ形式と列指向形式でそれぞれ JSON に変換します。
+###############################################################################
+import json
+import random
+import sys
+from datetime import datetime as dt
+from datetime import timedelta
+sys.path.insert(0, ".")
+from benchmark.common import prepare_database, measure, report
+
+
+if __name__ == "__main__":
+    days = int(sys.argv[1]) if 1 < len(sys.argv) else 365
+    groups = int(sys.argv[2]) if 2 < len(sys.argv) else 8
+    prepare_database("log_format")
+    from app.logs.api import build_log_graphs, build_columnar_logs
+
+    # 0時から24時まで1時間刻みの集計区間と、系列ごとのランダムな集計結果を生成する
+    random.seed(0)
+    begin_datetime = dt(2020, 1, 1)
+    pairs = [{
+        "begin": begin_datetime + timedelta(hours=x),
+        "end": begin_datetime + timedelta(hours=x + 1)
+    } for x in range(days * 24)]
+    group_ids = list(range(groups))
+    group_names = [f"{x}F 男性用トイレ" for x in group_ids]
+    frequencies_by_group = [[random.randint(0, 10) for x in pairs] for y in group_ids]
+    occupancies_by_group = [[random.random() for x in pairs] for y in group_ids]
+    print(f"series={groups} buckets={len(pairs)}")
+
+    def serialize_graphs():
+        return json.dumps(build_log_graphs(group_names, pairs, 1, frequencies_by_group, occupancies_by_group),
+                          separators=(",", ":"))
+
+    def serialize_columnar():
+        return json.dumps(build_columnar_logs(group_ids, group_names, begin_datetime, 0, 24, 1,
+                                              frequencies_by_group, occupancies_by_group),
+                          separators=(",", ":"))
+
+    print(f"{'graphs':<40} bytes={len(serialize_graphs()):,}")
+    print(f"{'columnar':<40} bytes={len(serialize_columnar()):,}")
+    report("graphs (build + serialize)", measure(serialize_graphs, 10))
+    report("columnar (build + serialize)", measure(serialize_columnar, 10))
@@ -0,0 +1,60 @@
+###############################################################################
+#    ログ取得APIの解像度の自動選択 (resolution=auto) による、期間の長さごとの応答時間を計測します。
+#    使い方: /server/ 直下で python3 -m benchmark.log_resolution [1日あたりの入室回数]
+#    1年分のイベントを流し込み、期間を変えながら1時間刻み固定の場合と比べます。集計結果のキャッシュは使用しません。
+###############################################################################
+import random
+import sys
+sys.path.insert(0, ".")
+from datetime import datetime as dt
+from datetime import timedelta
+from benchmark.common import prepare_database, seed_master, measure, report
+
+
+if __name__ == "__main__":
+    visits_per_day = int(sys.argv[1]) if 1 < len(sys.argv) else 100
+    days = 365
+    prepare_database("log_resolution")
+
+    import app.common as Common
+    from model.toilet import Toilet
+    from model.toilet_status import ToiletStatus
+    from app.logs.rollup import refresh_usage_rollups
+    from app.logs.toilet_session import rebuild_toilet_sessions
+    with Common.create_session() as session:
+        seed_master(session)
+
+        # トイレごとに入室と退室が交互に並ぶイベントを流し込む
+        random.seed(0)
+        now = dt.now()
+        begin_datetime = now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days)
+        toilet_ids = [x.id for x in session.query(Toilet.id).all()]
+        statuses = []
+        for toilet_id in toilet_ids:
+            for day in range(days):
+                for minutes in sorted(random.sample(range(0, 24 * 60, 10), visits_per_day // len(toilet_ids))):
+                    closed_time = begin_datetime + timedelta(days=day, minutes=minutes)
+                    statuses.append({"toilet_id": toilet_id, "is_closed": True, "created_time": closed_time})
+                    statuses.append({"toilet_id": toilet_id, "is_closed": False,
+                                     "created_time": closed_time + timedelta(minutes=random.randint(1, 9))})
+        session.bulk_insert_mappings(ToiletStatus, statuses)
+        session.commit()
+        refresh_usage_rollups(session)
+        rebuild_toilet_sessions(session)
+    print(f"events={len(statuses)} days={days}")
+
+    from app.main import app
+    import app.logs.api as Logs
+    Logs.log_result_cache.max_entries = 0
+    client = app.test_client()
+
+    import logging
+    logging.disable(logging.INFO)
+    for span_days in [7, 30, 90, 365]:
+        url = f"/logs/?begin_date={now - timedelta(days=span_days - 1):%Y%m%d}&end_date={now:%Y%m%d}"\
+              f"&begin_hours_per_day=0&end_hours_per_day=24&format=columnar"
+        resolution = client.get(url + "&resolution=auto").get_json()["resolution"]
+        report(f"{span_days:>3} days step_hours=1",
+               measure(lambda: client.get(url + "&step_hours=1"), 5))
+        report(f"{span_days:>3} days auto ({resolution['step_minutes']}min {resolution['source']})",
+               measure(lambda: client.get(url + "&resolution=auto"), 5))
@@ -0,0 +1,43 @@
+###############################################################################
+#    リクエストあたりのDB接続セッション生成コストを計測します。
+#    使い方: /server/ 直下で python3 -m benchmark.session [呼出回数]
+###############################################################################
+import sys
+sys.path.insert(0, ".")
+from benchmark.common import prepare_database, seed_master, measure, report
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if 1 < len(sys.argv) else 500
+    db_path = prepare_database("session")
+
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.pool import SingletonThreadPool
+    import app.common as Common
+    with Common.create_session() as session:
+        seed_master(session)
+
+    def per_request_engine(echo: bool):
+        # 変更前: リクエストのたびにエンジンとセッション生成器を作り直す
+        def run():
+            engine = create_engine(db_path, echo=echo, poolclass=SingletonThreadPool)
+            session = sessionmaker(bind=engine)()
+            Common.get_system_mode(session)
+            session.commit()
+            session.close()
+        return run
+
+    def shared_engine():
+        # 変更後: プロセス内で共有するエンジンレジストリーからセッションを得る
+        with Common.create_session() as session:
+            Common.get_system_mode(session)
+
+    # 変更前の echo=True 相当はログ出力を伴うため、出力先を捨てた上で計測する
+    import logging
+    logging.getLogger("sqlalchemy.engine").handlers = [logging.NullHandler()]
+    logging.getLogger("sqlalchemy.engine").propagate = False
+
+    report("per-request engine (echo=True)", measure(per_request_engine(True), count))
+    report("per-request engine (echo=False)", measure(per_request_engine(False), count))
+    report("shared engine registry", measure(shared_engine, count))
@@ -0,0 +1,80 @@
+###############################################################################
+#    現況取得APIの応答データ組み立て処理のスケーラビリティを計測します。
+#    使い方: /server/ 直下で python3 -m benchmark.status
+###############################################################################
+import sys
+sys.path.insert(0, ".")
+from collections import namedtuple
+from benchmark.common import prepare_database, measure, report
+
+# DBの取得結果を模したレコード
+Row = namedtuple("Row", ["id", "name", "valid", "is_closed", "toilet_group_id"])
+GroupRecord = namedtuple("GroupRecord", ["ToiletGroup", "ToiletGroupMap", "max"])
+ToiletRecord = namedtuple("ToiletRecord", ["Toilet", "ToiletGroupMap"])
+
+
+def create_records(groups: int, toilets: int) -> tuple:
+    """トイレグループとトイレの取得結果を模したレコードを生成します。
+
+    Arguments:
+        groups {int} -- トイレグループ数
+        toilets {int} -- トイレ数
+
+    Returns:
+        tuple -- (トイレグループのレコードリスト, トイレのレコードリスト)
+    """
+    per_group = toilets // groups
+    group_records = [
+        GroupRecord(Row(g, f"グループ {g}", True, None, None), Row(None, None, None, None, g), per_group)
+        for g in range(groups)
+    ]
+    toilet_records = [
+        ToiletRecord(Row(t, f"トイレ {t}", True, t % 3 == 0, None), Row(None, None, None, None, t // per_group))
+        for t in range(toilets)
+    ]
+    return group_records, toilet_records
+
+
+def assemble_status_nested(toilet_groups: list, toilets: list) -> list:
+    """変更前の トイレグループ数×トイレ数 の二重ループによる組み立て処理です。
+    """
+    status = []
+    for toilet_group in toilet_groups:
+        status.append({
+            "id": toilet_group.ToiletGroup.id,
+            "name": toilet_group.ToiletGroup.name,
+            "valid": toilet_group.ToiletGroup.valid,
+            "max": toilet_group.max,
+            "used": 0,
+            "rate100": 0,
+            "details": []
+        })
+        for toilet in toilets:
+            if toilet.ToiletGroupMap.toilet_group_id != toilet_group.ToiletGroup.id:
+                continue
+            if toilet.Toilet.is_closed:
+                status[-1]["used"] += 1
+            status[-1]["details"].append({
+                "id": toilet.Toilet.id,
+                "name": toilet.Toilet.name,
+                "used": toilet.Toilet.is_closed,
+                "valid": toilet.Toilet.valid
+            })
+        status[-1]["rate100"] = int(status[-1]["used"] / toilet_group.max * 100)
+    return status
+
+
+if __name__ == "__main__":
+    prepare_database("status")
+    from app.api import assemble_status
+
+    for groups, toilets in [(100, 1000), (250, 2500), (500, 5000), (1000, 10000)]:
+        group_records, toilet_records = create_records(groups, toilets)
+        assert assemble_status(group_records, toilet_records) == \
+            assemble_status_nested(group_records, toilet_records)
+
+        count = 3 if 500 <= groups else 10
+        report(f"nested loop  G={groups} T={toilets}",
+               measure(lambda: assemble_status_nested(group_records, toilet_records), count))
+        report(f"bucketed     G={groups} T={toilets}",
+               measure(lambda: assemble_status(group_records, toilet_records), 20))
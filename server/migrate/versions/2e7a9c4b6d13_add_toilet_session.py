@@ -0,0 +1,36 @@
+"""add toilet_session
+
+Revision ID: 2e7a9c4b6d13
+Revises: 8d5b7e2f1a64
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2e7a9c4b6d13'
+down_revision = '8d5b7e2f1a64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 既存のトイレ入退室トランザクションからの作り直しは python3 -m app.logs.toilet_session rebuild で行って下さい
+    op.create_table(
+        "toilet_session",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("toilet_id", sa.Integer(), nullable=False),
+        sa.Column("started_at", sa.DateTime(), nullable=False),
+        sa.Column("ended_at", sa.DateTime(), nullable=False),
+        sa.Column("duration_s", sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(["toilet_id"], ["toilet.id"]),
+        sa.PrimaryKeyConstraint("id")
+    )
+    op.create_index("ix_toilet_session_toilet_id_started_at", "toilet_session", ["toilet_id", "started_at"])
+
+
+def downgrade():
+    op.drop_index("ix_toilet_session_toilet_id_started_at", table_name="toilet_session")
+    op.drop_table("toilet_session")
@@ -0,0 +1,79 @@
+"""create base tables
+
+Revision ID: 4c1f0a2d9e31
+Revises:
+Create Date: 2026-10-18 14:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c1f0a2d9e31'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 以前はビルド時に自動生成したリビジョンでテーブルを作成していたため、既に存在するテーブルは作成しない
+    existing_tables = sa.inspect(op.get_bind()).get_table_names()
+
+    if "app_state" not in existing_tables:
+        op.create_table(
+            "app_state",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("name", sa.Text(), nullable=True),
+            sa.Column("state", sa.Integer(), nullable=False),
+            sa.Column("comment", sa.Text(), nullable=True),
+            sa.Column("modified_time", sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint("id")
+        )
+    if "toilet" not in existing_tables:
+        op.create_table(
+            "toilet",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("name", sa.Text(), nullable=False),
+            sa.Column("valid", sa.Boolean(), nullable=False),
+            sa.Column("is_closed", sa.Boolean(), nullable=False),
+            sa.Column("modified_time", sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint("id")
+        )
+    if "toilet_group" not in existing_tables:
+        op.create_table(
+            "toilet_group",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("name", sa.Text(), nullable=False),
+            sa.Column("valid", sa.Boolean(), nullable=False),
+            sa.Column("modified_time", sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint("id")
+        )
+    if "toilet_group_map" not in existing_tables:
+        op.create_table(
+            "toilet_group_map",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("toilet_id", sa.Integer(), nullable=False),
+            sa.Column("toilet_group_id", sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(["toilet_group_id"], ["toilet_group.id"]),
+            sa.ForeignKeyConstraint(["toilet_id"], ["toilet.id"]),
+            sa.PrimaryKeyConstraint("id")
+        )
+    if "toilet_status" not in existing_tables:
+        op.create_table(
+            "toilet_status",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("toilet_id", sa.Integer(), nullable=False),
+            sa.Column("is_closed", sa.Boolean(), nullable=False),
+            sa.Column("created_time", sa.DateTime(), nullable=False),
+            sa.ForeignKeyConstraint(["toilet_id"], ["toilet.id"]),
+            sa.PrimaryKeyConstraint("id")
+        )
+
+
+def downgrade():
+    op.drop_table("toilet_status")
+    op.drop_table("toilet_group_map")
+    op.drop_table("toilet_group")
+    op.drop_table("toilet")
+    op.drop_table("app_state")
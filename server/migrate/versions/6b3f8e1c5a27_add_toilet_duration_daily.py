@@ -0,0 +1,35 @@
+"""add toilet_duration_daily
+
+Revision ID: 6b3f8e1c5a27
+Revises: 2e7a9c4b6d13
+Create Date: 2026-10-18 15:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6b3f8e1c5a27'
+down_revision = '2e7a9c4b6d13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 既存のトイレ使用セッションからの作り直しは python3 -m app.logs.toilet_session rebuild で行って下さい
+    op.create_table(
+        "toilet_duration_daily",
+        sa.Column("toilet_id", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("day", sa.DateTime(), nullable=False),
+        sa.Column("hour", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.Column("total_seconds", sa.Float(), nullable=False),
+        sa.Column("buckets", sa.Text(), nullable=False),
+        sa.Column("modified_time", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("toilet_id", "day", "hour")
+    )
+
+
+def downgrade():
+    op.drop_table("toilet_duration_daily")
@@ -0,0 +1,25 @@
+"""add toilet_status (toilet_group_id, created_ms) index
+
+Revision ID: 7f2c4e8a9b35
+Revises: e3a7d9b2c418
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7f2c4e8a9b35'
+down_revision = 'e3a7d9b2c418'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_toilet_status_toilet_group_id_created_ms", "toilet_status",
+                    ["toilet_group_id", "created_ms", "is_closed"])
+
+
+def downgrade():
+    op.drop_index("ix_toilet_status_toilet_group_id_created_ms", table_name="toilet_status")
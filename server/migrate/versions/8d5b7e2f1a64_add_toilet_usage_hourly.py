@@ -0,0 +1,52 @@
+"""add toilet_usage_hourly
+
+Revision ID: 8d5b7e2f1a64
+Revises: 4c1f0a2d9e31
+Create Date: 2026-10-18 14:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from datetime import datetime as dt
+
+
+# revision identifiers, used by Alembic.
+revision = '8d5b7e2f1a64'
+down_revision = '4c1f0a2d9e31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "toilet_usage_hourly",
+        sa.Column("toilet_id", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("hour", sa.DateTime(), nullable=False),
+        sa.Column("closed_count", sa.Integer(), nullable=False),
+        sa.Column("occupied_seconds", sa.Float(), nullable=False),
+        sa.Column("modified_time", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("toilet_id", "hour")
+    )
+
+    # 集計テーブルに反映済みのトイレ入退室トランザクションID
+    # 既存のトイレ入退室トランザクションは python3 -m app.logs.rollup rebuild で反映して下さい
+    app_state = sa.table(
+        "app_state",
+        sa.column("id", sa.Integer),
+        sa.column("name", sa.Text),
+        sa.column("state", sa.Integer),
+        sa.column("comment", sa.Text),
+        sa.column("modified_time", sa.DateTime)
+    )
+    exists = op.get_bind().execute(sa.select([app_state.c.id]).where(app_state.c.id == 3)).first()
+    if exists is None:
+        op.bulk_insert(app_state, [{
+            "id": 3, "name": "トイレ使用状況集計", "state": 0,
+            "comment": "集計テーブルに反映済みのトイレ入退室トランザクションID",
+            "modified_time": dt.now()
+        }])
+
+
+def downgrade():
+    op.execute("DELETE FROM app_state WHERE id = 3")
+    op.drop_table("toilet_usage_hourly")
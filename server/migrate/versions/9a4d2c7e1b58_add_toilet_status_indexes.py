@@ -0,0 +1,26 @@
+"""add toilet_status indexes
+
+Revision ID: 9a4d2c7e1b58
+Revises: 6b3f8e1c5a27
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4d2c7e1b58'
+down_revision = '6b3f8e1c5a27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_toilet_status_created_time", "toilet_status", ["created_time", "toilet_id", "is_closed"])
+    op.create_index("ix_toilet_status_toilet_id_created_time", "toilet_status", ["toilet_id", "created_time", "is_closed"])
+
+
+def downgrade():
+    op.drop_index("ix_toilet_status_toilet_id_created_time", table_name="toilet_status")
+    op.drop_index("ix_toilet_status_created_time", table_name="toilet_status")
@@ -0,0 +1,41 @@
+"""add toilet_status.created_ms
+
+Revision ID: c5e8a1f3d702
+Revises: 9a4d2c7e1b58
+Create Date: 2026-10-18 16:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e8a1f3d702'
+down_revision = '9a4d2c7e1b58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("toilet_status", sa.Column("created_ms", sa.BigInteger(), nullable=True))
+
+    # 既存のレコードのレコード作成日時をエポックミリ秒に変換する (ミリ秒未満は切り捨て)
+    if op.get_bind().dialect.name == "sqlite":
+        # SQLite では日時を 'YYYY-MM-DD HH:MM:SS.ffffff' 形式の文字列で保持している
+        op.execute(
+            "UPDATE toilet_status SET created_ms = "
+            "CAST(strftime('%s', created_time) AS INTEGER) * 1000 + CAST(substr(created_time, 21, 3) AS INTEGER)"
+        )
+    else:
+        op.execute(
+            "UPDATE toilet_status SET created_ms = "
+            "TIMESTAMPDIFF(MICROSECOND, '1970-01-01 00:00:00', created_time) DIV 1000"
+        )
+
+    op.create_index("ix_toilet_status_created_ms", "toilet_status", ["created_ms", "toilet_id", "is_closed"])
+
+
+def downgrade():
+    op.drop_index("ix_toilet_status_created_ms", table_name="toilet_status")
+    with op.batch_alter_table("toilet_status") as batch_op:
+        batch_op.drop_column("created_ms")
@@ -0,0 +1,57 @@
+"""add toilet_status.toilet_group_id
+
+Revision ID: e3a7d9b2c418
+Revises: c5e8a1f3d702
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3a7d9b2c418'
+down_revision = 'c5e8a1f3d702'
+branch_labels = None
+depends_on = None
+
+# 紐付けが変わったトイレについて、トイレ入退室トランザクションのトイレグループIDを過去のレコードも含めて付け替えるトリガー
+# (トリガー名, 契機となる操作, 付け替えるトイレIDの式)
+RESTAMP_TRIGGERS = [
+    ("tr_toilet_group_map_insert", "INSERT", "NEW.toilet_id"),
+    ("tr_toilet_group_map_update", "UPDATE", "OLD.toilet_id, NEW.toilet_id"),
+    ("tr_toilet_group_map_delete", "DELETE", "OLD.toilet_id"),
+]
+# 複数のトイレグループに紐付いている場合は、最初に紐付けたものとする
+RESTAMP_STATEMENT = "UPDATE toilet_status SET toilet_group_id = (" \
+    "SELECT m.toilet_group_id FROM toilet_group_map m WHERE m.toilet_id = toilet_status.toilet_id ORDER BY m.id LIMIT 1" \
+    ") WHERE toilet_id IN ({})"
+
+
+def upgrade():
+    op.add_column("toilet_status", sa.Column("toilet_group_id", sa.Integer(), nullable=True))
+
+    # 既存のレコードに現在のトイレグループ紐付けを写す
+    op.execute(
+        "UPDATE toilet_status SET toilet_group_id = ("
+        "SELECT m.toilet_group_id FROM toilet_group_map m WHERE m.toilet_id = toilet_status.toilet_id ORDER BY m.id LIMIT 1"
+        ")"
+    )
+
+    # 以降に紐付けが変わった場合は、そのトイレのレコードをすべて付け替える (SQLite ではトリガーの本体を BEGIN ... END で囲む必要がある)
+    is_sqlite = op.get_bind().dialect.name == "sqlite"
+    for name, operation, toilet_ids in RESTAMP_TRIGGERS:
+        head = f"CREATE TRIGGER {name} AFTER {operation} ON toilet_group_map FOR EACH ROW"
+        statement = RESTAMP_STATEMENT.format(toilet_ids)
+        op.execute(f"{head} BEGIN {statement}; END" if is_sqlite else f"{head} {statement}")
+
+    op.create_index("ix_toilet_status_toilet_group_id_created_time", "toilet_status",
+                    ["toilet_group_id", "created_time", "is_closed"])
+
+
+def downgrade():
+    for name, operation, toilet_ids in RESTAMP_TRIGGERS:
+        op.execute(f"DROP TRIGGER IF EXISTS {name}")
+    op.drop_index("ix_toilet_status_toilet_group_id_created_time", table_name="toilet_status")
+    with op.batch_alter_table("toilet_status") as batch_op:
+        batch_op.drop_column("toilet_group_id")
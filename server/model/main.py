@@ -10,6 +10,9 @@ from model.toilet_status import ToiletStatus
 from model.toilet_group import ToiletGroup
 from model.toilet_group_map import ToiletGroupMap
 from model.app_state import AppState
+from model.toilet_usage_hourly import ToiletUsageHourly
+from model.toilet_session import ToiletSession
+from model.toilet_duration_daily import ToiletDurationDaily
 from datetime import datetime as dt
 from datetime import timedelta
 from sqlalchemy import create_engine
@@ -26,6 +29,9 @@ if __name__ == "__main__":
     session.query(ToiletGroup).delete()
     session.query(ToiletGroupMap).delete()
     session.query(AppState).delete()
+    session.query(ToiletUsageHourly).delete()
+    session.query(ToiletSession).delete()
+    session.query(ToiletDurationDaily).delete()
 
     # 初期状態で挿入するレコードの定義 ここから >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
     now = dt.now()
@@ -36,6 +42,11 @@ if __name__ == "__main__":
             id=1, name="システムモード", state=1,
             comment="0=使用できない状態, 1=使用可能な状態",
             modified_time=now
+        ),
+        AppState(
+            id=3, name="トイレ使用状況集計", state=0,
+            comment="集計テーブルに反映済みのトイレ入退室トランザクションID",
+            modified_time=now
         )
     ])
 
@@ -78,3 +89,7 @@ if __name__ == "__main__":
 
     # 変更をコミット
     session.commit()
+
+    # 稼働中のWebアプリケーションに現況のスナップショットを作り直させる
+    import app.common as Common
+    Common.status_version.increment()
@@ -0,0 +1,34 @@
+###############################################################################
+#    トイレの使用時間の分布を日・時間帯単位で保持するテーブルの定義
+###############################################################################
+from model import Base
+from sqlalchemy.sql.schema import Column
+from sqlalchemy.sql.sqltypes import Integer, Float, Text, DateTime
+
+
+"""トイレ使用時間分布テーブル (日・時間帯単位)
+"""
+class ToiletDurationDaily(Base):
+    __tablename__ = "toilet_duration_daily"
+    __table_args__ = {"extend_existing": True}
+
+    # トイレID
+    toilet_id = Column(Integer, primary_key=True, autoincrement=False)
+
+    # 入室した日 (0時0分0秒)
+    day = Column(DateTime, primary_key=True)
+
+    # 入室した時間帯 (0-23)
+    hour = Column(Integer, primary_key=True, autoincrement=False)
+
+    # 使用回数
+    count = Column(Integer, nullable=False)
+
+    # 使用秒数の合計
+    total_seconds = Column(Float, nullable=False)
+
+    # 使用秒数の分布 (対数スケールの区間番号 -> 使用回数 の JSON)
+    buckets = Column(Text, nullable=False)
+
+    # レコード更新日時
+    modified_time = Column(DateTime, nullable=False)
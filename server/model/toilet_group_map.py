@@ -2,7 +2,7 @@
 #    トイレに対するグループの紐付けを表すテーブルの定義
 ###############################################################################
 from model import Base
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, DDL, event
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql.schema import Column
 from sqlalchemy.sql.sqltypes import Integer, Text, Boolean, DateTime
@@ -22,3 +22,25 @@ class ToiletGroupMap(Base):
 
     # トイレグループID
     toilet_group_id = Column(Integer, ForeignKey("toilet_group.id"), nullable=False)
+
+
+# 紐付けが変わったトイレについて、トイレ入退室トランザクションのトイレグループIDを過去のレコードも含めて付け替えるトリガー
+# (トリガー名, 契機となる操作, 付け替えるトイレIDの式)
+RESTAMP_TRIGGERS = [
+    ("tr_toilet_group_map_insert", "INSERT", "NEW.toilet_id"),
+    ("tr_toilet_group_map_update", "UPDATE", "OLD.toilet_id, NEW.toilet_id"),
+    ("tr_toilet_group_map_delete", "DELETE", "OLD.toilet_id"),
+]
+# 複数のトイレグループに紐付いている場合は、登録時と同じく最初に紐付けたものとする
+RESTAMP_STATEMENT = "UPDATE toilet_status SET toilet_group_id = (" \
+    "SELECT m.toilet_group_id FROM toilet_group_map m WHERE m.toilet_id = toilet_status.toilet_id ORDER BY m.id LIMIT 1" \
+    ") WHERE toilet_id IN ({})"
+
+# テーブルの作成時にトリガーも作成する (SQLite ではトリガーの本体を BEGIN ... END で囲む必要がある)
+for name, operation, toilet_ids in RESTAMP_TRIGGERS:
+    head = f"CREATE TRIGGER {name} AFTER {operation} ON toilet_group_map FOR EACH ROW"
+    statement = RESTAMP_STATEMENT.format(toilet_ids)
+    event.listen(ToiletGroupMap.__table__, "after_create",
+                 DDL(f"{head} BEGIN {statement}; END").execute_if(dialect="sqlite"))
+    event.listen(ToiletGroupMap.__table__, "after_create",
+                 DDL(f"{head} {statement}").execute_if(dialect="mysql"))
@@ -0,0 +1,32 @@
+###############################################################################
+#    トイレの使用1回分 (入室から退室まで) を表すテーブルの定義
+###############################################################################
+from model import Base
+from sqlalchemy import ForeignKey, Index
+from sqlalchemy.sql.schema import Column
+from sqlalchemy.sql.sqltypes import Integer, Float, DateTime
+
+
+"""トイレ使用セッションテーブル
+"""
+class ToiletSession(Base):
+    __tablename__ = "toilet_session"
+    __table_args__ = (
+        Index("ix_toilet_session_toilet_id_started_at", "toilet_id", "started_at"),
+        {"extend_existing": True}
+    )
+
+    # 固有のID
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    # トイレID
+    toilet_id = Column(Integer, ForeignKey("toilet.id"), nullable=False)
+
+    # 入室日時 (ドアが閉められた日時)
+    started_at = Column(DateTime, nullable=False)
+
+    # 退室日時 (ドアが開いた日時)
+    ended_at = Column(DateTime, nullable=False)
+
+    # 使用秒数
+    duration_s = Column(Float, nullable=False)
@@ -1,18 +1,106 @@
 ###############################################################################
 #    トイレの在室ログを表すテーブルの定義
 ###############################################################################
+from datetime import datetime as dt, timedelta
 from model import Base
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index, select, asc, desc
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql.schema import Column
-from sqlalchemy.sql.sqltypes import Integer, Text, Boolean, DateTime
+from sqlalchemy.sql.sqltypes import Integer, BigInteger, Text, Boolean, DateTime
+
+# エポックミリ秒の起点 (タイムゾーン情報無しの日時をそのまま経過ミリ秒数に換算する)
+EPOCH = dt(1970, 1, 1)
+
+
+def to_epoch_milliseconds(value: dt) -> int:
+    """日時 (タイムゾーン情報無し) を1970年1月1日0時からの経過ミリ秒数に変換します。
+    タイムゾーンの変換は行わないため、毎時0分などの区切りは整数のまま割り算で求められます。ミリ秒未満は切り捨てます。
+
+    Arguments:
+        value {datetime} -- 日時
+
+    Returns:
+        int -- 経過ミリ秒数
+    """
+    return (value - EPOCH) // timedelta(milliseconds=1)
+
+
+def from_epoch_milliseconds(value: int) -> dt:
+    """1970年1月1日0時からの経過ミリ秒数を日時 (タイムゾーン情報無し) に変換します。
+
+    Arguments:
+        value {int} -- 経過ミリ秒数
+
+    Returns:
+        datetime -- 日時
+    """
+    return EPOCH + timedelta(milliseconds=value)
+
+
+def default_created_ms(context) -> int:
+    """レコード作成日時のエポックミリ秒の既定値として、同じ行のレコード作成日時から求めます。
+    """
+    created_time = context.get_current_parameters().get("created_time")
+    return to_epoch_milliseconds(created_time) if created_time is not None else None
+
+
+def get_toilet_group_ids(session) -> dict:
+    """トイレIDごとに紐付くトイレグループIDを返します。
+    複数のトイレグループに紐付いている場合は、最初に紐付けたものとします。
+    同じDB接続セッションの中では1回だけ読み込むため、まとめて登録する場合もトイレグループ紐付け用マスターへの問い合わせは1回で済みます。
+
+    Arguments:
+        session {Session} -- DB接続セッション
+
+    Returns:
+        dict -- トイレID -> トイレグループID
+    """
+    from model.toilet_group_map import ToiletGroupMap
+    toilet_group_ids = session.info.get("toilet_group_ids")
+    if toilet_group_ids is None:
+        # 紐付けた順の逆に読み込み、最初に紐付けたもので上書きする
+        toilet_group_ids = {}
+        for x in session \
+                .query(ToiletGroupMap.toilet_id, ToiletGroupMap.toilet_group_id) \
+                .order_by(desc(ToiletGroupMap.id)) \
+                .all():
+            toilet_group_ids[x.toilet_id] = x.toilet_group_id
+        session.info["toilet_group_ids"] = toilet_group_ids
+    return toilet_group_ids
+
+
+def default_toilet_group_id(context) -> int:
+    """トイレグループIDの既定値として、同じ行のトイレIDに紐付くトイレグループIDを求めます。
+    登録時に指定しなかった場合に限って1行ごとに問い合わせるため、ドアイベントの記録では get_toilet_group_ids() で求めて指定して下さい。
+    複数のトイレグループに紐付いている場合は、最初に紐付けたものとします。
+    """
+    from model.toilet_group_map import ToiletGroupMap
+    toilet_id = context.get_current_parameters().get("toilet_id")
+    return context.connection.execute(
+        select([ToiletGroupMap.toilet_group_id])
+        .where(ToiletGroupMap.toilet_id == toilet_id)
+        .order_by(asc(ToiletGroupMap.id))
+        .limit(1)
+    ).scalar()
 
 
 """トイレ入退室トランザクションテーブル
 """
 class ToiletStatus(Base):
     __tablename__ = "toilet_status"
-    __table_args__ = {"extend_existing": True}
+    __table_args__ = (
+        # 発生日時の範囲で絞り込み、発生日時の順に並べる集計用 (テーブルを参照せずに済むよう、集計に使う列をすべて含める)
+        Index("ix_toilet_status_created_time", "created_time", "toilet_id", "is_closed"),
+        # トイレごとに直前のイベントを求める、トイレごとに発生日時の順に走査する用
+        Index("ix_toilet_status_toilet_id_created_time", "toilet_id", "created_time", "is_closed"),
+        # レコード作成日時のエポックミリ秒の範囲で絞り込む集計用
+        Index("ix_toilet_status_created_ms", "created_ms", "toilet_id", "is_closed"),
+        # トイレグループごとに発生日時の範囲で絞り込む集計用
+        Index("ix_toilet_status_toilet_group_id_created_time", "toilet_group_id", "created_time", "is_closed"),
+        # トイレグループごとにエポックミリ秒の範囲で絞り込む集計用
+        Index("ix_toilet_status_toilet_group_id_created_ms", "toilet_group_id", "created_ms", "is_closed"),
+        {"extend_existing": True}
+    )
 
     # 固有のID
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -25,3 +113,12 @@ class ToiletStatus(Base):
 
     # レコード作成日時
     created_time = Column(DateTime, nullable=False)
+
+    # レコード作成日時 (1970年1月1日0時からの経過ミリ秒数)
+    # 文字列の比較と日時への変換を避けて範囲で絞り込むためのもので、登録時にレコード作成日時から自動で求める
+    created_ms = Column(BigInteger, nullable=True, default=default_created_ms)
+
+    # トイレグループID (トイレグループ紐付け用マスターの写し)
+    # 集計時にトイレグループ紐付け用マスターを参照せずに済ませるためのもので、登録時に指定しなかった場合はトイレIDから自動で求める
+    # 紐付けが変わった場合は、DB側のトリガーで過去のレコードも含めて付け替えるため、外部キーにはしない
+    toilet_group_id = Column(Integer, nullable=True, default=default_toilet_group_id)
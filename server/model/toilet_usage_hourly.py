@@ -0,0 +1,28 @@
+###############################################################################
+#    トイレの使用状況を1時間単位で集計したテーブルの定義
+###############################################################################
+from model import Base
+from sqlalchemy.sql.schema import Column
+from sqlalchemy.sql.sqltypes import Integer, Float, DateTime
+
+
+"""トイレ使用状況集計テーブル (1時間単位)
+"""
+class ToiletUsageHourly(Base):
+    __tablename__ = "toilet_usage_hourly"
+    __table_args__ = {"extend_existing": True}
+
+    # トイレID
+    toilet_id = Column(Integer, primary_key=True, autoincrement=False)
+
+    # 集計対象の時間帯の開始日時 (毎時0分0秒)
+    hour = Column(DateTime, primary_key=True)
+
+    # この時間帯にドアが閉められた回数
+    closed_count = Column(Integer, nullable=False)
+
+    # この時間帯にドアが閉まっていた秒数 (退室済みのものに限る)
+    occupied_seconds = Column(Float, nullable=False)
+
+    # レコード更新日時
+    modified_time = Column(DateTime, nullable=False)
@@ -0,0 +1,41 @@
+###############################################################################
+#    サーバー部のテストで共有するフィクスチャーを定義します。
+#    使い方: /server/ 直下で python3 -m pytest tests
+#    アプリケーションのモジュールは、一時ディレクトリー上に作成した SQLite データベースに接続した状態で読み込みます。
+###############################################################################
+import os
+import sys
+import pytest
+
+# 設定ファイルはカレントディレクトリーから読み込まれるため、どこから起動しても /server/ 直下で実行する
+SERVER_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIRECTORY)
+os.chdir(SERVER_DIRECTORY)
+
+
+@pytest.fixture(scope="session")
+def common():
+    """テスト用のデータベースを作成してマスターデータを流し込み、アプリケーションの共通モジュールを返します。
+    アプリケーションのモジュールはこのフィクスチャーよりも後に読み込んで下さい。
+
+    Returns:
+        module -- app.common
+    """
+    from benchmark.common import prepare_database, seed_master
+    prepare_database("test")
+
+    import app.common as Common
+    with Common.create_session() as session:
+        seed_master(session)
+    return Common
+
+
+@pytest.fixture(scope="session")
+def client(common):
+    """Flask のテストクライアントを返します。
+
+    Returns:
+        FlaskClient -- テストクライアント
+    """
+    from app.main import app
+    return app.test_client()
@@ -0,0 +1,44 @@
+###############################################################################
+#    ログ取得APIの集計結果のキャッシュが、後から記録されたイベントで無効になる範囲を検査します。
+###############################################################################
+from datetime import datetime as dt
+from datetime import timedelta
+
+### 定数定義
+# 検査に使うトイレID (他のテストと重ならない期間にイベントを流し込む)
+TARGET_TOILET_ID = 9
+
+
+def test_session_ended_next_day_invalidates_started_day(common):
+    """翌日に退室した場合、入室した日の集計結果は無効になり、それより前の日の集計結果は有効なままであること。
+    """
+    from sqlalchemy import func
+    from model.toilet_status import ToiletStatus
+    from app.logs.cache import LogResultCache
+    from app.logs.toilet_session import add_toilet_sessions
+
+    started_day = dt(2021, 3, 1)
+    with common.create_session() as session:
+        session.add(ToiletStatus(toilet_id=TARGET_TOILET_ID, is_closed=True, created_time=started_day + timedelta(hours=18, minutes=30)))
+
+    # 入室した日とその前日の集計結果をキャッシュする
+    cache = LogResultCache(10)
+    with common.create_session() as session:
+        computed_id = session.query(func.max(ToiletStatus.id)).scalar()
+    for day in [started_day - timedelta(days=1), started_day]:
+        cache.put(("test", day.date().isoformat()), {
+            "computed_id": computed_id,
+            "data_end": day + timedelta(days=1),
+            "frequencies": [],
+            "occupancies": []
+        })
+
+    # 翌日に退室する
+    with common.create_session() as session:
+        opened_status = ToiletStatus(toilet_id=TARGET_TOILET_ID, is_closed=False, created_time=started_day + timedelta(days=1, hours=9))
+        add_toilet_sessions(session, [opened_status])
+        session.add(opened_status)
+
+    with common.create_session() as session:
+        results = cache.get_days(session, [("test", x) for x in ["2021-02-28", "2021-03-01"]])
+    assert list(results.keys()) == [("test", "2021-02-28")]
@@ -0,0 +1,114 @@
+###############################################################################
+#    占有秒数を、サーバー版 (トイレ使用セッションテーブルの区間) と Lambda 版 (イベントの列の走査) で求めた結果が一致することを検査します。
+#    ドアが閉められたイベントが続く場合も、いずれも最初のものを入室とします。
+###############################################################################
+import importlib.util
+import os
+import random
+from datetime import datetime as dt
+from datetime import timedelta
+import pytest
+
+### 定数定義
+# Lambda 版の集計処理のファイル
+LAMBDA_AGGREGATE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "server-for-lambda", "functions", "aggregate.py"
+)
+# 検査に使うトイレID (他のテストと重ならない期間にイベントを流し込む)
+TARGET_TOILET_IDS = [2, 3, 4]
+# イベントを流し込む期間の開始日時
+EVENTS_BEGIN = dt(2020, 1, 6)
+
+
+@pytest.fixture(scope="module")
+def lambda_aggregate():
+    """Lambda 版の集計処理のモジュールを返します。
+
+    Returns:
+        module -- server-for-lambda/functions/aggregate.py
+    """
+    spec = importlib.util.spec_from_file_location("lambda_aggregate", LAMBDA_AGGREGATE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope="module")
+def events(common):
+    """ドアが閉められたイベントが続くものを含む入退室イベントを、ドアイベントの記録と同じ経路で1件ずつ記録して返します。
+
+    Returns:
+        list -- 記録した入退室イベント (発生日時の昇順)
+    """
+    from model.toilet_status import ToiletStatus
+    from app.logs.toilet_session import add_toilet_sessions
+
+    random.seed(7)
+    statuses = []
+    for toilet_id in TARGET_TOILET_IDS:
+        created_time = EVENTS_BEGIN
+        for i in range(300):
+            created_time += timedelta(minutes=random.randint(1, 50))
+            statuses.append(ToiletStatus(toilet_id=toilet_id, is_closed=random.random() < 0.6, created_time=created_time))
+    statuses.sort(key=lambda x: x.created_time)
+
+    for status in statuses:
+        with common.create_session() as session:
+            if not status.is_closed:
+                add_toilet_sessions(session, [status])
+            session.add(ToiletStatus(toilet_id=status.toilet_id, is_closed=status.is_closed, created_time=status.created_time))
+    return statuses
+
+
+@pytest.mark.parametrize("begin_offset_hours, end_offset_hours", [(25, 72), (25, 24 * 30)])
+def test_occupied_seconds_match(common, lambda_aggregate, events, begin_offset_hours, end_offset_hours):
+    """サーバー版と Lambda 版で、集計区間ごとの占有秒数が一致すること。
+    期間の終端を最後のイベントより後にした場合は、入室中のまま退室していないものも含めて比べます。
+    """
+    from model.toilet_session import ToiletSession
+    from app.logs.aggregate import sum_interval_seconds_per_bucket
+    from app.logs.rollup import get_session_started_time
+
+    begin_datetime = EVENTS_BEGIN + timedelta(hours=begin_offset_hours)
+    end_datetime = EVENTS_BEGIN + timedelta(hours=end_offset_hours)
+    bucket_begins = []
+    while len(bucket_begins) * 30 < (end_datetime - begin_datetime).total_seconds() // 60:
+        bucket_begins.append(begin_datetime + timedelta(minutes=30 * len(bucket_begins)))
+    bucket_ends = [x + timedelta(minutes=30) for x in bucket_begins]
+
+    # サーバー版: 区間と重なるトイレ使用セッションに、入室中のまま退室していないものを補う
+    with common.create_session() as session:
+        toilet_sessions = session \
+            .query(ToiletSession.started_at, ToiletSession.ended_at) \
+            .filter(
+                ToiletSession.toilet_id.in_(TARGET_TOILET_IDS),
+                ToiletSession.started_at < end_datetime,
+                begin_datetime < ToiletSession.ended_at
+            ) \
+            .all()
+        begin_times = [x.started_at for x in toilet_sessions]
+        end_times = [x.ended_at for x in toilet_sessions]
+        for toilet_id in TARGET_TOILET_IDS:
+            last_status = [x for x in events if x.toilet_id == toilet_id][-1]
+            if last_status.is_closed:
+                begin_times.append(get_session_started_time(session, toilet_id, last_status.created_time + timedelta(seconds=1)))
+                end_times.append(end_datetime)
+    server_seconds = sum_interval_seconds_per_bucket(begin_times, end_times, bucket_begins, bucket_ends)
+
+    # Lambda 版: 区間の開始時点で入室中だったトイレを起点に、区間内のイベントの列を走査する
+    initially_closed_toilet_ids = []
+    for toilet_id in TARGET_TOILET_IDS:
+        previous_statuses = [x for x in events if x.toilet_id == toilet_id and x.created_time < begin_datetime]
+        if previous_statuses and previous_statuses[-1].is_closed:
+            initially_closed_toilet_ids.append(toilet_id)
+    lambda_seconds = lambda_aggregate.sum_occupied_seconds_per_bucket(
+        [x for x in events if begin_datetime <= x.created_time < end_datetime],
+        initially_closed_toilet_ids,
+        begin_datetime,
+        bucket_begins,
+        bucket_ends
+    )
+
+    assert 0 < sum(server_seconds)
+    assert server_seconds == pytest.approx(lambda_seconds)
@@ -0,0 +1,123 @@
+###############################################################################
+#    ログ取得APIとドアステート切替APIがトイレ入退室トランザクションテーブルに発行するクエリーの実行計画を検査します。
+#    各集計元でAPIを呼び出して実際に発行されたクエリーを記録し、EXPLAIN QUERY PLAN でインデックスを使わずに全件を走査するものがあれば失敗とします。
+###############################################################################
+import random
+import re
+from datetime import datetime as dt
+from datetime import timedelta
+import pytest
+
+### 定数定義
+# 検査対象のテーブル
+TARGET_TABLE = "toilet_status"
+# インデックスを使わずに全件を走査することを表す実行計画 (SQLite 3.36 より前は "SCAN TABLE")
+FULL_SCAN_PATTERN = re.compile(rf"^SCAN (TABLE )?{TARGET_TABLE}\b(?!.*\bINDEX\b)")
+
+
+@pytest.fixture(scope="module")
+def recorded_statements(common, client):
+    """入退室トランザクションを流し込んでから各APIを呼び出し、検査対象のテーブルを参照したクエリーを記録して返します。
+
+    Returns:
+        dict -- クエリー -> 最初に発行された時のパラメーター
+    """
+    from sqlalchemy import event
+    from model.toilet import Toilet
+    from model.toilet_status import ToiletStatus
+    import app.door.api as Door
+    import app.logs.api as Logs
+
+    # 実行計画がテーブルの件数に左右されないことを確かめるため、ある程度の件数を流し込んでおく
+    random.seed(0)
+    now = dt.now()
+    with common.create_session() as session:
+        toilet_ids = [x.id for x in session.query(Toilet.id).order_by(Toilet.id).all()]
+        statuses = []
+        for toilet_id in toilet_ids:
+            created_time = now - timedelta(days=30)
+            is_closed = False
+            while created_time < now - timedelta(minutes=10):
+                is_closed = not is_closed
+                statuses.append({"toilet_id": toilet_id, "is_closed": is_closed, "created_time": created_time})
+                created_time += timedelta(minutes=random.randint(1, 120))
+        session.bulk_insert_mappings(ToiletStatus, statuses)
+
+    # 以降に発行されたクエリーのうち、検査対象のテーブルを参照するものを記録する
+    statements = []
+
+    def record_statement(connection, cursor, statement, parameters, context, executemany):
+        if TARGET_TABLE in statement and statement.lstrip().upper().startswith("SELECT") and not executemany:
+            statements.append((statement, parameters))
+
+    # ログ取得APIの読み取りは集計・分析用の接続で、集計テーブルの最新化とドアイベントの記録は既定の接続で行われる
+    engines = [common.engine_registry.get_engine(x) for x in [common.DEFAULT_ENGINE_NAME, common.ANALYTICS_ENGINE_NAME]]
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", record_statement)
+
+    settings = (Logs.USE_USAGE_ROLLUP, Logs.USE_EPOCH_TIMESTAMPS, Logs.log_result_cache.max_entries, Door.MIN_DOOR_EVENT_SPAN_SECONDS)
+    try:
+        # 集計テーブルへの反映はドアイベントの記録側で行われるため、ここで反映して反映時のクエリーも検査する
+        from app.logs.rollup import refresh_usage_rollups
+        with common.create_session() as session:
+            refresh_usage_rollups(session)
+
+        Logs.log_result_cache.max_entries = 0
+        begin_date = f"{now - timedelta(days=7):%Y%m%d}"
+        end_date = f"{now:%Y%m%d}"
+        urls = [
+            f"/logs/?begin_date={begin_date}&end_date={end_date}&step_minutes=30",
+            f"/logs/?begin_date={begin_date}&end_date={end_date}&step_hours=1",
+            f"/logs/?begin_date={begin_date}&end_date={end_date}&begin_hours_per_day=0&end_hours_per_day=24&step_hours=24",
+            "/logs/heatmap?weeks=4",
+        ]
+        # 入退室トランザクションテーブルを走査する場合は、レコード作成日時とエポックミリ秒のどちらで絞り込むかでクエリーが異なる
+        for use_rollup, use_epoch_timestamps in [(True, False), (False, False), (False, True)]:
+            Logs.USE_USAGE_ROLLUP = use_rollup
+            Logs.USE_EPOCH_TIMESTAMPS = use_epoch_timestamps
+            for url in urls:
+                response = client.get(url)
+                assert response.status_code == 200, url
+                assert response.get_json()["success"], f"{url} {response.get_json()['message']}"
+
+        # ドアが開いたイベントの記録で、直前の入室を求めるクエリーも検査する
+        # 閉めた直後に開けるため、最短呼出間隔の判定は外しておく
+        Door.MIN_DOOR_EVENT_SPAN_SECONDS = 0
+        for path in ["/door/close", "/door/open"]:
+            response = client.put(path, json={"toilet_id": toilet_ids[0]})
+            assert response.status_code == 200, path
+            assert response.get_json()["success"], f"{path} {response.get_json()['message']}"
+    finally:
+        Logs.USE_USAGE_ROLLUP, Logs.USE_EPOCH_TIMESTAMPS, Logs.log_result_cache.max_entries, Door.MIN_DOOR_EVENT_SPAN_SECONDS = settings
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", record_statement)
+
+    # 同じクエリーはパラメーターが異なっても実行計画が変わらないため、1回ずつ検査する
+    unique_statements = {}
+    for statement, parameters in statements:
+        unique_statements.setdefault(statement, parameters)
+    return unique_statements
+
+
+def test_queries_are_recorded(recorded_statements):
+    """ログの集計とドアイベントの記録のいずれでも、検査対象のクエリーが記録されていること。
+    """
+    assert any("ORDER BY toilet_status.created_time DESC" in x for x in recorded_statements), \
+        "ドアが開いたイベントの記録で、直前の入室を求めるクエリーが発行されていません"
+    assert any("toilet_status.toilet_group_id IN" in x for x in recorded_statements), \
+        "ログ取得APIで、入退室トランザクションテーブルを走査するクエリーが発行されていません"
+
+
+def test_no_full_scan(common, recorded_statements):
+    """インデックスを使わずに入退室トランザクションテーブルを全件走査するクエリーが無いこと。
+    """
+    full_scans = []
+    connection = common.engine_registry.get_engine().raw_connection()
+    try:
+        for statement, parameters in recorded_statements.items():
+            plan = [x[-1] for x in connection.cursor().execute(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()]
+            if any(FULL_SCAN_PATTERN.search(x) for x in plan):
+                full_scans.append(" ".join(statement.split()) + "\n    " + "\n    ".join(plan))
+    finally:
+        connection.close()
+    assert not full_scans, "\n".join(full_scans)
@@ -0,0 +1,40 @@
+###############################################################################
+#    現況のストリーム配信 (/stream) の配信枠が、配信を始めなかった要求で失われないことを検査します。
+###############################################################################
+
+
+def test_head_does_not_take_stream_slots(common, client):
+    """HEAD は拒否され、配信数の上限を超えて繰り返しても GET の配信を妨げないこと。
+    """
+    max_clients = common.get_setting("stream.max_clients", 4, type=int)
+    for i in range(max_clients + 1):
+        assert client.head("/stream").status_code == 405
+
+    response = client.get("/stream", buffered=False)
+    assert response.status_code == 200
+    response.close()
+
+
+def test_stream_slots_are_released_on_close(common, client):
+    """配信中の接続が上限に達すると 503 を返し、切断すると再び配信できること。
+    応答を返しただけで一度も反復されなかった配信は、配信枠を確保しないこと。
+    """
+    max_clients = common.get_setting("stream.max_clients", 4, type=int)
+    client.get("/stream", buffered=False).close()
+
+    responses = []
+    for i in range(max_clients):
+        response = client.get("/stream", buffered=False)
+        assert response.status_code == 200
+        # 最初のイベントを受け取った時点で配信枠を確保している
+        assert next(iter(response.response)).startswith(b"retry:")
+        responses.append(response)
+    assert client.get("/stream").status_code == 503
+
+    # 同じスレッドで開いた配信はリクエストコンテキストが積み重なっているため、開いた順とは逆に切断する
+    for response in reversed(responses):
+        response.close()
+    response = client.get("/stream", buffered=False)
+    assert response.status_code == 200
+    assert next(iter(response.response)).startswith(b"retry:")
+    response.close()